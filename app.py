@@ -1,24 +1,81 @@
-from flask import Flask, request, jsonify
+from flask import Flask, Response, request, jsonify, stream_with_context
 import os
+import hmac
+import json
+import time
 from datetime import timedelta
-from werkzeug.security import generate_password_hash, check_password_hash
 from flask_jwt_extended import JWTManager, create_access_token, jwt_required, get_jwt_identity
 
-from queue import get_queue
+import eventos
+import fila
+import metricas
+from fila import get_queue
+from despacho import obter_despachante, MAX_WAIT
+from senhas import gerar_hash, verificar_login, precisa_rehash
 from botocore.exceptions import BotoCoreError, ClientError
 from storage import (
+    USAR_TINYDB,
     iniciar_armazenamento,
     criar_entregador,
     obter_entregador_por_nome,
+    atualizar_hash_entregador,
     criar_entrega,
+    criar_entregas,
     listar_entregas,
+    iterar_entregas,
     atribuir_entrega,
     atualizar_status_entrega,
     obter_entrega,
     criar_tabelas,
+    EntregaJaAtribuida,
 )
 
 
+MAX_PAGE_SIZE = int(os.getenv('ORDERS_MAX_PAGE_SIZE', '1000'))
+MAX_DUPLICATAS_NEXT = 5
+MAX_LOTE_PEDIDOS = int(os.getenv('ORDERS_BATCH_MAX', '100'))
+MSG_CAMPOS_PEDIDO = 'restaurant, pickup_address e customer_address são obrigatórios'
+# outbox transacional: só com SQLAlchemy (a fila TinyDB já é uma escrita local)
+USAR_OUTBOX = not USAR_TINYDB and os.getenv('USE_OUTBOX', 'true').lower() == 'true'
+# token dos endpoints /admin (header X-Admin-Token); sem ele os endpoints respondem 403
+ADMIN_TOKEN = os.getenv('ADMIN_TOKEN')
+
+
+def _arg_inteiro(nome):
+    valor = request.args.get(nome)
+    return int(valor) if valor not in (None, '') else None
+
+
+def _campos_pedido(data):
+    """(restaurante, retirada, cliente) do corpo de um pedido, ou None se faltar algum."""
+    if not isinstance(data, dict):
+        return None
+    restaurant = data.get('restaurant') or data.get('restaurante')
+    pickup_address = data.get('pickup_address') or data.get('endereco_retirada')
+    customer_address = data.get('customer_address') or data.get('endereco_cliente')
+    if not restaurant or not pickup_address or not customer_address:
+        return None
+    return restaurant, pickup_address, customer_address
+
+
+def _admin_autorizado():
+    token = request.headers.get('X-Admin-Token') or ''
+    return bool(ADMIN_TOKEN) and hmac.compare_digest(token.encode(), ADMIN_TOKEN.encode())
+
+
+def _entrega_do_entregador(delivery_id, driver_id):
+    """A entrega, se estiver atribuída ao entregador; senão None.
+
+    Se a cópia do cache não pertence ao entregador, relê do banco: o cache local
+    pode não ter visto a atribuição feita por outro processo (worker).
+    """
+    for usar_cache in (True, False):
+        delivery = obter_entrega(delivery_id, usar_cache=usar_cache)
+        if delivery and int(delivery.get('id_entregador') or delivery.get('assigned_driver_id') or 0) == int(driver_id):
+            return delivery
+    return None
+
+
 def create_app():
     app = Flask(__name__)
     app.config['SQLALCHEMY_DATABASE_URI'] = os.getenv('DATABASE_URL', 'sqlite:///app.db')
@@ -28,12 +85,18 @@ def create_app():
     app.config['JWT_ACCESS_TOKEN_EXPIRES'] = timedelta(hours=8)
 
     iniciar_armazenamento(app)
+    fila.init_app(app)
+    metricas.init_app(app)
+    eventos.init_app(app)
     jwt = JWTManager(app)
 
-    @app.before_first_request
-    def init_db():
+    with app.app_context():
         criar_tabelas()
 
+    if USAR_OUTBOX and os.getenv('OUTBOX_RELAY', 'app') == 'app':
+        from outbox import RelayOutbox
+        app.extensions['outbox_relay'] = RelayOutbox(app).iniciar()
+
     @app.route('/health')
     def health():
         return jsonify({'status': 'ok'})
@@ -46,8 +109,10 @@ def create_app():
         password = data.get('password') or data.get('senha')
         if not name or not password:
             return jsonify({'msg': 'nome e senha são obrigatórios'}), 400
-        hashed = generate_password_hash(password)
+        hashed = gerar_hash(password)
         d = criar_entregador(name, phone, hashed)
+        if not d:
+            return jsonify({'msg': 'nome já cadastrado'}), 409
         return jsonify({'id': d['id'], 'nome': d['name']}), 201
 
     @app.route('/drivers/login', methods=['POST'])
@@ -58,34 +123,116 @@ def create_app():
         if not name or not password:
             return jsonify({'msg': 'nome e senha são obrigatórios'}), 400
         driver = obter_entregador_por_nome(name)
-        if not driver or not driver.get('password_hash') or not check_password_hash(driver.get('password_hash'), password):
+        if not driver or not driver.get('password_hash') or not verificar_login(name, password, driver.get('password_hash')):
             return jsonify({'msg': 'credenciais inválidas'}), 401
-        access_token = create_access_token(identity=driver.get('id'))
+        if precisa_rehash(driver.get('password_hash')):
+            # política de custo mudou: regravar o hash com o método atual
+            atualizar_hash_entregador(driver.get('id'), gerar_hash(password))
+        access_token = create_access_token(identity=str(driver.get('id')))
         return jsonify({'token_acesso': access_token}), 200
 
     @app.route('/orders', methods=['POST'])
     def create_order():
-        data = request.get_json() or {}
-        restaurant = data.get('restaurant') or data.get('restaurante')
-        pickup_address = data.get('pickup_address') or data.get('endereco_retirada')
-        customer_address = data.get('customer_address') or data.get('endereco_cliente')
-        if not restaurant or not pickup_address or not customer_address:
-            return jsonify({'msg': 'restaurant, pickup_address e customer_address são obrigatórios'}), 400
-        order = criar_entrega(restaurant, pickup_address, customer_address, status='enfileirado')
-        
+        campos = _campos_pedido(request.get_json() or {})
+        if campos is None:
+            return jsonify({'msg': MSG_CAMPOS_PEDIDO}), 400
+        order = criar_entrega(*campos, status='enfileirado', outbox=USAR_OUTBOX)
+        if USAR_OUTBOX:
+            # a mensagem foi gravada no outbox no mesmo commit; o relay publica no SQS
+            return jsonify({'id': order['id'], 'status': order['status']}), 201
+
         try:
             q = get_queue()
-            q.send_message(order['id'])
+            # os campos de dispatch vão no corpo: o consumidor não precisa reler a entrega
+            q.send_message(order)
         except Exception as e:
             return jsonify({'msg': 'falha ao enfileirar mensagem no SQS', 'erro': str(e)}), 500
         return jsonify({'id': order['id'], 'status': order['status']}), 201
 
+    @app.route('/orders/batch', methods=['POST'])
+    def create_orders_batch():
+        """Cria até MAX_LOTE_PEDIDOS pedidos com um insert e envios em lote à fila.
+
+        Aceita uma lista ou `{"pedidos": [...]}`. Responde 201 se todos os itens
+        deram certo e 207 caso contrário, com um resultado por item na ordem do
+        pedido: `{indice, id, status}` ou `{indice, erro}` (itens criados mas não
+        enfileirados trazem `id` e `erro`).
+        """
+        data = request.get_json()
+        pedidos = data.get('pedidos', data.get('orders')) if isinstance(data, dict) else data
+        if not isinstance(pedidos, list) or not pedidos:
+            return jsonify({'msg': 'envie uma lista de pedidos'}), 400
+        if len(pedidos) > MAX_LOTE_PEDIDOS:
+            return jsonify({'msg': 'no máximo %d pedidos por lote' % MAX_LOTE_PEDIDOS}), 413
+
+        resultados = []
+        validos = []
+        for i, pedido in enumerate(pedidos):
+            campos = _campos_pedido(pedido)
+            resultados.append({'indice': i} if campos else {'indice': i, 'erro': MSG_CAMPOS_PEDIDO})
+            if campos:
+                validos.append(campos)
+        criados = criar_entregas(validos, status='enfileirado', outbox=USAR_OUTBOX)
+        por_indice = iter(criados)
+        for r in resultados:
+            if 'erro' not in r:
+                order = next(por_indice)
+                r.update(id=order['id'], status=order['status'])
+
+        if criados and not USAR_OUTBOX:
+            try:
+                res = get_queue().send_messages(criados)
+                falhas = {f['id_entrega']: f.get('erro') for f in res.get('Failed', [])}
+            except Exception as e:
+                falhas = {o['id']: str(e) for o in criados}
+            for r in resultados:
+                if r.get('id') in falhas:
+                    r['erro'] = 'falha ao enfileirar mensagem: %s' % falhas[r['id']]
+
+        ok = all('erro' not in r for r in resultados)
+        return jsonify({'criados': len(criados), 'resultados': resultados}), 201 if ok else 207
+
     @app.route('/orders', methods=['GET'])
     def list_orders():
-        orders = listar_entregas()
-        out = orders
+        try:
+            limit = _arg_inteiro('limit')
+            after_id = _arg_inteiro('after_id')
+            id_entregador = _arg_inteiro('id_entregador')
+        except ValueError:
+            return jsonify({'msg': 'limit, after_id e id_entregador devem ser inteiros'}), 400
+        status = request.args.get('status')
         # resposta com campos em português já fornecida pela camada de storage
-        return jsonify(out), 200
+        if request.args.get('formato') == 'ndjson' or request.accept_mimetypes.best == 'application/x-ndjson':
+            def gerar():
+                for o in iterar_entregas(status=status, id_entregador=id_entregador):
+                    yield json.dumps(o, default=str) + '\n'
+            return Response(stream_with_context(gerar()), mimetype='application/x-ndjson')
+        if limit is None and after_id is None:
+            # sem paginação: formato antigo (lista completa)
+            return jsonify(listar_entregas(status=status, id_entregador=id_entregador)), 200
+        limit = max(1, min(limit or MAX_PAGE_SIZE, MAX_PAGE_SIZE))
+        orders = listar_entregas(limit, after_id, status, id_entregador)
+        proximo = orders[-1]['id'] if len(orders) == limit else None
+        return jsonify({'entregas': orders, 'proximo_after_id': proximo}), 200
+
+    @app.route('/orders/events', methods=['GET'])
+    def order_events():
+        """SSE das mudanças de status; retoma do header Last-Event-ID (ou ?last_event_id=)."""
+        try:
+            id_entrega = _arg_inteiro('id_entrega')
+            id_entregador = _arg_inteiro('id_entregador')
+            ultimo_id = request.headers.get('Last-Event-ID') or request.args.get('last_event_id')
+            ultimo_id = int(ultimo_id) if ultimo_id not in (None, '') else None
+            timeout = _arg_inteiro('timeout')
+        except ValueError:
+            return jsonify({'msg': 'id_entrega, id_entregador, last_event_id e timeout devem ser inteiros'}), 400
+        duracao = eventos.EVENTS_MAX_SECONDS if timeout is None else max(0, min(timeout, eventos.EVENTS_MAX_SECONDS))
+        gerador = eventos.fluxo_sse(ultimo_id, id_entrega, id_entregador, duracao)
+        return Response(
+            stream_with_context(gerador),
+            mimetype='text/event-stream',
+            headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'},
+        )
 
     @app.route('/driver/<int:driver_id>/next', methods=['GET'])
     @jwt_required()
@@ -94,21 +241,50 @@ def create_app():
         current = get_jwt_identity()
         if int(current) != int(driver_id):
             return jsonify({'msg': 'acesso proibido'}), 403
+        try:
+            wait = _arg_inteiro('wait') or 0
+        except ValueError:
+            return jsonify({'msg': 'wait deve ser inteiro'}), 400
+        wait = max(0, min(wait, MAX_WAIT))
         # receive message from SQS
         try:
             q = get_queue()
-            msg = q.receive_message()
         except Exception as e:
             return jsonify({'msg': 'falha ao receber do SQS', 'erro': str(e)}), 500
-        if not msg:
+        # long polling: a espera é feita no despachante compartilhado, sem receive próprio
+        prazo = time.monotonic() + wait
+        # duplicatas (entrega já atribuída por outro consumidor) e mensagens de entregas
+        # inexistentes são descartadas e a próxima é tentada
+        for _ in range(MAX_DUPLICATAS_NEXT):
+            try:
+                if wait:
+                    msg = obter_despachante().aguardar(max(0.0, prazo - time.monotonic()))
+                else:
+                    # só o id é necessário: a atribuição retorna a entrega atualizada
+                    msg = q.receive_message(hidratar='nunca')
+            except Exception as e:
+                return jsonify({'msg': 'falha ao receber do SQS', 'erro': str(e)}), 500
+            if not msg:
+                return jsonify({'msg': 'sem mensagens'}), 204
+            delivery = msg.get('entrega') or msg.get('delivery')
+            if not delivery:
+                return jsonify({'msg': 'mensagem inválida'}), 500
+            # atribuir ao entregador via storage
+            try:
+                assigned = atribuir_entrega(delivery.get('id'), driver_id)
+            except EntregaJaAtribuida:
+                q.delete_message(msg.get('ReceiptHandle'))
+                continue
+            if not assigned:
+                # entrega inexistente nunca será atribuída: ack, como no worker, e tenta a próxima
+                q.delete_message(msg.get('ReceiptHandle'))
+                continue
+            metricas.registrar_atribuicao('api', msg.get('enfileirado_em'))
+            # ack: sem o delete a mensagem volta a ficar visível após o visibility timeout
+            q.delete_message(msg.get('ReceiptHandle'))
+            break
+        else:
             return jsonify({'msg': 'sem mensagens'}), 204
-        delivery = msg.get('delivery')
-        if not delivery:
-            return jsonify({'msg': 'mensagem inválida'}), 500
-        # atribuir ao entregador via storage
-        assigned = atribuir_entrega(delivery.get('id'), driver_id)
-        if not assigned:
-            return jsonify({'msg': 'falha ao atribuir entrega'}), 500
         return jsonify({'id_entrega': assigned.get('id'), 'restaurante': assigned.get('restaurante'), 'endereco_retirada': assigned.get('endereco_retirada'), 'endereco_cliente': assigned.get('endereco_cliente'), 'status': assigned.get('status')}), 200
 
     @app.route('/driver/<int:driver_id>/pickup', methods=['POST'])
@@ -119,8 +295,7 @@ def create_app():
             return jsonify({'msg': 'acesso proibido'}), 403
         data = request.get_json() or {}
         delivery_id = data.get('delivery_id') or data.get('id_entrega')
-        delivery = obter_entrega(delivery_id)
-        if not delivery or int(delivery.get('assigned_driver_id') or 0) != int(driver_id):
+        if not _entrega_do_entregador(delivery_id, driver_id):
             return jsonify({'msg': 'entrega não encontrada ou não atribuída ao entregador'}), 404
         updated = atualizar_status_entrega(delivery_id, 'coletado')
         if not updated:
@@ -135,14 +310,47 @@ def create_app():
             return jsonify({'msg': 'acesso proibido'}), 403
         data = request.get_json() or {}
         delivery_id = data.get('delivery_id') or data.get('id_entrega')
-        delivery = obter_entrega(delivery_id)
-        if not delivery or int(delivery.get('assigned_driver_id') or 0) != int(driver_id):
+        if not _entrega_do_entregador(delivery_id, driver_id):
             return jsonify({'msg': 'entrega não encontrada ou não atribuída ao entregador'}), 404
         updated = atualizar_status_entrega(delivery_id, 'entregue')
         if not updated:
             return jsonify({'msg': 'falha ao atualizar status'}), 500
         return jsonify({'id': updated.get('id'), 'status': updated.get('status')}), 200
 
+    @app.route('/admin/dlq', methods=['GET'])
+    def admin_dlq():
+        if not _admin_autorizado():
+            return jsonify({'msg': 'acesso proibido'}), 403
+        try:
+            limit = max(1, min(_arg_inteiro('limit') or 100, MAX_PAGE_SIZE))
+        except ValueError:
+            return jsonify({'msg': 'limit deve ser inteiro'}), 400
+        try:
+            q = get_queue()
+            mensagens = q.list_dlq(limit)
+            total = q.estatisticas().get('dlq')
+        except (BotoCoreError, ClientError, RuntimeError) as e:
+            return jsonify({'msg': 'falha ao ler a DLQ', 'erro': str(e)}), 500
+        return jsonify({'mensagens': mensagens, 'total': total}), 200
+
+    @app.route('/admin/dlq/redrive', methods=['POST'])
+    def admin_dlq_redrive():
+        if not _admin_autorizado():
+            return jsonify({'msg': 'acesso proibido'}), 403
+        data = request.get_json(silent=True) or {}
+        ids = data.get('ids')
+        if ids is not None and not isinstance(ids, list):
+            return jsonify({'msg': 'ids deve ser uma lista'}), 400
+        try:
+            limite = max(1, min(int(data.get('limite') or data.get('limit') or 100), MAX_PAGE_SIZE))
+        except (TypeError, ValueError):
+            return jsonify({'msg': 'limite deve ser inteiro'}), 400
+        try:
+            reprocessadas = get_queue().redrive_dlq(ids, limite)
+        except (BotoCoreError, ClientError, RuntimeError) as e:
+            return jsonify({'msg': 'falha ao reprocessar a DLQ', 'erro': str(e)}), 500
+        return jsonify({'reprocessadas': reprocessadas, 'total': len(reprocessadas)}), 200
+
     return app
 
 
@@ -0,0 +1,68 @@
+"""Arquivamento das entregas concluídas (separação quente/fria).
+
+Entregas `entregue` sem mudança de status há mais de `ARCHIVE_RETENTION_DAYS`
+dias saem da tabela ativa (`entrega` / tabela `deliveries` do TinyDB) em lotes
+de `ARCHIVE_BATCH_SIZE`, via `storage.arquivar_entregas`: no SQLAlchemy vão
+para `entrega_arquivada`, no TinyDB para arquivos JSON Lines gzip ao lado do
+banco. Assim `GET /orders`, as varreduras do worker e as regravações do TinyDB
+ficam proporcionais ao trabalho em andamento, não ao histórico. As arquivadas
+continuam legíveis por `obter_entrega`.
+
+Uso: `python arquivamento.py` (uma passada, ex.: no cron) ou
+`python arquivamento.py --loop` (repete a cada `ARCHIVE_INTERVAL_SECONDS`).
+"""
+import argparse
+import logging
+import os
+import threading
+from datetime import datetime, timedelta
+
+from storage import arquivar_entregas, encerrar_sessao
+
+ARCHIVE_RETENTION_DAYS = float(os.getenv('ARCHIVE_RETENTION_DAYS', '30'))
+ARCHIVE_BATCH_SIZE = int(os.getenv('ARCHIVE_BATCH_SIZE', '500'))
+ARCHIVE_INTERVAL = float(os.getenv('ARCHIVE_INTERVAL_SECONDS', '3600'))
+
+logger = logging.getLogger('arquivamento')
+
+
+def arquivar(retencao_dias=ARCHIVE_RETENTION_DAYS, lote=ARCHIVE_BATCH_SIZE, agora=None, parar=None):
+    """Arquiva, lote a lote, tudo que passou da retenção. Retorna quantas entregas foram arquivadas."""
+    antes_de = (agora or datetime.utcnow()) - timedelta(days=retencao_dias)
+    total = 0
+    while parar is None or not parar.is_set():
+        try:
+            n = arquivar_entregas(antes_de, lote)
+        finally:
+            # um commit por lote: a sessão não acumula as linhas movidas
+            encerrar_sessao()
+        total += n
+        if n < lote:
+            break
+    return total
+
+
+if __name__ == '__main__':
+    import signal
+
+    logging.basicConfig(level=logging.INFO, format='[%(asctime)s] %(levelname)s: %(message)s')
+    parser = argparse.ArgumentParser(description='Arquiva entregas concluídas antigas')
+    parser.add_argument('--dias', type=float, default=ARCHIVE_RETENTION_DAYS, help='retenção em dias desde a última mudança de status')
+    parser.add_argument('--lote', type=int, default=ARCHIVE_BATCH_SIZE)
+    parser.add_argument('--loop', action='store_true', help='repetir a cada ARCHIVE_INTERVAL_SECONDS')
+    args = parser.parse_args()
+
+    os.environ['OUTBOX_RELAY'] = 'off'
+    from app import create_app
+
+    parar = threading.Event()
+    signal.signal(signal.SIGTERM, lambda *_: parar.set())
+    with create_app().app_context():
+        while True:
+            try:
+                n = arquivar(args.dias, args.lote, parar=parar)
+                logger.info('%s entregas arquivadas', n)
+            except Exception as e:
+                logger.exception('erro no arquivamento: %s', e)
+            if not args.loop or parar.wait(ARCHIVE_INTERVAL):
+                break
@@ -0,0 +1,55 @@
+"""Micro-benchmark do custo de `get_queue()` por requisição.
+
+Mede o tempo médio de obter o adaptador de fila (o que `/orders` e
+`/driver/<id>/next` fazem a cada chamada): construir um `SQSQueue` novo (um
+`boto3.client('sqs')` por chamada) versus o singleton do processo. Não acessa a
+rede: a criação do client é local.
+
+Uso: python benchmarks/fila_bench.py [--n 200]
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def medir(func, n):
+    func()  # aquecimento (imports, carga dos modelos do botocore)
+    inicio = time.perf_counter()
+    for _ in range(n):
+        func()
+    return (time.perf_counter() - inicio) / n * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--n', type=int, default=200)
+    args = parser.parse_args()
+
+    os.environ.setdefault('AWS_SQS_QUEUE_URL', 'https://sqs.us-east-1.amazonaws.com/000000000000/bench')
+    os.environ.setdefault('AWS_REGION', 'us-east-1')
+    os.environ.setdefault('AWS_ACCESS_KEY_ID', 'bench')
+    os.environ.setdefault('AWS_SECRET_ACCESS_KEY', 'bench')
+    os.environ['USE_TINYDB'] = 'false'
+
+    import boto3
+    import fila
+
+    def por_requisicao():
+        # o que get_queue() fazia antes: um SQSQueue e um boto3.client novos a cada chamada
+        return boto3.client('sqs', region_name=os.environ['AWS_REGION'])
+
+    resultados = {
+        'cliente_novo_por_chamada_us': medir(por_requisicao, args.n),
+        'singleton_us': medir(fila.get_queue, args.n),
+    }
+    resultados = {k: round(v, 2) for k, v in resultados.items()}
+    resultados['n'] = args.n
+    print(json.dumps(resultados))
+
+
+if __name__ == '__main__':
+    main()
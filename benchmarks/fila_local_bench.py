@@ -0,0 +1,106 @@
+"""Custo de receive+delete da fila local conforme o backlog, com um produtor concorrente.
+
+Para cada tamanho de backlog (`--backlogs`, mensagens já na fila) mede, neste
+processo, `receber_mensagem_td` + `deletar_mensagem_td` uma a uma enquanto um
+processo separado enfileira mensagens sem parar (`--taxa` por segundo, como a
+API em `POST /orders`). Cada escrita do produtor muda a versão da fila, então o
+consumidor atualiza o índice antes de quase todo receive.
+
+O custo por mensagem não deve crescer com o backlog: o índice é atualizado só
+com o que o produtor gravou no log e o lease grava só os documentos alterados.
+Imprime uma linha JSON por backlog e termina com código 1 se a mediana do
+maior backlog passar de `--max-razao` vezes a do menor.
+
+Uso: python benchmarks/fila_local_bench.py [--backlogs 1000,10000,50000] [--n 500] [--taxa 200] [--max-razao 3]
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, RAIZ)
+
+PRODUTOR = '''
+import sys, time
+sys.path.insert(0, %r)
+import tiny_store
+tiny_store.init_tinydb(sys.argv[1])
+intervalo = 1 / float(sys.argv[2])
+n = 0
+inicio = time.perf_counter()
+try:
+    while True:
+        tiny_store.enviar_mensagem_td(n + 1)
+        n += 1
+        time.sleep(max(0.0, inicio + n * intervalo - time.perf_counter()))
+except KeyboardInterrupt:
+    pass
+print(round(n / (time.perf_counter() - inicio), 1), flush=True)
+'''
+
+
+def percentil(valores, p):
+    valores = sorted(valores)
+    return valores[min(len(valores) - 1, int(len(valores) * p))] if valores else None
+
+
+def medir(backlog, n, taxa, max_segundos):
+    import tiny_store
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'tinydb.json')
+        tiny_store.fechar_tinydb()
+        tiny_store.init_tinydb(path)
+        tiny_store.enviar_mensagens_td(list(range(1, backlog + 1)))
+
+        produtor = subprocess.Popen([sys.executable, '-c', PRODUTOR % RAIZ, path, str(taxa)], stdout=subprocess.PIPE, text=True, env=os.environ)
+        time.sleep(0.5)
+        tempos = []
+        inicio = time.perf_counter()
+        while len(tempos) < n and time.perf_counter() - inicio < max_segundos:
+            t = time.perf_counter()
+            msg = tiny_store.receber_mensagem_td()
+            if msg is None:
+                break
+            tiny_store.deletar_mensagem_td(msg['ReceiptHandle'])
+            tempos.append(time.perf_counter() - t)
+        decorrido = time.perf_counter() - inicio
+        produtor.send_signal(2)
+        enviadas_s = float(produtor.communicate(timeout=60)[0].strip() or 0)
+        tiny_store.fechar_tinydb()
+    return {
+        'backlog': backlog,
+        'n': len(tempos),
+        'mensagens_s': round(len(tempos) / decorrido, 1) if decorrido else None,
+        'p50_ms': round(percentil(tempos, 0.5) * 1000, 2) if tempos else None,
+        'p99_ms': round(percentil(tempos, 0.99) * 1000, 2) if tempos else None,
+        'produtor_envios_s': enviadas_s,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--backlogs', default='1000,10000,50000')
+    parser.add_argument('--n', type=int, default=500)
+    parser.add_argument('--taxa', type=float, default=200)
+    parser.add_argument('--max-segundos', type=float, default=30)
+    parser.add_argument('--max-razao', type=float, default=3)
+    args = parser.parse_args()
+
+    resultados = []
+    for backlog in [int(b) for b in args.backlogs.split(',')]:
+        resultados.append(medir(backlog, args.n, args.taxa, args.max_segundos))
+        print(json.dumps(resultados[-1]), flush=True)
+
+    medianas = [r['p50_ms'] for r in resultados if r['p50_ms']]
+    if len(medianas) > 1 and medianas[-1] > args.max_razao * medianas[0]:
+        print('custo por mensagem cresce com o backlog: p50 %.2fms -> %.2fms' % (medianas[0], medianas[-1]), file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
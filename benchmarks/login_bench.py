@@ -0,0 +1,87 @@
+"""Benchmark de logins/s em `/drivers/login`.
+
+Compara hash na thread da requisição, hash no pool de processos e o cache de
+credenciais verificadas, com várias threads fazendo login ao mesmo tempo (como
+na troca de turno). Roda offline com SQLite num arquivo temporário.
+
+Uso: python benchmarks/login_bench.py [--threads 8] [--logins 200] [--metodo pbkdf2:sha256:600000]
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def medir(app, nomes, logins, threads):
+    por_thread = max(1, logins // threads)
+    erros = []
+
+    def rodar(i):
+        client = app.test_client()
+        for j in range(por_thread):
+            nome = nomes[(i * por_thread + j) % len(nomes)]
+            resp = client.post('/drivers/login', json={'nome': nome, 'senha': 'senha-' + nome})
+            if resp.status_code != 200:
+                erros.append(resp.status_code)
+
+    inicio = time.perf_counter()
+    ts = [threading.Thread(target=rodar, args=(i,)) for i in range(threads)]
+    for t in ts:
+        t.start()
+    for t in ts:
+        t.join()
+    duracao = time.perf_counter() - inicio
+    total = por_thread * threads
+    return {'logins': total, 'segundos': round(duracao, 3), 'logins_por_s': round(total / duracao, 1), 'erros': len(erros)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--threads', type=int, default=8)
+    parser.add_argument('--logins', type=int, default=200)
+    parser.add_argument('--entregadores', type=int, default=50)
+    parser.add_argument('--metodo', default=os.getenv('PASSWORD_HASH_METHOD', 'pbkdf2:sha256:600000'))
+    args = parser.parse_args()
+
+    tmp = tempfile.mkdtemp()
+    os.environ['USE_TINYDB'] = 'false'
+    os.environ['DATABASE_URL'] = 'sqlite:///' + os.path.join(tmp, 'app.db')
+    os.environ['PASSWORD_HASH_METHOD'] = args.metodo
+
+    import senhas
+    from app import create_app
+
+    app = create_app()
+    client = app.test_client()
+    nomes = ['entregador%d' % i for i in range(args.entregadores)]
+    for nome in nomes:
+        client.post('/drivers/register', json={'nome': nome, 'senha': 'senha-' + nome})
+
+    cenarios = [
+        ('hash na thread, sem cache', 0, 0),
+        ('pool de processos, sem cache', os.cpu_count() or 1, 0),
+        ('pool de processos, com cache', os.cpu_count() or 1, 300),
+    ]
+    resultados = []
+    for nome, workers, ttl in cenarios:
+        senhas.encerrar_pool()
+        senhas.limpar_cache()
+        senhas.HASH_WORKERS = workers
+        senhas.LOGIN_CACHE_TTL = ttl
+        if ttl:
+            # aquecimento: um login por entregador popula o cache
+            medir(app, nomes, len(nomes), 1)
+        res = medir(app, nomes, args.logins, args.threads)
+        res.update({'cenario': nome, 'hash_workers': workers, 'cache_ttl': ttl, 'threads': args.threads, 'metodo': args.metodo})
+        resultados.append(res)
+        print(json.dumps(res, ensure_ascii=False))
+    senhas.encerrar_pool()
+
+
+if __name__ == '__main__':
+    main()
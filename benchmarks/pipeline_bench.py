@@ -0,0 +1,385 @@
+"""Benchmark de carga da API + worker, offline e reproduzível.
+
+Cada cenário `backend:servidor[:perfil]` roda num subprocesso próprio (o
+backend é escolhido na importação de `storage`):
+
+- backend `tinydb` (fila TinyDB) ou `sqlite` (SQLAlchemy + outbox, com o SQS
+  em memória de `sqs_local.py`);
+- servidor `teste` (test client do Flask) ou `wsgi` (servidor WSGI com threads
+  do werkzeug, requisições HTTP de verdade);
+- perfil opcional do engine SQLAlchemy (`DB_ENGINE_PROFILE`: `producao`, o
+  padrão, ou `padrao`), para comparar WAL/PRAGMAs com os defaults.
+
+Fases: POST /orders e POST /orders/batch com `--threads` clientes; drenagem da
+fila por `worker.executar` (atribuições/s); escrita mista, com POST /orders
+enquanto o worker atribui (escritas/s); pickup/deliver pelos entregadores;
+/driver/<id>/next com o worker parado; GET /orders paginado. Para cada rota
+saem n, req/s, p50 e p99 (ms); também a memória (RSS) no início e no fim.
+
+Cada cenário imprime uma linha JSON; `--saida` grava a lista completa e
+`--base` compara com um resultado anterior (sai com código 1 se alguma vazão
+cair, ou algum p99 subir, mais que `--tolerancia`).
+
+Uso: python benchmarks/pipeline_bench.py [--cenarios tinydb:teste,sqlite:wsgi] [--pedidos 1000]
+     [--threads 8] [--worker-threads 4] [--saida resultado.json] [--base anterior.json]
+"""
+import argparse
+import http.client
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, RAIZ)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+CENARIOS = ('tinydb:teste', 'tinydb:wsgi', 'sqlite:teste', 'sqlite:wsgi', 'sqlite:wsgi:padrao')
+
+
+def rss_mb():
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 2 ** 20
+    except OSError:
+        return None
+
+
+def pico_rss_mb():
+    # ru_maxrss: KB no Linux, bytes no macOS
+    pico = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return pico / 2 ** 20 if sys.platform == 'darwin' else pico / 1024
+
+
+def percentil(ordenados, p):
+    if not ordenados:
+        return None
+    return ordenados[min(len(ordenados) - 1, int(round(p * (len(ordenados) - 1))))]
+
+
+class Medidor:
+    """Latências por rota (template) e contagem de respostas inesperadas."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.latencias = {}
+        self.duracoes = {}
+        self.erros = {}
+
+    def registrar(self, rota, segundos, ok):
+        with self._lock:
+            self.latencias.setdefault(rota, []).append(segundos)
+            if not ok:
+                self.erros[rota] = self.erros.get(rota, 0) + 1
+
+    def fase(self, rota, segundos):
+        with self._lock:
+            self.duracoes[rota] = self.duracoes.get(rota, 0.0) + segundos
+
+    def resumo(self):
+        out = {}
+        for rota, valores in sorted(self.latencias.items()):
+            valores = sorted(valores)
+            duracao = self.duracoes.get(rota)
+            out[rota] = {
+                'n': len(valores),
+                'req_s': round(len(valores) / duracao, 1) if duracao else None,
+                'p50_ms': round(percentil(valores, 0.50) * 1000, 3),
+                'p99_ms': round(percentil(valores, 0.99) * 1000, 3),
+                'erros': self.erros.get(rota, 0),
+            }
+        return out
+
+
+class ClienteTeste:
+    """Requisições pelo test client do Flask (um por thread)."""
+
+    def __init__(self, app):
+        self.app = app
+        self._local = threading.local()
+
+    def requisitar(self, metodo, caminho, corpo=None, token=None):
+        cliente = getattr(self._local, 'cliente', None)
+        if cliente is None:
+            cliente = self._local.cliente = self.app.test_client()
+        headers = {'Authorization': 'Bearer ' + token} if token else {}
+        resp = cliente.open(caminho, method=metodo, json=corpo, headers=headers)
+        return resp.status_code, resp.get_json(silent=True)
+
+
+class ClienteHTTP:
+    """Requisições HTTP/1.1 com keep-alive (uma conexão por thread)."""
+
+    def __init__(self, host, porta):
+        self.host = host
+        self.porta = porta
+        self._local = threading.local()
+
+    def requisitar(self, metodo, caminho, corpo=None, token=None):
+        headers = {'Content-Type': 'application/json'}
+        if token:
+            headers['Authorization'] = 'Bearer ' + token
+        dados = json.dumps(corpo) if corpo is not None else None
+        for tentativa in (0, 1):
+            conexao = getattr(self._local, 'conexao', None)
+            if conexao is None:
+                conexao = self._local.conexao = http.client.HTTPConnection(self.host, self.porta, timeout=30)
+            try:
+                conexao.request(metodo, caminho, body=dados, headers=headers)
+                resp = conexao.getresponse()
+                bruto = resp.read()
+                break
+            except (http.client.HTTPException, OSError):
+                # o servidor fechou a conexão ociosa: reconectar uma vez
+                conexao.close()
+                self._local.conexao = None
+                if tentativa:
+                    raise
+        try:
+            return resp.status, json.loads(bruto) if bruto else None
+        except ValueError:
+            return resp.status, None
+
+
+def em_paralelo(threads, tarefas, executar):
+    """Distribui `tarefas` entre `threads` threads. Retorna a duração em segundos."""
+    fatias = [tarefas[i::threads] for i in range(threads)]
+
+    def rodar(fatia):
+        for tarefa in fatia:
+            executar(tarefa)
+
+    inicio = time.perf_counter()
+    ts = [threading.Thread(target=rodar, args=(f,)) for f in fatias if f]
+    for t in ts:
+        t.start()
+    for t in ts:
+        t.join()
+    return time.perf_counter() - inicio
+
+
+def _configurar_ambiente(backend, tmp, perfil=None):
+    os.environ['USE_TINYDB'] = 'true' if backend == 'tinydb' else 'false'
+    if perfil:
+        os.environ['DB_ENGINE_PROFILE'] = perfil
+    os.environ['TINYDB_PATH'] = os.path.join(tmp, 'tinydb.json')
+    os.environ['DATABASE_URL'] = 'sqlite:///' + os.path.join(tmp, 'app.db')
+    # o modo json do TinyDB regrava o arquivo inteiro a cada escrita (ver tinydb_bench.py)
+    os.environ.setdefault('TINYDB_STORAGE', 'log')
+    os.environ.setdefault('PASSWORD_HASH_METHOD', 'pbkdf2:sha256:1000')
+    os.environ.setdefault('OUTBOX_POLL_INTERVAL', '0.05')
+    os.environ.setdefault('WORKER_POLL_INTERVAL', '0.05')
+    os.environ.setdefault('WORKER_REPORT_INTERVAL', '1')
+    # cursor do round-robin no banco: nada é gravado fora do diretório temporário
+    os.environ.setdefault('WORKER_STATE_BACKEND', 'banco')
+    os.environ['WORKER_METRICS_PORT'] = '0'
+    os.environ['OUTBOX_RELAY'] = 'app'
+
+
+def executar_cenario(cenario, args):
+    backend, servidor, perfil = (cenario.split(':') + [None])[:3]
+    tmp = tempfile.mkdtemp(prefix='pipeline_bench_')
+    _configurar_ambiente(backend, tmp, perfil)
+
+    import logging
+    import fila
+    import metricas
+    import storage
+    import worker
+    from app import create_app
+
+    for nome in ('', 'werkzeug'):
+        logging.getLogger(nome).setLevel(logging.INFO if args.log else logging.WARNING)
+    if backend == 'sqlite':
+        import sqs_local
+        fila._fila = sqs_local.criar_fila(latencia=args.latencia_sqs / 1000.0)
+
+    memoria_inicio = rss_mb()
+    app = create_app()
+    # o app do worker não sobe outro relay do outbox
+    os.environ['OUTBOX_RELAY'] = 'off'
+
+    servidor_wsgi = None
+    if servidor == 'wsgi':
+        from werkzeug.serving import make_server
+        servidor_wsgi = make_server('127.0.0.1', 0, app, threaded=True)
+        threading.Thread(target=servidor_wsgi.serve_forever, daemon=True).start()
+        cliente = ClienteHTTP('127.0.0.1', servidor_wsgi.server_port)
+    else:
+        cliente = ClienteTeste(app)
+
+    medidor = Medidor()
+
+    def chamar(rota, metodo, caminho, corpo=None, token=None, esperados=(200, 201)):
+        inicio = time.perf_counter()
+        status, resposta = cliente.requisitar(metodo, caminho, corpo, token)
+        medidor.registrar(rota, time.perf_counter() - inicio, status in esperados)
+        return status, resposta
+
+    # entregadores
+    entregadores = {}
+    for i in range(args.entregadores):
+        nome = 'bench-%d' % i
+        _, d = chamar('POST /drivers/register', 'POST', '/drivers/register', {'nome': nome, 'senha': 'x'})
+        _, t = chamar('POST /drivers/login', 'POST', '/drivers/login', {'nome': nome, 'senha': 'x'})
+        entregadores[d['id']] = t['token_acesso']
+
+    pedido = {'restaurante': 'R', 'endereco_retirada': 'A', 'endereco_cliente': 'B'}
+    resultado = {'cenario': cenario, 'backend': backend, 'servidor': servidor, 'pedidos': args.pedidos,
+                 'threads': args.threads, 'worker_threads': args.worker_threads}
+
+    if backend == 'sqlite':
+        resultado['perfil_engine'] = storage.PERFIL_ENGINE
+
+    # 1. criação de pedidos, um por requisição e em lote
+    d = em_paralelo(args.threads, list(range(args.pedidos)), lambda _: chamar('POST /orders', 'POST', '/orders', pedido))
+    medidor.fase('POST /orders', d)
+    resultado['pedidos_s'] = round(args.pedidos / d, 1)
+    lotes = [[pedido] * min(args.lote, args.pedidos - i) for i in range(0, args.pedidos, args.lote)]
+    d = em_paralelo(args.threads, lotes, lambda lote: chamar('POST /orders/batch', 'POST', '/orders/batch', lote))
+    medidor.fase('POST /orders/batch', d)
+    resultado['pedidos_lote_s'] = round(args.pedidos / d, 1)
+
+    # 2. drenagem da fila pelo worker
+    total = 2 * args.pedidos
+    antes = metricas.ATRIBUICOES.valor(origem='worker')
+    parar = threading.Event()
+    t_worker = threading.Thread(target=worker.executar, args=(args.worker_threads, parar), daemon=True)
+    inicio = time.perf_counter()
+    t_worker.start()
+    prazo = inicio + args.timeout
+    while metricas.ATRIBUICOES.valor(origem='worker') - antes < total and time.perf_counter() < prazo:
+        time.sleep(0.01)
+    d = time.perf_counter() - inicio
+    atribuidas = metricas.ATRIBUICOES.valor(origem='worker') - antes
+    resultado['atribuicoes'] = atribuidas
+    resultado['atribuicoes_s'] = round(atribuidas / d, 1)
+
+    # 3. escrita mista: API e worker gravando no banco ao mesmo tempo
+    antes = metricas.ATRIBUICOES.valor(origem='worker')
+    inicio = time.perf_counter()
+    d = em_paralelo(args.threads, list(range(args.pedidos)), lambda _: chamar('POST /orders (misto)', 'POST', '/orders', pedido))
+    medidor.fase('POST /orders (misto)', d)
+    prazo = time.perf_counter() + args.timeout
+    while metricas.ATRIBUICOES.valor(origem='worker') - antes < args.pedidos and time.perf_counter() < prazo:
+        time.sleep(0.01)
+    atribuidas = metricas.ATRIBUICOES.valor(origem='worker') - antes
+    resultado['escritas_mistas_s'] = round((args.pedidos + atribuidas) / (time.perf_counter() - inicio), 1)
+    parar.set()
+    t_worker.join(10)
+
+    # 4. entregadores coletam e entregam o que receberam
+    tarefas = []
+    for driver_id, token in entregadores.items():
+        _, pagina = chamar('GET /orders', 'GET', '/orders?status=atribuido&id_entregador=%d&limit=1000' % driver_id)
+        tarefas.extend((driver_id, token, o['id']) for o in (pagina or {}).get('entregas', []))
+    tarefas = tarefas[:args.entregas]
+
+    def coletar_e_entregar(tarefa):
+        driver_id, token, delivery_id = tarefa
+        chamar('POST /driver/<id>/pickup', 'POST', '/driver/%d/pickup' % driver_id, {'id_entrega': delivery_id}, token)
+        chamar('POST /driver/<id>/deliver', 'POST', '/driver/%d/deliver' % driver_id, {'id_entrega': delivery_id}, token)
+
+    d = em_paralelo(args.threads, tarefas, coletar_e_entregar)
+    medidor.fase('POST /driver/<id>/pickup', d / 2)
+    medidor.fase('POST /driver/<id>/deliver', d / 2)
+
+    # 5. /next com o worker parado: os entregadores puxam da fila diretamente
+    for i in range(0, args.entregas, args.lote):
+        cliente.requisitar('POST', '/orders/batch', [pedido] * min(args.lote, args.entregas - i))
+    time.sleep(0.2)  # relay do outbox
+    tokens = list(entregadores.items())
+    d = em_paralelo(args.threads, [tokens[i % len(tokens)] for i in range(args.entregas)],
+                    lambda dt: chamar('GET /driver/<id>/next', 'GET', '/driver/%d/next' % dt[0], token=dt[1], esperados=(200, 204)))
+    medidor.fase('GET /driver/<id>/next', d)
+
+    # 6. listagem paginada
+    d = em_paralelo(args.threads, list(range(args.entregas)), lambda _: chamar('GET /orders', 'GET', '/orders?limit=50'))
+    medidor.fase('GET /orders', d)
+
+    if servidor_wsgi is not None:
+        servidor_wsgi.shutdown()
+    resultado['endpoints'] = medidor.resumo()
+    resultado['memoria_mb'] = {
+        'inicio': round(memoria_inicio, 1) if memoria_inicio else None,
+        'fim': round(rss_mb(), 1) if rss_mb() else None,
+        'pico': round(pico_rss_mb(), 1),
+    }
+    if memoria_inicio:
+        resultado['memoria_mb']['crescimento'] = round(resultado['memoria_mb']['fim'] - memoria_inicio, 1)
+    resultado['erros'] = sum(e['erros'] for e in resultado['endpoints'].values())
+    return resultado
+
+
+def regressoes(atual, base, tolerancia):
+    """Vazões que caíram, ou p99 que subiram, mais que `tolerancia` em relação a `base`."""
+    por_cenario = {r['cenario']: r for r in base}
+    out = []
+    for r in atual:
+        b = por_cenario.get(r['cenario'])
+        if not b:
+            continue
+        for campo in ('pedidos_s', 'pedidos_lote_s', 'atribuicoes_s', 'escritas_mistas_s'):
+            if b.get(campo) and r.get(campo) is not None and r[campo] < b[campo] * (1 - tolerancia):
+                out.append('%s %s: %s -> %s' % (r['cenario'], campo, b[campo], r[campo]))
+        for rota, e in r.get('endpoints', {}).items():
+            eb = b.get('endpoints', {}).get(rota)
+            if eb and eb.get('p99_ms') and e['p99_ms'] > eb['p99_ms'] * (1 + tolerancia):
+                out.append('%s %s p99_ms: %s -> %s' % (r['cenario'], rota, eb['p99_ms'], e['p99_ms']))
+    return out
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--cenarios', default=','.join(CENARIOS))
+    parser.add_argument('--pedidos', type=int, default=1000, help='pedidos por fase de criação')
+    parser.add_argument('--lote', type=int, default=50, help='pedidos por POST /orders/batch')
+    parser.add_argument('--entregas', type=int, default=300, help='pickups/delivers e chamadas a /next')
+    parser.add_argument('--entregadores', type=int, default=20)
+    parser.add_argument('--threads', type=int, default=8, help='clientes simultâneos')
+    parser.add_argument('--worker-threads', type=int, default=4)
+    parser.add_argument('--latencia-sqs', type=float, default=0.0, help='ms por chamada ao SQS em memória')
+    parser.add_argument('--timeout', type=float, default=120, help='limite da drenagem da fila (s)')
+    parser.add_argument('--log', action='store_true', help='mantém os logs INFO do worker')
+    parser.add_argument('--saida', help='grava os resultados (lista JSON) neste arquivo')
+    parser.add_argument('--base', help='resultado anterior para comparação')
+    parser.add_argument('--tolerancia', type=float, default=0.2)
+    parser.add_argument('--cenario', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.cenario:
+        print(json.dumps(executar_cenario(args.cenario, args)))
+        return 0
+
+    resultados = []
+    repassar = sys.argv[1:]
+    for cenario in args.cenarios.split(','):
+        proc = subprocess.run([sys.executable, os.path.abspath(__file__), '--cenario', cenario] + repassar,
+                              stdout=subprocess.PIPE, cwd=RAIZ, text=True)
+        linhas = [l for l in proc.stdout.splitlines() if l.startswith('{')]
+        if proc.returncode or not linhas:
+            resultado = {'cenario': cenario, 'falhou': True, 'codigo': proc.returncode}
+        else:
+            resultado = json.loads(linhas[-1])
+        print(json.dumps(resultado), flush=True)
+        resultados.append(resultado)
+
+    if args.saida:
+        with open(args.saida, 'w', encoding='utf-8') as f:
+            json.dump(resultados, f, indent=2)
+    codigo = 1 if any(r.get('falhou') for r in resultados) else 0
+    if args.base:
+        with open(args.base, encoding='utf-8') as f:
+            piores = regressoes(resultados, json.load(f), args.tolerancia)
+        for linha in piores:
+            print('REGRESSÃO ' + linha, file=sys.stderr)
+        codigo = codigo or (1 if piores else 0)
+    return codigo
+
+
+if __name__ == '__main__':
+    sys.exit(main())
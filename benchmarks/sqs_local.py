@@ -0,0 +1,187 @@
+"""SQS em memória para benchmarks offline (sem moto nem rede).
+
+Implementa as chamadas do client boto3 usadas por `fila.SQSQueue`
+(`send_message[_batch]`, `receive_message` com long polling,
+`delete_message[_batch]`, `change_message_visibility[_batch]`,
+`get_queue_attributes`), com visibility timeout e `DelaySeconds`. Cada
+`QueueUrl` é uma fila separada (a DLQ é só outra URL).
+
+    fila._fila = sqs_local.criar_fila()
+"""
+import heapq
+import itertools
+import os
+import sys
+import threading
+import time
+import uuid
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+class _Fila:
+
+    def __init__(self, seq):
+        self._seq = seq
+        # (visível_em, seq, id) com invalidação preguiçosa; _msgs[id] guarda o estado atual
+        self._heap = []
+        self._msgs = {}
+        self._recibos = {}
+
+    def _agendar(self, msg_id, visivel_em):
+        msg = self._msgs[msg_id]
+        msg['visivel_em'] = visivel_em
+        msg['seq'] = next(self._seq)
+        heapq.heappush(self._heap, (visivel_em, msg['seq'], msg_id))
+
+    def enviar(self, corpo, atraso=0):
+        msg_id = str(uuid.uuid4())
+        self._msgs[msg_id] = {'Body': corpo, 'recebimentos': 0, 'recibo': None}
+        self._agendar(msg_id, time.monotonic() + (atraso or 0))
+        return msg_id
+
+    def retirar(self, n, visibilidade):
+        agora = time.monotonic()
+        out = []
+        while self._heap and len(out) < n:
+            visivel_em, seq, msg_id = self._heap[0]
+            msg = self._msgs.get(msg_id)
+            if msg is None or msg['seq'] != seq:
+                heapq.heappop(self._heap)
+                continue
+            if visivel_em > agora:
+                break
+            heapq.heappop(self._heap)
+            if msg['recibo']:
+                self._recibos.pop(msg['recibo'], None)
+            msg['recibo'] = recibo = '%s#%d' % (msg_id, msg['recebimentos'])
+            msg['recebimentos'] += 1
+            self._recibos[recibo] = msg_id
+            self._agendar(msg_id, agora + visibilidade)
+            out.append({
+                'MessageId': msg_id,
+                'ReceiptHandle': recibo,
+                'Body': msg['Body'],
+                'Attributes': {'ApproximateReceiveCount': str(msg['recebimentos'])},
+            })
+        return out
+
+    def apagar(self, recibo):
+        msg_id = self._recibos.pop(recibo, None)
+        if msg_id is not None:
+            self._msgs.pop(msg_id, None)
+
+    def mudar_visibilidade(self, recibo, segundos):
+        msg_id = self._recibos.get(recibo)
+        if msg_id is not None:
+            self._agendar(msg_id, time.monotonic() + segundos)
+        return msg_id is not None
+
+
+class ClienteSQSLocal:
+
+    def __init__(self, visibility_timeout=30.0, latencia=0.0):
+        self.visibility_timeout = visibility_timeout
+        # atraso artificial por chamada, para simular a ida e volta de rede
+        self.latencia = latencia
+        self._cond = threading.Condition()
+        self._seq = itertools.count()
+        self._filas = {}
+
+    def _rede(self):
+        if self.latencia:
+            time.sleep(self.latencia)
+
+    def _fila(self, url):
+        fila = self._filas.get(url)
+        if fila is None:
+            fila = self._filas[url] = _Fila(self._seq)
+        return fila
+
+    def send_message(self, QueueUrl, MessageBody, DelaySeconds=0, **kwargs):
+        self._rede()
+        with self._cond:
+            msg_id = self._fila(QueueUrl).enviar(MessageBody, DelaySeconds)
+            self._cond.notify_all()
+        return {'MessageId': msg_id}
+
+    def send_message_batch(self, QueueUrl, Entries):
+        self._rede()
+        with self._cond:
+            fila = self._fila(QueueUrl)
+            ok = [{'Id': e['Id'], 'MessageId': fila.enviar(e['MessageBody'], e.get('DelaySeconds', 0))} for e in Entries]
+            self._cond.notify_all()
+        return {'Successful': ok, 'Failed': []}
+
+    def receive_message(self, QueueUrl, MaxNumberOfMessages=1, WaitTimeSeconds=0, VisibilityTimeout=None, **kwargs):
+        self._rede()
+        visibilidade = self.visibility_timeout if VisibilityTimeout is None else VisibilityTimeout
+        prazo = time.monotonic() + (WaitTimeSeconds or 0)
+        with self._cond:
+            fila = self._fila(QueueUrl)
+            while True:
+                msgs = fila.retirar(MaxNumberOfMessages, visibilidade)
+                restante = prazo - time.monotonic()
+                if msgs or restante <= 0:
+                    return {'Messages': msgs} if msgs else {}
+                proxima = fila._heap[0][0] - time.monotonic() if fila._heap else restante
+                self._cond.wait(max(0.001, min(restante, proxima)))
+
+    def delete_message(self, QueueUrl, ReceiptHandle):
+        self._rede()
+        with self._cond:
+            self._fila(QueueUrl).apagar(ReceiptHandle)
+        return {}
+
+    def delete_message_batch(self, QueueUrl, Entries):
+        self._rede()
+        with self._cond:
+            fila = self._fila(QueueUrl)
+            for e in Entries:
+                fila.apagar(e['ReceiptHandle'])
+        return {'Successful': [{'Id': e['Id']} for e in Entries], 'Failed': []}
+
+    def change_message_visibility(self, QueueUrl, ReceiptHandle, VisibilityTimeout):
+        self._rede()
+        with self._cond:
+            self._fila(QueueUrl).mudar_visibilidade(ReceiptHandle, VisibilityTimeout)
+            self._cond.notify_all()
+        return {}
+
+    def change_message_visibility_batch(self, QueueUrl, Entries):
+        self._rede()
+        ok, falhas = [], []
+        with self._cond:
+            fila = self._fila(QueueUrl)
+            for e in Entries:
+                if fila.mudar_visibilidade(e['ReceiptHandle'], e['VisibilityTimeout']):
+                    ok.append({'Id': e['Id']})
+                else:
+                    falhas.append({'Id': e['Id'], 'Code': 'ReceiptHandleIsInvalid', 'SenderFault': True})
+            self._cond.notify_all()
+        return {'Successful': ok, 'Failed': falhas}
+
+    def get_queue_attributes(self, QueueUrl, AttributeNames=None):
+        agora = time.monotonic()
+        with self._cond:
+            fila = self._fila(QueueUrl)
+            visiveis = sum(1 for m in fila._msgs.values() if m['visivel_em'] <= agora)
+            total = len(fila._msgs)
+        return {'Attributes': {
+            'ApproximateNumberOfMessages': str(visiveis),
+            'ApproximateNumberOfMessagesNotVisible': str(total - visiveis),
+        }}
+
+    def close(self):
+        pass
+
+
+def criar_fila(visibility_timeout=30.0, latencia=0.0, url='http://sqs.local/fila', dlq_url=None):
+    """Um `fila.SQSQueue` cujo client é um `ClienteSQSLocal`."""
+    from fila import SQSQueue
+    q = SQSQueue.__new__(SQSQueue)
+    q.queue_url = url
+    q.dlq_url = dlq_url
+    q.region = None
+    q.client = ClienteSQSLocal(visibility_timeout, latencia)
+    return q
@@ -0,0 +1,68 @@
+"""Inserções/s do TinyDB por modo de persistência e tamanho do banco.
+
+Para cada tamanho (`--tamanhos`, padrão 10k, 100k e 1M documentos) grava um
+snapshot com a tabela `deliveries` já preenchida, abre o banco em cada modo
+(`json`, `cache`, `log`, ver `tiny_armazenamento.py`) e mede `--n` inserções
+de entregas, uma por chamada, como faz `criar_entrega_td` (parando antes se
+passar de `--max-segundos`). O tempo das inserções inclui gravar em disco o que
+ficou pendente (flush); o `close`, que no modo `log` compacta o snapshot
+inteiro, é medido à parte. Imprime uma linha JSON por modo e tamanho.
+
+Uso: python benchmarks/tinydb_bench.py [--tamanhos 10000,100000,1000000] [--n 200] [--max-segundos 30] [--modos json,cache,log]
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from tiny_armazenamento import abrir_tinydb  # noqa: E402
+
+DOC = {'restaurante': 'R', 'endereco_retirada': 'Rua A, 1', 'endereco_cliente': 'Rua B, 2', 'status': 'enfileirado', 'id_entregador': None, 'created_at': '2024-01-01T00:00:00'}
+
+
+def preparar(path, tamanho):
+    with open(path, 'w') as f:
+        json.dump({'deliveries': {str(i): DOC for i in range(1, tamanho + 1)}}, f)
+
+
+def medir(path, modo, n, max_segundos):
+    db = abrir_tinydb(path, modo)
+    deliveries = db.table('deliveries')
+    deliveries.insert(dict(DOC))  # aquecimento: carga do arquivo e do próximo id
+    inicio = time.perf_counter()
+    feitas = 0
+    while feitas < n and time.perf_counter() - inicio < max_segundos:
+        deliveries.insert(dict(DOC))
+        feitas += 1
+    flush = getattr(db.storage, 'flush', None)
+    if flush:
+        flush()
+    decorrido = time.perf_counter() - inicio
+    inicio_close = time.perf_counter()
+    db.close()
+    return {'n': feitas, 'insercoes_s': round(feitas / decorrido, 1), 'close_s': round(time.perf_counter() - inicio_close, 3)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--tamanhos', default='10000,100000,1000000')
+    parser.add_argument('--n', type=int, default=200)
+    parser.add_argument('--max-segundos', type=float, default=30)
+    parser.add_argument('--modos', default='json,cache,log')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        for tamanho in (int(t) for t in args.tamanhos.split(',')):
+            for modo in args.modos.split(','):
+                path = os.path.join(tmp, '%s-%d.json' % (modo, tamanho))
+                preparar(path, tamanho)
+                res = medir(path, modo, args.n, args.max_segundos)
+                print(json.dumps(dict({'modo': modo, 'documentos': tamanho}, **res)), flush=True)
+
+
+if __name__ == '__main__':
+    main()
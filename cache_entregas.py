@@ -0,0 +1,162 @@
+"""Cache de leitura das entregas usado por `storage.obter_entrega`.
+
+Por padrão é um LRU em memória com TTL (`DELIVERY_CACHE_MAX` itens,
+`DELIVERY_CACHE_TTL` segundos; `DELIVERY_CACHE_MAX=0` desliga). Com
+`DELIVERY_CACHE_REDIS_URL` as entradas ficam no Redis e são compartilhadas
+entre a API e os workers, de modo que a invalidação feita por um processo vale
+para todos. No cache local, uma escrita feita por outro processo só aparece
+depois do TTL.
+
+`atribuir_entrega` e `atualizar_status_entrega` invalidam a entrada alterada.
+Falhas do Redis contam como miss e nunca impedem a leitura do banco.
+"""
+import json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+
+CACHE_MAX = int(os.getenv('DELIVERY_CACHE_MAX', '10000'))
+CACHE_TTL = float(os.getenv('DELIVERY_CACHE_TTL', '30'))
+CACHE_REDIS_URL = os.getenv('DELIVERY_CACHE_REDIS_URL', '')
+
+logger = logging.getLogger('cache_entregas')
+
+
+class CacheLocal:
+    """LRU limitado a `max_itens`, com expiração de `ttl` segundos."""
+
+    def __init__(self, max_itens=CACHE_MAX, ttl=CACHE_TTL):
+        self.max_itens = max_itens
+        self.ttl = ttl
+        self._itens = OrderedDict()
+        self._lock = threading.Lock()
+
+    def obter(self, chave):
+        agora = time.monotonic()
+        with self._lock:
+            item = self._itens.get(chave)
+            if item is None:
+                return None
+            expira_em, valor = item
+            if expira_em <= agora:
+                del self._itens[chave]
+                return None
+            self._itens.move_to_end(chave)
+            return valor
+
+    def gravar(self, chave, valor):
+        with self._lock:
+            self._itens[chave] = (time.monotonic() + self.ttl, valor)
+            self._itens.move_to_end(chave)
+            while len(self._itens) > self.max_itens:
+                self._itens.popitem(last=False)
+
+    def invalidar(self, chave):
+        with self._lock:
+            self._itens.pop(chave, None)
+
+    def limpar(self):
+        with self._lock:
+            self._itens.clear()
+
+    def tamanho(self):
+        return len(self._itens)
+
+
+class CacheRedis:
+    """Entradas em JSON no Redis (`SET ... EX`), compartilhadas entre processos."""
+
+    def __init__(self, cliente, ttl=CACHE_TTL, prefixo='entrega:'):
+        self.cliente = cliente
+        self.ttl = ttl
+        self.prefixo = prefixo
+
+    def obter(self, chave):
+        bruto = self.cliente.get(self.prefixo + str(chave))
+        return json.loads(bruto) if bruto is not None else None
+
+    def gravar(self, chave, valor):
+        self.cliente.set(self.prefixo + str(chave), json.dumps(valor, default=str), ex=max(1, int(self.ttl)))
+
+    def invalidar(self, chave):
+        self.cliente.delete(self.prefixo + str(chave))
+
+    def limpar(self):
+        chaves = list(self.cliente.scan_iter(match=self.prefixo + '*'))
+        if chaves:
+            self.cliente.delete(*chaves)
+
+    def tamanho(self):
+        return None
+
+
+class CacheEntregas:
+    """Read-through com contadores de hits/misses sobre um dos caches acima."""
+
+    def __init__(self, backend):
+        self.backend = backend
+        self.hits = 0
+        self.misses = 0
+        self.erros = 0
+        self._lock = threading.Lock()
+
+    def _contar(self, campo):
+        with self._lock:
+            setattr(self, campo, getattr(self, campo) + 1)
+
+    def obter(self, delivery_id, carregar):
+        """Retorna a entrega do cache ou `carregar(delivery_id)`, guardando o resultado."""
+        try:
+            chave = int(delivery_id)
+        except (TypeError, ValueError):
+            return carregar(delivery_id)
+        try:
+            valor = self.backend.obter(chave)
+        except Exception as e:
+            self._contar('erros')
+            logger.warning('falha ao ler o cache de entregas: %s', e)
+            valor = None
+        if valor is not None:
+            self._contar('hits')
+            return dict(valor)
+        self._contar('misses')
+        valor = carregar(delivery_id)
+        if valor is not None:
+            try:
+                self.backend.gravar(chave, dict(valor))
+            except Exception as e:
+                self._contar('erros')
+                logger.warning('falha ao gravar no cache de entregas: %s', e)
+        return valor
+
+    def invalidar(self, delivery_id):
+        try:
+            self.backend.invalidar(int(delivery_id))
+        except (TypeError, ValueError):
+            pass
+        except Exception as e:
+            self._contar('erros')
+            logger.warning('falha ao invalidar o cache de entregas: %s', e)
+
+    def limpar(self):
+        try:
+            self.backend.limpar()
+        except Exception as e:
+            logger.warning('falha ao limpar o cache de entregas: %s', e)
+        with self._lock:
+            self.hits = self.misses = self.erros = 0
+
+    def estatisticas(self):
+        return {'hits': self.hits, 'misses': self.misses, 'erros': self.erros, 'tamanho': self.backend.tamanho()}
+
+
+def criar_cache():
+    """Cache configurado pelas variáveis de ambiente, ou None se desligado."""
+    if CACHE_MAX <= 0:
+        return None
+    if CACHE_REDIS_URL:
+        import redis
+        return CacheEntregas(CacheRedis(redis.Redis.from_url(CACHE_REDIS_URL, socket_timeout=0.5), CACHE_TTL))
+    return CacheEntregas(CacheLocal(CACHE_MAX, CACHE_TTL))
@@ -0,0 +1,128 @@
+"""Despachante compartilhado para o long polling de `/driver/<id>/next?wait=N`.
+
+Em vez de cada entregador ocioso fazer o próprio receive no SQS/TinyDB, as
+requisições se registram numa lista de espera e um único poller por processo
+busca mensagens só quando há alguém esperando (no máximo uma por espera, em
+lotes de até 10) e as entrega em ordem de chegada.
+
+Cada requisição em espera ainda ocupa uma thread do servidor WSGI; para
+milhares de conexões ociosas rode a API com workers gevent/eventlet, onde essas
+esperas viram greenlets baratos. O que deixa de existir é a chamada ao SQS por
+entregador.
+"""
+import atexit
+import logging
+import os
+import threading
+import time
+from collections import deque
+
+from fila import get_queue, SQS_MAX_LOTE
+
+MAX_WAIT = 20
+# espera do receive do poller no SQS (long polling do lado do SQS)
+DESPACHO_SQS_WAIT = int(os.getenv('DISPATCH_SQS_WAIT_SECONDS', '5'))
+# intervalo entre receives vazios na fila TinyDB, que retorna na hora
+DESPACHO_INTERVALO = float(os.getenv('DISPATCH_POLL_INTERVAL', '0.2'))
+# mensagem recebida sem ninguém esperando é descartada localmente depois disso
+# (o lease expira e ela volta para a fila)
+DESPACHO_BUFFER_TTL = float(os.getenv('DISPATCH_BUFFER_TTL', '10'))
+
+logger = logging.getLogger('despacho')
+
+_despachante = None
+_despachante_lock = threading.Lock()
+
+
+class _Espera:
+    __slots__ = ('evento', 'msg')
+
+    def __init__(self):
+        self.evento = threading.Event()
+        self.msg = None
+
+
+class Despachante:
+
+    def __init__(self, q=None):
+        self.q = q
+        self._cond = threading.Condition()
+        self._esperas = deque()
+        self._buffer = deque()
+        self._parar = threading.Event()
+        self._thread = None
+
+    def _garantir_poller(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._executar, name='despacho-poller', daemon=True)
+            self._thread.start()
+
+    def aguardar(self, timeout):
+        """Bloqueia até uma mensagem ser entregue a esta espera ou `timeout` passar."""
+        espera = _Espera()
+        with self._cond:
+            msg = self._do_buffer()
+            if msg is not None:
+                return msg
+            self._esperas.append(espera)
+            self._garantir_poller()
+            self._cond.notify_all()
+        espera.evento.wait(timeout)
+        with self._cond:
+            if espera.msg is None:
+                self._esperas.remove(espera)
+            return espera.msg
+
+    def _do_buffer(self):
+        limite = time.monotonic() - DESPACHO_BUFFER_TTL
+        while self._buffer:
+            recebida_em, msg = self._buffer.popleft()
+            if recebida_em >= limite:
+                return msg
+        return None
+
+    def _entregar(self, msgs):
+        with self._cond:
+            for msg in msgs:
+                if self._esperas:
+                    espera = self._esperas.popleft()
+                    espera.msg = msg
+                    espera.evento.set()
+                else:
+                    self._buffer.append((time.monotonic(), msg))
+
+    def _executar(self):
+        while not self._parar.is_set():
+            with self._cond:
+                while not self._esperas and not self._parar.is_set():
+                    self._cond.wait()
+                n = min(len(self._esperas), SQS_MAX_LOTE)
+            if self._parar.is_set():
+                return
+            try:
+                q = self.q or get_queue()
+                msgs = q.receive_messages(n, hidratar='nunca', wait_seconds=DESPACHO_SQS_WAIT)
+            except Exception as e:
+                logger.error('erro ao receber mensagens para o long polling: %s', e)
+                self._parar.wait(1)
+                continue
+            if msgs:
+                self._entregar(msgs)
+            else:
+                self._parar.wait(DESPACHO_INTERVALO)
+
+    def encerrar(self, timeout=None):
+        self._parar.set()
+        with self._cond:
+            self._cond.notify_all()
+        if self._thread:
+            self._thread.join(timeout)
+
+
+def obter_despachante():
+    global _despachante
+    with _despachante_lock:
+        if _despachante is None:
+            _despachante = Despachante()
+            atexit.register(_despachante.encerrar, 1)
+        return _despachante
@@ -0,0 +1,233 @@
+"""Eventos de mudança de status das entregas, para o SSE de `/orders/events`.
+
+`init_app` registra um ouvinte em `storage` (`registrar_ouvinte`): cada
+`atribuir_entrega`/`atualizar_status_entrega` vira um evento com id crescente,
+guardado num buffer circular dos últimos `EVENTS_BUFFER` eventos. Um cliente
+que reconecta com `Last-Event-ID` recebe o que perdeu; se o id já saiu do
+buffer (ou é de outra vida do contador) recebe um evento `reinicio` e deve
+recarregar o estado por `GET /orders`.
+
+Sem `EVENTS_REDIS_URL` os eventos são do processo: a API não vê as atribuições
+feitas pelo worker. Com ela, cada publicação recebe o id de um contador no
+Redis e é difundida por pub/sub (script Lua: INCR + RPUSH + PUBLISH, na mesma
+ordem para todos); cada processo da API assina o canal e completa o buffer com
+a lista dos últimos eventos, então o `Last-Event-ID` vale em qualquer réplica.
+"""
+import atexit
+import json
+import logging
+import os
+import threading
+import time
+from collections import deque
+
+import storage
+
+EVENTS_REDIS_URL = os.getenv('EVENTS_REDIS_URL', '')
+EVENTS_REDIS_CHANNEL = os.getenv('EVENTS_REDIS_CHANNEL', 'entregas:eventos')
+EVENTS_BUFFER = int(os.getenv('EVENTS_BUFFER', '1000'))
+# comentário/heartbeat para proxies não derrubarem a conexão ociosa
+EVENTS_HEARTBEAT = float(os.getenv('EVENTS_HEARTBEAT', '15'))
+# a conexão é encerrada depois disso; o EventSource reconecta com Last-Event-ID
+EVENTS_MAX_SECONDS = float(os.getenv('EVENTS_MAX_SECONDS', '300'))
+EVENTS_RETRY_MS = 3000
+
+logger = logging.getLogger('eventos')
+
+_barramento = None
+_barramento_lock = threading.Lock()
+
+_LUA_PUBLICAR = """
+local id = redis.call('INCR', KEYS[1])
+local msg = id .. ' ' .. ARGV[2]
+redis.call('RPUSH', KEYS[2], msg)
+redis.call('LTRIM', KEYS[2], -tonumber(ARGV[3]), -1)
+redis.call('PUBLISH', ARGV[1], msg)
+return id
+"""
+
+
+def dados_evento(entrega):
+    return {
+        'id_entrega': entrega.get('id'),
+        'status': entrega.get('status'),
+        'id_entregador': entrega.get('id_entregador'),
+        'em': time.time(),
+    }
+
+
+class Barramento:
+    """Buffer dos últimos eventos do processo; leitores esperam por ids novos."""
+
+    def __init__(self, capacidade=EVENTS_BUFFER):
+        self._eventos = deque(maxlen=max(1, int(capacidade)))
+        self._cond = threading.Condition()
+        self._ultimo_id = 0
+
+    def publicar(self, dados):
+        with self._cond:
+            return self._adicionar(self._ultimo_id + 1, dados)
+
+    def _adicionar(self, evento_id, dados):
+        # chamado com _cond; ids repetidos (ex.: backfill depois do pub/sub) são ignorados
+        if evento_id <= self._ultimo_id:
+            return None
+        self._eventos.append((evento_id, dados))
+        self._ultimo_id = evento_id
+        self._cond.notify_all()
+        return evento_id
+
+    def ultimo_id(self):
+        return self._ultimo_id
+
+    def _apos(self, ultimo_id):
+        primeiro = self._eventos[0][0] if self._eventos else self._ultimo_id + 1
+        if ultimo_id > self._ultimo_id or ultimo_id < primeiro - 1:
+            # cursor do futuro (contador reiniciado) ou já fora do buffer
+            return [], self._ultimo_id
+        novos = []
+        for evento in reversed(self._eventos):
+            if evento[0] <= ultimo_id:
+                break
+            novos.append(evento)
+        novos.reverse()
+        return novos, None
+
+    def aguardar(self, ultimo_id, timeout):
+        """([(id, dados)] depois de `ultimo_id`, esperando até `timeout`; cursor de reinício ou None)."""
+        with self._cond:
+            self._cond.wait_for(lambda: self._ultimo_id != ultimo_id, max(0.0, timeout))
+            return self._apos(ultimo_id)
+
+    def encerrar(self):
+        pass
+
+
+class BarramentoRedis(Barramento):
+    """Ids e difusão pelo Redis. A assinatura do canal só começa no primeiro leitor."""
+
+    def __init__(self, cliente, cliente_assinatura=None, canal=EVENTS_REDIS_CHANNEL, capacidade=EVENTS_BUFFER):
+        super().__init__(capacidade)
+        self.cliente = cliente
+        self.cliente_assinatura = cliente_assinatura or cliente
+        self.canal = canal
+        self._chaves = [canal + ':seq', canal + ':recentes']
+        self._script = cliente.register_script(_LUA_PUBLICAR)
+        self._pronto = threading.Event()
+        self._parar = threading.Event()
+        self._thread = None
+        self._thread_lock = threading.Lock()
+
+    def publicar(self, dados):
+        return self._script(keys=self._chaves, args=[self.canal, json.dumps(dados, default=str), self._eventos.maxlen])
+
+    def _receber(self, mensagem):
+        evento_id, _, dados = mensagem.partition(' ')
+        with self._cond:
+            self._adicionar(int(evento_id), json.loads(dados))
+
+    def _garantir_assinatura(self, timeout=5):
+        with self._thread_lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._executar, name='eventos-redis', daemon=True)
+                self._thread.start()
+        self._pronto.wait(timeout)
+
+    def _executar(self):
+        while not self._parar.is_set():
+            pubsub = self.cliente_assinatura.pubsub(ignore_subscribe_messages=True)
+            try:
+                pubsub.subscribe(self.canal)
+                # assinar antes de ler a lista: nada publicado no meio se perde (duplicatas são ignoradas)
+                for mensagem in self.cliente_assinatura.lrange(self._chaves[1], 0, -1):
+                    self._receber(mensagem)
+                self._pronto.set()
+                while not self._parar.is_set():
+                    mensagem = pubsub.get_message(timeout=1.0)
+                    if mensagem and mensagem['type'] == 'message':
+                        self._receber(mensagem['data'])
+            except Exception as e:
+                logger.warning('falha na assinatura de eventos no Redis: %s', e)
+                self._parar.wait(1)
+            finally:
+                try:
+                    pubsub.close()
+                except Exception:
+                    pass
+
+    def ultimo_id(self):
+        self._garantir_assinatura()
+        return super().ultimo_id()
+
+    def aguardar(self, ultimo_id, timeout):
+        self._garantir_assinatura()
+        return super().aguardar(ultimo_id, timeout)
+
+    def encerrar(self):
+        self._parar.set()
+        if self._thread:
+            self._thread.join(2)
+
+
+def obter_barramento():
+    global _barramento
+    with _barramento_lock:
+        if _barramento is None:
+            if EVENTS_REDIS_URL:
+                import redis
+                _barramento = BarramentoRedis(
+                    redis.Redis.from_url(EVENTS_REDIS_URL, decode_responses=True, socket_timeout=0.5),
+                    redis.Redis.from_url(EVENTS_REDIS_URL, decode_responses=True),
+                )
+            else:
+                _barramento = Barramento()
+            atexit.register(_barramento.encerrar)
+        return _barramento
+
+
+def publicar_alteracao(entrega):
+    """Ouvinte do storage: publica a mudança de uma entrega."""
+    obter_barramento().publicar(dados_evento(entrega))
+
+
+def _formatar(evento_id, evento=None, dados=None):
+    linhas = ['id: %d' % evento_id]
+    if evento:
+        linhas.append('event: ' + evento)
+        linhas.append('data: ' + json.dumps(dados, default=str))
+    return '\n'.join(linhas) + '\n\n'
+
+
+def fluxo_sse(ultimo_id=None, id_entrega=None, id_entregador=None, duracao=EVENTS_MAX_SECONDS, heartbeat=EVENTS_HEARTBEAT, barramento=None):
+    """Gera o corpo `text/event-stream` a partir de `ultimo_id` (ou só eventos novos), por até `duracao` segundos."""
+    barramento = barramento or obter_barramento()
+    fim = time.monotonic() + duracao
+    cursor = barramento.ultimo_id() if ultimo_id is None else int(ultimo_id)
+    yield 'retry: %d\n\n' % EVENTS_RETRY_MS
+    while True:
+        eventos, reinicio = barramento.aguardar(cursor, min(heartbeat, fim - time.monotonic()))
+        if reinicio is not None:
+            cursor = reinicio
+            yield _formatar(cursor, 'reinicio', {'ultimo_id': cursor})
+        enviado = None
+        for evento_id, dados in eventos:
+            cursor = evento_id
+            if id_entrega is not None and dados.get('id_entrega') != id_entrega:
+                continue
+            if id_entregador is not None and dados.get('id_entregador') != id_entregador:
+                continue
+            enviado = evento_id
+            yield _formatar(evento_id, 'entrega', dados)
+        if eventos and enviado != cursor:
+            # últimos eventos filtrados: avança o Last-Event-ID do cliente sem disparar evento
+            yield _formatar(cursor)
+        elif not eventos and reinicio is None:
+            yield ': ping\n\n'
+        if time.monotonic() >= fim:
+            return
+
+
+def init_app(app):
+    # create_app pode rodar mais de uma vez no processo: um único ouvinte
+    storage.remover_ouvinte(publicar_alteracao)
+    storage.registrar_ouvinte(publicar_alteracao)
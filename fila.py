@@ -0,0 +1,769 @@
+import os
+import json
+import time
+import uuid
+import atexit
+import socket
+import logging
+import threading
+import boto3
+from botocore.config import Config
+from botocore.exceptions import BotoCoreError, ClientError
+
+import metricas
+from mensagens import corpo_reprocessado
+from storage import (
+    USAR_TINYDB,
+    obter_entregas,
+    enviar_mensagem_fila,
+    enviar_mensagens_fila,
+    receber_mensagens_fila,
+    deletar_mensagem_fila,
+    deletar_mensagens_fila,
+    estatisticas_fila,
+    adiar_mensagens_fila,
+    mover_para_dlq_fila,
+    listar_dlq_fila,
+    reprocessar_dlq_fila,
+)
+
+# limite de entradas por chamada *_batch / MaxNumberOfMessages imposto pelo SQS
+SQS_MAX_LOTE = 10
+# maior VisibilityTimeout aceito pelo SQS (12h)
+SQS_MAX_VISIBILIDADE = 43200
+
+# backend da fila: 'sqs', 'tinydb' ou 'redis' (Redis Streams); padrão segue USE_TINYDB
+QUEUE_BACKEND = os.getenv('QUEUE_BACKEND') or ('tinydb' if USAR_TINYDB else 'sqs')
+REDIS_QUEUE_URL = os.getenv('REDIS_QUEUE_URL', 'redis://localhost:6379/0')
+REDIS_QUEUE_STREAM = os.getenv('REDIS_QUEUE_STREAM', 'entregas')
+REDIS_QUEUE_GROUP = os.getenv('REDIS_QUEUE_GROUP', 'dispatch')
+# mensagens pendentes há mais tempo que isso são retomadas por outro consumidor (XAUTOCLAIM)
+REDIS_QUEUE_VISIBILITY_TIMEOUT = float(os.getenv('REDIS_QUEUE_VISIBILITY_TIMEOUT', '30'))
+
+# pool de conexões do botocore: deve comportar as threads do servidor/worker que usam a fila
+SQS_MAX_POOL = int(os.getenv('SQS_MAX_POOL_CONNECTIONS', '50'))
+SQS_MAX_TENTATIVAS = int(os.getenv('SQS_MAX_ATTEMPTS', '3'))
+SQS_CONNECT_TIMEOUT = float(os.getenv('SQS_CONNECT_TIMEOUT', '2'))
+# maior que o WaitTimeSeconds máximo do long polling (20s)
+SQS_READ_TIMEOUT = float(os.getenv('SQS_READ_TIMEOUT', '25'))
+
+logger = logging.getLogger('fila')
+
+_fila = None
+_fila_lock = threading.Lock()
+
+
+# campos da entrega copiados para o corpo da mensagem no enqueue; não mudam depois da criação
+CAMPOS_DISPATCH = ('restaurante', 'endereco_retirada', 'endereco_cliente')
+
+# como preencher `entrega` nas mensagens recebidas:
+#   'payload' - usa os campos do corpo; busca no banco (um IN) só mensagens sem eles
+#   'sempre'  - sempre busca o estado atual no banco (um IN por lote)
+#   'nunca'   - apenas {'id': ...}; o consumidor busca o que precisar
+HIDRATACAO = os.getenv('QUEUE_HIDRATACAO', 'payload')
+
+
+def _lotes(items, tamanho=SQS_MAX_LOTE):
+    for i in range(0, len(items), tamanho):
+        yield items[i:i + tamanho]
+
+
+def corpo_mensagem(entrega):
+    """Corpo da mensagem para um id de entrega ou para o dict retornado por `criar_entrega`."""
+    if isinstance(entrega, dict):
+        corpo = {'id_entrega': int(entrega['id']), 'entrega': {k: entrega.get(k) for k in CAMPOS_DISPATCH}}
+        # o outbox informa quando a entrega foi de fato enfileirada (commit da criação)
+        corpo['enfileirado_em'] = entrega.get('enfileirado_em') or time.time()
+    else:
+        corpo = {'id_entrega': int(entrega), 'enfileirado_em': time.time()}
+    return corpo
+
+
+def hidratar_mensagens(msgs, modo=None):
+    """Converte `corpo` em `entrega` conforme o modo de hidratação (ver HIDRATACAO).
+
+    As entregas que precisam vir do banco são buscadas de uma vez com `obter_entregas`.
+    """
+    modo = modo or HIDRATACAO
+    faltando = []
+    for msg in msgs:
+        # `corpo` fica na mensagem: é o que vai para a DLQ
+        corpo = msg['corpo']
+        delivery_id = int(corpo.get('id_entrega') or corpo.get('delivery_id'))
+        msg['id_entrega'] = delivery_id
+        msg['enfileirado_em'] = corpo.get('enfileirado_em')
+        msg.setdefault('tentativas', int(corpo.get('tentativas') or 1))
+        if modo == 'nunca':
+            msg['entrega'] = {'id': delivery_id}
+        elif modo == 'payload' and corpo.get('entrega'):
+            msg['entrega'] = dict(corpo['entrega'], id=delivery_id)
+        else:
+            msg['entrega'] = None
+            faltando.append(delivery_id)
+    if faltando:
+        entregas = obter_entregas(faltando)
+        for msg in msgs:
+            if msg['entrega'] is None:
+                msg['entrega'] = entregas.get(msg['id_entrega'])
+    return msgs
+
+
+class SQSQueue:
+    """Adaptador SQS. O client do boto3 é thread-safe: use uma instância por processo (`get_queue`).
+
+    Com `AWS_SQS_DLQ_URL`, `move_to_dlq` copia as mensagens para essa fila e
+    `list_dlq`/`redrive_dlq` a inspecionam e devolvem mensagens à fila principal.
+    """
+
+    dlq_url = None
+
+    def __init__(self):
+        self.queue_url = os.getenv('AWS_SQS_QUEUE_URL')
+        if not self.queue_url:
+            raise RuntimeError('variável AWS_SQS_QUEUE_URL não definida')
+        self.dlq_url = os.getenv('AWS_SQS_DLQ_URL') or None
+        self.region = os.getenv('AWS_REGION')
+        config = Config(
+            max_pool_connections=SQS_MAX_POOL,
+            tcp_keepalive=True,
+            connect_timeout=SQS_CONNECT_TIMEOUT,
+            read_timeout=SQS_READ_TIMEOUT,
+            retries={'max_attempts': SQS_MAX_TENTATIVAS, 'mode': 'standard'},
+        )
+        # criado uma vez por processo, sob _fila_lock (a sessão padrão do boto3 não é thread-safe)
+        self.client = boto3.client('sqs', region_name=self.region, config=config) if self.region else boto3.client('sqs', config=config)
+
+    def close(self):
+        self.client.close()
+
+    @metricas.medir_fila('sqs', 'send_message')
+    def send_message(self, delivery_id):
+        """`delivery_id` pode ser o id ou o dict da entrega (campos de dispatch vão no corpo)."""
+        body = json.dumps(corpo_mensagem(delivery_id))
+        try:
+            resp = self.client.send_message(QueueUrl=self.queue_url, MessageBody=body)
+            return {'MessageId': resp.get('MessageId')}
+        except (BotoCoreError, ClientError) as e:
+            raise
+
+    @metricas.medir_fila('sqs', 'send_messages')
+    def send_messages(self, delivery_ids):
+        """Envia em lotes de 10 via send_message_batch.
+
+        Retorna `{'Successful': [{'id_entrega', 'MessageId'}], 'Failed': [{'id_entrega', 'erro'}]}`.
+        """
+        ok, falhas = [], []
+        for lote in _lotes([corpo_mensagem(d) for d in delivery_ids]):
+            entries = [{'Id': str(i), 'MessageBody': json.dumps(c)} for i, c in enumerate(lote)]
+            try:
+                resp = self.client.send_message_batch(QueueUrl=self.queue_url, Entries=entries)
+            except (BotoCoreError, ClientError) as e:
+                falhas.extend({'id_entrega': c['id_entrega'], 'erro': str(e)} for c in lote)
+                continue
+            for entry in resp.get('Successful', []):
+                ok.append({'id_entrega': lote[int(entry['Id'])]['id_entrega'], 'MessageId': entry.get('MessageId')})
+            for entry in resp.get('Failed', []):
+                falhas.append({'id_entrega': lote[int(entry['Id'])]['id_entrega'], 'erro': entry.get('Message') or entry.get('Code')})
+        return {'Successful': ok, 'Failed': falhas}
+
+    def receive_message(self, hidratar=None):
+        msgs = self.receive_messages(1, hidratar)
+        return msgs[0] if msgs else None
+
+    @metricas.medir_fila('sqs', 'receive_messages')
+    def receive_messages(self, max_n: int = SQS_MAX_LOTE, hidratar=None, wait_seconds: int = 1):
+        try:
+            resp = self.client.receive_message(
+                QueueUrl=self.queue_url,
+                MaxNumberOfMessages=max(1, min(int(max_n), SQS_MAX_LOTE)),
+                WaitTimeSeconds=max(0, min(int(wait_seconds), 20)),
+                AttributeNames=['ApproximateReceiveCount'],
+            )
+        except (BotoCoreError, ClientError) as e:
+            raise
+        out = []
+        malformadas = []
+        for msg in resp.get('Messages') or []:
+            try:
+                payload = json.loads(msg.get('Body'))
+                int(payload.get('id_entrega') or payload.get('delivery_id'))
+            except Exception:
+                # se a mensagem estiver malformada, tirá-la da fila para evitar loop
+                malformadas.append(msg)
+                continue
+            # NÃO deletar imediatamente — retornar ReceiptHandle para permitir delete/ack explícito
+            tentativas = int((msg.get('Attributes') or {}).get('ApproximateReceiveCount') or 1)
+            out.append({'MessageId': msg.get('MessageId'), 'ReceiptHandle': msg.get('ReceiptHandle'), 'corpo': payload, 'tentativas': tentativas})
+        if malformadas:
+            self._descartar_malformadas(malformadas)
+        return hidratar_mensagens(out, hidratar)
+
+    def _descartar_malformadas(self, msgs):
+        # com DLQ o corpo original é preservado lá; sem ela a mensagem é apagada
+        if self.dlq_url:
+            entries = [{'Id': str(i), 'MessageBody': m.get('Body') or ''} for i, m in enumerate(msgs)]
+            try:
+                resp = self.client.send_message_batch(QueueUrl=self.dlq_url, Entries=entries)
+                msgs = [msgs[int(e['Id'])] for e in resp.get('Successful', [])]
+            except (BotoCoreError, ClientError) as e:
+                logger.warning('falha ao mover mensagens malformadas para a DLQ: %s', e)
+                return
+            metricas.MENSAGENS_DLQ.inc(len(msgs), motivo='malformada')
+        self.delete_messages([m.get('ReceiptHandle') for m in msgs])
+
+    @metricas.medir_fila('sqs', 'delete_message')
+    def delete_message(self, receipt_handle: str):
+        try:
+            resp = self.client.delete_message(QueueUrl=self.queue_url, ReceiptHandle=receipt_handle)
+            return True
+        except Exception:
+            return False
+
+    @metricas.medir_fila('sqs', 'delete_messages')
+    def delete_messages(self, receipt_handles):
+        """Apaga em lotes de 10 via delete_message_batch.
+
+        Retorna `{'Successful': [ReceiptHandle], 'Failed': [{'ReceiptHandle', 'erro'}]}`.
+        """
+        ok, falhas = [], []
+        for lote in _lotes(list(receipt_handles)):
+            entries = [{'Id': str(i), 'ReceiptHandle': r} for i, r in enumerate(lote)]
+            try:
+                resp = self.client.delete_message_batch(QueueUrl=self.queue_url, Entries=entries)
+            except (BotoCoreError, ClientError) as e:
+                falhas.extend({'ReceiptHandle': r, 'erro': str(e)} for r in lote)
+                continue
+            for entry in resp.get('Successful', []):
+                ok.append(lote[int(entry['Id'])])
+            for entry in resp.get('Failed', []):
+                falhas.append({'ReceiptHandle': lote[int(entry['Id'])], 'erro': entry.get('Message') or entry.get('Code')})
+        return {'Successful': ok, 'Failed': falhas}
+
+    @metricas.medir_fila('sqs', 'change_visibility')
+    def change_visibility(self, itens):
+        """[(receipt_handle, segundos)] via change_message_visibility_batch, em lotes de 10.
+
+        Retorna `{'Successful': [ReceiptHandle], 'Failed': [{'ReceiptHandle', 'erro'}]}`.
+        """
+        ok, falhas = [], []
+        for lote in _lotes(list(itens)):
+            entries = [
+                {'Id': str(i), 'ReceiptHandle': r, 'VisibilityTimeout': max(0, min(int(segundos), SQS_MAX_VISIBILIDADE))}
+                for i, (r, segundos) in enumerate(lote)
+            ]
+            try:
+                resp = self.client.change_message_visibility_batch(QueueUrl=self.queue_url, Entries=entries)
+            except (BotoCoreError, ClientError) as e:
+                falhas.extend({'ReceiptHandle': r, 'erro': str(e)} for r, _ in lote)
+                continue
+            for entry in resp.get('Successful', []):
+                ok.append(lote[int(entry['Id'])][0])
+            for entry in resp.get('Failed', []):
+                falhas.append({'ReceiptHandle': lote[int(entry['Id'])][0], 'erro': entry.get('Message') or entry.get('Code')})
+        return {'Successful': ok, 'Failed': falhas}
+
+    @metricas.medir_fila('sqs', 'move_to_dlq')
+    def move_to_dlq(self, itens):
+        """[(mensagem recebida, info)]: copia o corpo, com `dlq`=info, para a DLQ e apaga da fila."""
+        itens = list(itens)
+        if not self.dlq_url:
+            return {'Successful': [], 'Failed': [{'ReceiptHandle': m.get('ReceiptHandle'), 'erro': 'AWS_SQS_DLQ_URL não definida'} for m, _ in itens]}
+        ok, falhas = [], []
+        for lote in _lotes(itens):
+            entries = []
+            for i, (msg, info) in enumerate(lote):
+                corpo = dict(msg.get('corpo') or {'id_entrega': msg.get('id_entrega')}, tentativas=msg.get('tentativas'))
+                corpo['dlq'] = dict(info or {}, movida_em=time.time())
+                entries.append({'Id': str(i), 'MessageBody': json.dumps(corpo, default=str)})
+            try:
+                resp = self.client.send_message_batch(QueueUrl=self.dlq_url, Entries=entries)
+            except (BotoCoreError, ClientError) as e:
+                falhas.extend({'ReceiptHandle': m.get('ReceiptHandle'), 'erro': str(e)} for m, _ in lote)
+                continue
+            for entry in resp.get('Failed', []):
+                falhas.append({'ReceiptHandle': lote[int(entry['Id'])][0].get('ReceiptHandle'), 'erro': entry.get('Message') or entry.get('Code')})
+            copiadas = [lote[int(entry['Id'])][0].get('ReceiptHandle') for entry in resp.get('Successful', [])]
+            if copiadas:
+                # se o delete falhar a mensagem fica nas duas filas; a atribuição por CAS tolera a cópia
+                res = self.delete_messages(copiadas)
+                ok.extend(res['Successful'])
+                falhas.extend(res['Failed'])
+        return {'Successful': ok, 'Failed': falhas}
+
+    def _receber_dlq(self, visibilidade):
+        resp = self.client.receive_message(QueueUrl=self.dlq_url, MaxNumberOfMessages=SQS_MAX_LOTE, WaitTimeSeconds=0, VisibilityTimeout=visibilidade)
+        return resp.get('Messages') or []
+
+    def list_dlq(self, limite=100):
+        """Espia até `limite` mensagens da DLQ sem apagá-las (receive com VisibilityTimeout=0; amostra aproximada)."""
+        if not self.dlq_url:
+            return []
+        vistas = {}
+        sem_novas = 0
+        while len(vistas) < limite and sem_novas < 2:
+            novas = 0
+            for m in self._receber_dlq(0):
+                if m['MessageId'] in vistas:
+                    continue
+                try:
+                    corpo = json.loads(m.get('Body'))
+                except ValueError:
+                    corpo = {'bruto': m.get('Body')}
+                if not isinstance(corpo, dict):
+                    corpo = {'bruto': corpo}
+                vistas[m['MessageId']] = dict(corpo, id=m['MessageId'])
+                novas += 1
+            sem_novas = 0 if novas else sem_novas + 1
+        return list(vistas.values())[:limite]
+
+    def redrive_dlq(self, ids=None, limite=100):
+        """Devolve à fila as mensagens `ids` da DLQ (ou até `limite`). Retorna os MessageIds movidos."""
+        if not self.dlq_url:
+            return []
+        procurados = {str(i) for i in ids} if ids is not None else None
+        alvo = len(procurados) if procurados is not None else limite
+        movidas = []
+        sem_novas = 0
+        while len(movidas) < alvo and sem_novas < 2:
+            mover, devolver = [], []
+            for m in self._receber_dlq(30):
+                if len(movidas) + len(mover) >= alvo or (procurados is not None and m['MessageId'] not in procurados):
+                    devolver.append(m)
+                    continue
+                try:
+                    corpo = corpo_reprocessado(json.loads(m.get('Body')))
+                    int(corpo.get('id_entrega') or corpo.get('delivery_id'))
+                except Exception:
+                    # malformada: fica na DLQ
+                    devolver.append(m)
+                    continue
+                mover.append((m, corpo))
+            if devolver:
+                self.client.change_message_visibility_batch(QueueUrl=self.dlq_url, Entries=[
+                    {'Id': str(i), 'ReceiptHandle': m['ReceiptHandle'], 'VisibilityTimeout': 0} for i, m in enumerate(devolver)
+                ])
+            if not mover:
+                sem_novas += 1
+                continue
+            sem_novas = 0
+            resp = self.client.send_message_batch(QueueUrl=self.queue_url, Entries=[
+                {'Id': str(i), 'MessageBody': json.dumps(corpo)} for i, (_, corpo) in enumerate(mover)
+            ])
+            enviadas = [mover[int(e['Id'])][0] for e in resp.get('Successful', [])]
+            if enviadas:
+                self.client.delete_message_batch(QueueUrl=self.dlq_url, Entries=[
+                    {'Id': str(i), 'ReceiptHandle': m['ReceiptHandle']} for i, m in enumerate(enviadas)
+                ])
+                if procurados is not None:
+                    procurados.difference_update(m['MessageId'] for m in enviadas)
+                movidas.extend(m['MessageId'] for m in enviadas)
+        return movidas
+
+    def _contagens(self, url):
+        attrs = self.client.get_queue_attributes(
+            QueueUrl=url,
+            AttributeNames=['ApproximateNumberOfMessages', 'ApproximateNumberOfMessagesNotVisible'],
+        ).get('Attributes', {})
+        return int(attrs.get('ApproximateNumberOfMessages', 0)), int(attrs.get('ApproximateNumberOfMessagesNotVisible', 0))
+
+    def estatisticas(self):
+        """Contagens aproximadas do SQS. A idade da mensagem mais antiga só existe no CloudWatch."""
+        visiveis, em_voo = self._contagens(self.queue_url)
+        out = {'visiveis': visiveis, 'em_voo': em_voo, 'idade_mais_antiga': None}
+        if self.dlq_url:
+            out['dlq'] = sum(self._contagens(self.dlq_url))
+        return out
+
+
+class TinyDBQueue:
+    """Adaptador da fila local (TinyDB) com a mesma interface do SQSQueue."""
+
+    @metricas.medir_fila('tinydb', 'send_message')
+    def send_message(self, delivery_id):
+        return enviar_mensagem_fila(corpo_mensagem(delivery_id))
+
+    @metricas.medir_fila('tinydb', 'send_messages')
+    def send_messages(self, delivery_ids):
+        return enviar_mensagens_fila([corpo_mensagem(d) for d in delivery_ids])
+
+    def receive_message(self, hidratar=None):
+        msgs = self.receive_messages(1, hidratar)
+        return msgs[0] if msgs else None
+
+    @metricas.medir_fila('tinydb', 'receive_messages')
+    def receive_messages(self, max_n: int = SQS_MAX_LOTE, hidratar=None, wait_seconds: int = 0):
+        # a fila local não bloqueia: quem espera (ex.: despacho.py) faz polling
+        return hidratar_mensagens(receber_mensagens_fila(max_n), hidratar)
+
+    @metricas.medir_fila('tinydb', 'delete_message')
+    def delete_message(self, receipt_handle: str):
+        return deletar_mensagem_fila(receipt_handle)
+
+    @metricas.medir_fila('tinydb', 'delete_messages')
+    def delete_messages(self, receipt_handles):
+        return deletar_mensagens_fila(receipt_handles)
+
+    @metricas.medir_fila('tinydb', 'change_visibility')
+    def change_visibility(self, itens):
+        return adiar_mensagens_fila(list(itens))
+
+    @metricas.medir_fila('tinydb', 'move_to_dlq')
+    def move_to_dlq(self, itens):
+        return mover_para_dlq_fila([(m.get('ReceiptHandle'), info) for m, info in itens])
+
+    def list_dlq(self, limite=100):
+        return listar_dlq_fila(limite)
+
+    def redrive_dlq(self, ids=None, limite=100):
+        return reprocessar_dlq_fila(ids, limite)
+
+    def estatisticas(self):
+        return estatisticas_fila()
+
+    def close(self):
+        pass
+
+
+# adia uma mensagem pendente deste consumidor: sai do stream e vai para o zset `adiadas`
+# com score = instante (ms) em que volta; a contagem de entregas acumula em `tentativas`
+_LUA_ADIAR = """
+local p = redis.call('XPENDING', KEYS[1], ARGV[1], ARGV[4], ARGV[4], 1)
+if #p == 0 or p[1][2] ~= ARGV[2] then return 0 end
+local e = redis.call('XRANGE', KEYS[1], ARGV[4], ARGV[4])
+redis.call('XACK', KEYS[1], ARGV[1], ARGV[4])
+redis.call('XDEL', KEYS[1], ARGV[4])
+if #e == 0 then return 0 end
+local campos, corpo, tentativas = e[1][2], '', 0
+for i = 1, #campos, 2 do
+  if campos[i] == 'corpo' then corpo = campos[i + 1] elseif campos[i] == 'tentativas' then tentativas = tonumber(campos[i + 1]) end
+end
+redis.call('ZADD', KEYS[2], ARGV[3], cjson.encode({id = ARGV[4], corpo = corpo, tentativas = tentativas + p[1][4]}))
+return 1
+"""
+
+# XACK e, só se a entrada ainda estava pendente no grupo, XDEL; com KEYS[2] a
+# entrada confirmada antes vai para a DLQ com o corpo ARGV[3]
+_LUA_CONFIRMAR = """
+local n = redis.call('XACK', KEYS[1], ARGV[1], ARGV[2])
+if n == 1 then
+  if KEYS[2] then redis.call('XADD', KEYS[2], '*', 'corpo', ARGV[3]) end
+  redis.call('XDEL', KEYS[1], ARGV[2])
+end
+return n
+"""
+
+# devolve ao stream as mensagens adiadas cujo instante já passou
+_LUA_PROMOVER = """
+local itens = redis.call('ZRANGEBYSCORE', KEYS[1], '-inf', ARGV[1], 'LIMIT', 0, tonumber(ARGV[2]))
+for _, item in ipairs(itens) do
+  local m = cjson.decode(item)
+  redis.call('XADD', KEYS[2], '*', 'corpo', m['corpo'], 'tentativas', m['tentativas'])
+  redis.call('ZREM', KEYS[1], item)
+end
+return #itens
+"""
+
+
+class RedisStreamQueue:
+    """Fila em Redis Streams com consumer group, com a mesma interface do SQSQueue.
+
+    `send_message` faz XADD; `receive_messages` lê com XREADGROUP (bloqueando até
+    `wait_seconds`) depois de retomar, via XAUTOCLAIM, mensagens pendentes há mais
+    de `REDIS_QUEUE_VISIBILITY_TIMEOUT` segundos (o equivalente ao visibility
+    timeout). O ReceiptHandle é o id da entrada; `delete_message` faz XACK + XDEL,
+    de modo que o stream só guarda mensagens não confirmadas.
+
+    Mensagens adiadas (`change_visibility`) ficam no zset `<stream>:adiadas` até
+    voltarem ao stream; a DLQ é o stream `<stream>:dlq`. Requer Redis 6.2+.
+    """
+
+    def __init__(self, cliente=None, stream=REDIS_QUEUE_STREAM, grupo=REDIS_QUEUE_GROUP, consumidor=None,
+                 visibility_timeout=REDIS_QUEUE_VISIBILITY_TIMEOUT):
+        if cliente is None:
+            import redis
+            cliente = redis.Redis.from_url(REDIS_QUEUE_URL, decode_responses=True, socket_connect_timeout=2, health_check_interval=30)
+        self.cliente = cliente
+        self.stream = stream
+        self.grupo = grupo
+        self.adiadas = stream + ':adiadas'
+        self.dlq = stream + ':dlq'
+        # um consumidor por processo: as threads compartilham o mesmo client e os mesmos leases
+        self.consumidor = consumidor or os.getenv('REDIS_QUEUE_CONSUMER') or '%s-%d-%s' % (socket.gethostname(), os.getpid(), uuid.uuid4().hex[:6])
+        self.visibility_timeout = float(visibility_timeout)
+        self._lock = threading.Lock()
+        self._cursor_reclaim = '0-0'
+        self._proximo_reclaim = 0.0
+        self._adiar = cliente.register_script(_LUA_ADIAR)
+        self._promover = cliente.register_script(_LUA_PROMOVER)
+        self._confirmar = cliente.register_script(_LUA_CONFIRMAR)
+        self._criar_grupo()
+
+    def _criar_grupo(self):
+        from redis.exceptions import ResponseError
+        try:
+            # id '0': mensagens enviadas antes do grupo existir também são entregues
+            self.cliente.xgroup_create(self.stream, self.grupo, id='0', mkstream=True)
+        except ResponseError as e:
+            if 'BUSYGROUP' not in str(e):
+                raise
+
+    def close(self):
+        self.cliente.close()
+
+    @metricas.medir_fila('redis', 'send_message')
+    def send_message(self, delivery_id):
+        msg_id = self.cliente.xadd(self.stream, {'corpo': json.dumps(corpo_mensagem(delivery_id)), 'tentativas': 0})
+        return {'MessageId': msg_id}
+
+    @metricas.medir_fila('redis', 'send_messages')
+    def send_messages(self, delivery_ids):
+        """XADD de todas as mensagens num único pipeline. Retorna o mesmo formato do SQSQueue."""
+        corpos = [corpo_mensagem(d) for d in delivery_ids]
+        pipe = self.cliente.pipeline(transaction=False)
+        for c in corpos:
+            pipe.xadd(self.stream, {'corpo': json.dumps(c), 'tentativas': 0})
+        ok, falhas = [], []
+        for c, res in zip(corpos, pipe.execute(raise_on_error=False)):
+            if isinstance(res, Exception):
+                falhas.append({'id_entrega': c['id_entrega'], 'erro': str(res)})
+            else:
+                ok.append({'id_entrega': c['id_entrega'], 'MessageId': res})
+        return {'Successful': ok, 'Failed': falhas}
+
+    def receive_message(self, hidratar=None):
+        msgs = self.receive_messages(1, hidratar, wait_seconds=0)
+        return msgs[0] if msgs else None
+
+    def _reclamar(self, n):
+        """[(id, campos, entregas)] pendentes há mais que o visibility timeout, agora deste consumidor."""
+        with self._lock:
+            if time.monotonic() < self._proximo_reclaim:
+                return []
+            cursor, entradas = self.cliente.xautoclaim(
+                self.stream, self.grupo, self.consumidor, int(self.visibility_timeout * 1000),
+                start_id=self._cursor_reclaim, count=n,
+            )[:2]
+            self._cursor_reclaim = cursor
+            if cursor == '0-0':
+                # a lista de pendentes foi percorrida inteira: próxima varredura daqui a 1s
+                self._proximo_reclaim = time.monotonic() + 1
+        entradas = [(i, c) for i, c in entradas if i is not None and c]
+        if not entradas:
+            return []
+        pipe = self.cliente.pipeline(transaction=False)
+        for i, _ in entradas:
+            pipe.xpending_range(self.stream, self.grupo, min=i, max=i, count=1)
+        pendentes = pipe.execute()
+        return [(i, c, p[0]['times_delivered'] if p else 1) for (i, c), p in zip(entradas, pendentes)]
+
+    @metricas.medir_fila('redis', 'receive_messages')
+    def receive_messages(self, max_n: int = SQS_MAX_LOTE, hidratar=None, wait_seconds: int = 1):
+        max_n = max(1, int(max_n))
+        self._promover(keys=[self.adiadas, self.stream], args=[int(time.time() * 1000), max_n])
+        entradas = self._reclamar(max_n)
+        falta = max_n - len(entradas)
+        if falta:
+            # block=0 no Redis espera para sempre: sem espera, não passar block
+            block = int(wait_seconds * 1000) if wait_seconds and not entradas else None
+            resp = self.cliente.xreadgroup(self.grupo, self.consumidor, {self.stream: '>'}, count=falta, block=block)
+            for _, msgs in resp or []:
+                entradas.extend((i, c, 1) for i, c in msgs)
+        out = []
+        malformadas = []
+        for msg_id, campos, entregas in entradas:
+            try:
+                payload = json.loads(campos.get('corpo'))
+                int(payload.get('id_entrega') or payload.get('delivery_id'))
+            except Exception:
+                malformadas.append((msg_id, campos.get('corpo')))
+                continue
+            tentativas = int(campos.get('tentativas') or 0) + int(entregas)
+            out.append({'MessageId': msg_id, 'ReceiptHandle': msg_id, 'corpo': payload, 'tentativas': tentativas})
+        if malformadas:
+            # o corpo original fica na DLQ, fora do caminho dos consumidores
+            pipe = self.cliente.pipeline(transaction=False)
+            for msg_id, bruto in malformadas:
+                self._confirmar(keys=[self.stream, self.dlq], args=[self.grupo, msg_id, bruto or ''], client=pipe)
+            metricas.MENSAGENS_DLQ.inc(sum(pipe.execute()), motivo='malformada')
+        return hidratar_mensagens(out, hidratar)
+
+    @metricas.medir_fila('redis', 'delete_message')
+    def delete_message(self, receipt_handle: str):
+        return not self.delete_messages([receipt_handle])['Failed']
+
+    @metricas.medir_fila('redis', 'delete_messages')
+    def delete_messages(self, receipt_handles):
+        """XACK + XDEL por mensagem. Falha, sem apagar a entrada, se a mensagem já não estava pendente no grupo."""
+        receipt_handles = list(receipt_handles)
+        if not receipt_handles:
+            return {'Successful': [], 'Failed': []}
+        pipe = self.cliente.pipeline(transaction=False)
+        for r in receipt_handles:
+            self._confirmar(keys=[self.stream], args=[self.grupo, r], client=pipe)
+        ok, falhas = [], []
+        for r, res in zip(receipt_handles, pipe.execute(raise_on_error=False)):
+            if res == 1:
+                ok.append(r)
+            else:
+                falhas.append({'ReceiptHandle': r, 'erro': str(res) if isinstance(res, Exception) else 'mensagem não pendente no grupo'})
+        return {'Successful': ok, 'Failed': falhas}
+
+    @metricas.medir_fila('redis', 'change_visibility')
+    def change_visibility(self, itens):
+        """[(receipt_handle, segundos)]: tira a mensagem do stream até `segundos` depois de agora."""
+        itens = list(itens)
+        agora_ms = int(time.time() * 1000)
+        pipe = self.cliente.pipeline(transaction=False)
+        for r, segundos in itens:
+            self._adiar(keys=[self.stream, self.adiadas], args=[self.grupo, self.consumidor, agora_ms + int(max(0, segundos) * 1000), r], client=pipe)
+        ok, falhas = [], []
+        for (r, _), res in zip(itens, pipe.execute(raise_on_error=False)):
+            if res == 1:
+                ok.append(r)
+            else:
+                falhas.append({'ReceiptHandle': r, 'erro': str(res) if isinstance(res, Exception) else 'lease expirado ou inexistente'})
+        return {'Successful': ok, 'Failed': falhas}
+
+    @metricas.medir_fila('redis', 'move_to_dlq')
+    def move_to_dlq(self, itens):
+        """[(mensagem recebida, info)]: XACK e, se a mensagem ainda estava pendente, XADD na DLQ + XDEL (script atômico)."""
+        itens = list(itens)
+        pipe = self.cliente.pipeline(transaction=False)
+        for msg, info in itens:
+            corpo = dict(msg.get('corpo') or {'id_entrega': msg.get('id_entrega')}, tentativas=msg.get('tentativas'))
+            corpo['dlq'] = dict(info or {}, movida_em=time.time())
+            self._confirmar(keys=[self.stream, self.dlq], args=[self.grupo, msg.get('ReceiptHandle'), json.dumps(corpo, default=str)], client=pipe)
+        ok, falhas = [], []
+        for (msg, _), res in zip(itens, pipe.execute(raise_on_error=False)):
+            r = msg.get('ReceiptHandle')
+            if res == 1:
+                ok.append(r)
+            else:
+                falhas.append({'ReceiptHandle': r, 'erro': str(res) if isinstance(res, Exception) else 'mensagem não pendente no grupo'})
+        return {'Successful': ok, 'Failed': falhas}
+
+    def _entrada_dlq(self, msg_id, campos):
+        try:
+            corpo = json.loads(campos.get('corpo'))
+        except ValueError:
+            corpo = None
+        if not isinstance(corpo, dict):
+            corpo = {'bruto': campos.get('corpo')}
+        return dict(corpo, id=msg_id)
+
+    def list_dlq(self, limite=100):
+        return [self._entrada_dlq(i, c) for i, c in self.cliente.xrange(self.dlq, count=limite)]
+
+    def redrive_dlq(self, ids=None, limite=100):
+        """Devolve à fila as mensagens `ids` da DLQ (ou as `limite` mais antigas). Retorna os ids movidos."""
+        if ids is None:
+            entradas = self.cliente.xrange(self.dlq, count=limite)
+        else:
+            pipe = self.cliente.pipeline(transaction=False)
+            for i in ids:
+                pipe.xrange(self.dlq, min=str(i), max=str(i), count=1)
+            entradas = [e[0] for e in pipe.execute() if e]
+        movidas = []
+        pipe = self.cliente.pipeline()
+        for msg_id, campos in entradas:
+            try:
+                corpo = corpo_reprocessado(json.loads(campos.get('corpo')))
+                int(corpo.get('id_entrega') or corpo.get('delivery_id'))
+            except Exception:
+                # malformada: fica na DLQ
+                continue
+            pipe.xadd(self.stream, {'corpo': json.dumps(corpo), 'tentativas': 0})
+            pipe.xdel(self.dlq, msg_id)
+            movidas.append(msg_id)
+        if movidas:
+            pipe.execute()
+        return movidas
+
+    def estatisticas(self):
+        """Como o stream só guarda mensagens não confirmadas, visíveis = XLEN - pendentes do grupo."""
+        pipe = self.cliente.pipeline(transaction=False)
+        pipe.xlen(self.stream)
+        pipe.xpending(self.stream, self.grupo)
+        pipe.zcard(self.adiadas)
+        pipe.xlen(self.dlq)
+        pipe.xrange(self.stream, count=1)
+        total, pendentes, adiadas, dlq, primeira = pipe.execute()
+        pendentes = pendentes.get('pending', 0) if isinstance(pendentes, dict) else pendentes[0]
+        idade = None
+        if primeira:
+            # o id da entrada começa pelo instante do XADD em ms
+            idade = max(0.0, time.time() - int(primeira[0][0].split('-')[0]) / 1000)
+        return {'visiveis': max(0, total - pendentes), 'em_voo': pendentes + adiadas, 'idade_mais_antiga': idade, 'dlq': dlq}
+
+
+def criar_queue(backend=None):
+    """Adaptador do backend `QUEUE_BACKEND` (ou `backend`)."""
+    backend = backend or QUEUE_BACKEND
+    if backend == 'tinydb':
+        return TinyDBQueue()
+    if backend == 'sqs':
+        return SQSQueue()
+    if backend == 'redis':
+        return RedisStreamQueue()
+    raise ValueError('QUEUE_BACKEND desconhecido: %s' % backend)
+
+
+def get_queue():
+    """Adaptador de fila compartilhado pelo processo (criado na primeira chamada)."""
+    global _fila
+    fila = _fila
+    if fila is not None:
+        return fila
+    with _fila_lock:
+        if _fila is None:
+            _fila = criar_queue()
+        return _fila
+
+
+_estatisticas = (0.0, None)
+
+
+def _estatisticas_fila():
+    """`estatisticas()` da fila, reaproveitada por 1s entre os gauges de uma mesma coleta."""
+    global _estatisticas
+    instante, valor = _estatisticas
+    if valor is None or time.monotonic() - instante > 1:
+        valor = get_queue().estatisticas()
+        _estatisticas = (time.monotonic(), valor)
+    return valor
+
+
+metricas.gauge('fila_mensagens', 'Mensagens na fila por estado.', ('estado',), coletar=lambda: {
+    # `dlq` só existe quando há dead-letter queue; None omite a série
+    estado: _estatisticas_fila().get(estado) for estado in ('visiveis', 'em_voo', 'dlq')
+})
+metricas.gauge('fila_idade_mais_antiga_segundos', 'Idade da mensagem mais antiga ainda não apagada.',
+               coletar=lambda: _estatisticas_fila()['idade_mais_antiga'])
+
+
+def fechar_queue():
+    """Fecha o client e descarta o singleton; a próxima `get_queue()` cria outro."""
+    global _fila
+    with _fila_lock:
+        fila, _fila = _fila, None
+    if fila is not None:
+        try:
+            fila.close()
+        except Exception as e:
+            logger.warning('falha ao fechar a fila: %s', e)
+
+
+def init_app(app):
+    """Liga o ciclo de vida da fila ao app Flask.
+
+    Com `QUEUE_PREWARM=true` o client é criado na inicialização, para a primeira
+    requisição não pagar a resolução de credenciais/endpoint. A fila é fechada na
+    saída do processo.
+    """
+    app.extensions['fila'] = get_queue
+    if os.getenv('QUEUE_PREWARM', 'false').lower() == 'true':
+        try:
+            get_queue()
+        except Exception as e:
+            logger.warning('falha ao pré-criar a fila: %s', e)
+    atexit.register(fechar_queue)
@@ -0,0 +1,12 @@
+"""Corpo das mensagens de dispatch, comum a todos os backends de fila."""
+import time
+
+# campos acrescentados à mensagem na fila/DLQ e removidos quando ela volta à fila
+CAMPOS_DLQ = ('dlq', 'tentativas', 'visivel_em', 'lease', 'created_at')
+
+
+def corpo_reprocessado(corpo):
+    """Corpo de uma mensagem da DLQ pronto para voltar à fila (tentativas zeradas)."""
+    corpo = {k: v for k, v in corpo.items() if k not in CAMPOS_DLQ}
+    corpo['enfileirado_em'] = time.time()
+    return corpo
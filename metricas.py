@@ -0,0 +1,302 @@
+"""Métricas no formato texto do Prometheus, sem dependências externas.
+
+Contadores, gauges e histogramas registrados aqui são expostos em `/metrics`
+na API (`init_app`) e, no worker, num servidor HTTP à parte (`servir`, em
+`WORKER_METRICS_HOST`:`WORKER_METRICS_PORT`, por padrão só em 127.0.0.1). Gauges podem ter uma função chamada a cada coleta (ex.:
+profundidade da fila).
+
+Séries principais:
+- `http_requisicao_segundos{rota,metodo,status}`
+- `storage_operacao_segundos{funcao}`
+- `fila_operacao_segundos{backend,operacao}`
+- `fila_mensagens`, `fila_idade_mais_antiga_segundos`
+- `atribuicoes_total{origem}`, `worker_atribuicoes_por_segundo`,
+  `worker_reenfileiradas_total{motivo}`, `fila_dlq_total{motivo}`
+- `atribuicao_latencia_segundos{origem}` (do enqueue até a atribuição)
+"""
+import bisect
+import functools
+import hmac
+import logging
+import math
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+BUCKETS_PADRAO = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+BUCKETS_LATENCIA = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1800)
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+# porta do /metrics do worker; 0 desliga
+WORKER_METRICS_PORT = int(os.getenv('WORKER_METRICS_PORT', '9100'))
+# só a máquina local por padrão; 0.0.0.0 para o Prometheus coletar de fora (rede interna)
+WORKER_METRICS_HOST = os.getenv('WORKER_METRICS_HOST', '127.0.0.1')
+# token do /metrics no header `Authorization: Bearer <token>` (o bearer token do Prometheus);
+# sem ele o /metrics da API responde 403, e o do worker (local por padrão) fica aberto
+METRICS_TOKEN = os.getenv('METRICS_TOKEN')
+
+logger = logging.getLogger('metricas')
+
+
+def _escapar(valor):
+    return str(valor).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _rotulos(nomes, valores, extra=None):
+    pares = list(zip(nomes, valores))
+    if extra:
+        pares.append(extra)
+    if not pares:
+        return ''
+    return '{%s}' % ','.join('%s="%s"' % (k, _escapar(v)) for k, v in pares)
+
+
+def _numero(v):
+    if v == math.inf:
+        return '+Inf'
+    return repr(float(v)) if isinstance(v, float) else str(v)
+
+
+class _Metrica:
+    tipo = None
+
+    def __init__(self, nome, ajuda, rotulos=()):
+        self.nome = nome
+        self.ajuda = ajuda
+        self.rotulos = tuple(rotulos)
+        self._lock = threading.Lock()
+        self._series = {}
+
+    def _chave(self, rotulos):
+        return tuple(str(rotulos[r]) for r in self.rotulos)
+
+    def expor(self):
+        linhas = ['# HELP %s %s' % (self.nome, self.ajuda), '# TYPE %s %s' % (self.nome, self.tipo)]
+        with self._lock:
+            series = sorted(self._series.items())
+        for chave, valor in series:
+            linhas.extend(self._linhas(chave, valor))
+        return linhas
+
+    def _linhas(self, chave, valor):
+        return ['%s%s %s' % (self.nome, _rotulos(self.rotulos, chave), _numero(valor))]
+
+
+class Contador(_Metrica):
+    tipo = 'counter'
+
+    def inc(self, valor=1, **rotulos):
+        chave = self._chave(rotulos)
+        with self._lock:
+            self._series[chave] = self._series.get(chave, 0) + valor
+
+    def valor(self, **rotulos):
+        return self._series.get(self._chave(rotulos), 0)
+
+
+class Gauge(_Metrica):
+    """Valor instantâneo. Com `coletar`, o valor é lido na hora da exposição.
+
+    `coletar()` retorna um número (sem rótulos) ou um dict {valores dos rótulos: número};
+    None omite a série.
+    """
+    tipo = 'gauge'
+
+    def __init__(self, nome, ajuda, rotulos=(), coletar=None):
+        super().__init__(nome, ajuda, rotulos)
+        self.coletar = coletar
+
+    def set(self, valor, **rotulos):
+        with self._lock:
+            self._series[self._chave(rotulos)] = valor
+
+    def expor(self):
+        if self.coletar is not None:
+            try:
+                valores = self.coletar()
+            except Exception as e:
+                logger.warning('falha ao coletar %s: %s', self.nome, e)
+                valores = None
+            if not isinstance(valores, dict):
+                valores = {(): valores}
+            with self._lock:
+                self._series = {(k if isinstance(k, tuple) else (k,)): v for k, v in valores.items() if v is not None}
+        return super().expor()
+
+
+class Histograma(_Metrica):
+    tipo = 'histogram'
+
+    def __init__(self, nome, ajuda, rotulos=(), buckets=BUCKETS_PADRAO):
+        super().__init__(nome, ajuda, rotulos)
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+
+    def observar(self, valor, **rotulos):
+        self._observar(self._chave(rotulos), valor)
+
+    def _observar(self, chave, valor):
+        i = bisect.bisect_left(self.buckets, valor)
+        with self._lock:
+            serie = self._series.get(chave)
+            if serie is None:
+                serie = self._series[chave] = [[0] * len(self.buckets), 0.0, 0]
+            serie[0][i] += 1
+            serie[1] += valor
+            serie[2] += 1
+
+    def contagem(self, **rotulos):
+        serie = self._series.get(self._chave(rotulos))
+        return serie[2] if serie else 0
+
+    def _linhas(self, chave, serie):
+        contagens, soma, total = serie
+        linhas = []
+        acumulado = 0
+        for limite, n in zip(self.buckets, contagens):
+            acumulado += n
+            linhas.append('%s_bucket%s %d' % (self.nome, _rotulos(self.rotulos, chave, ('le', _numero(limite))), acumulado))
+        linhas.append('%s_sum%s %s' % (self.nome, _rotulos(self.rotulos, chave), repr(soma)))
+        linhas.append('%s_count%s %d' % (self.nome, _rotulos(self.rotulos, chave), total))
+        return linhas
+
+    def cronometrar(self, **rotulos):
+        """Decorator que observa a duração de cada chamada (inclusive com exceção)."""
+        chave = self._chave(rotulos)
+
+        def decorator(func):
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                inicio = time.perf_counter()
+                try:
+                    return func(*args, **kwargs)
+                finally:
+                    self._observar(chave, time.perf_counter() - inicio)
+            return wrapper
+        return decorator
+
+
+class Registro:
+
+    def __init__(self):
+        self._metricas = {}
+        self._lock = threading.Lock()
+
+    def registrar(self, metrica):
+        with self._lock:
+            # reimportar um módulo devolve a métrica existente
+            return self._metricas.setdefault(metrica.nome, metrica)
+
+    def expor(self):
+        with self._lock:
+            metricas = list(self._metricas.values())
+        linhas = []
+        for m in metricas:
+            linhas.extend(m.expor())
+        return '\n'.join(linhas) + '\n'
+
+
+REGISTRO = Registro()
+
+
+def contador(nome, ajuda, rotulos=()):
+    return REGISTRO.registrar(Contador(nome, ajuda, rotulos))
+
+
+def gauge(nome, ajuda, rotulos=(), coletar=None):
+    return REGISTRO.registrar(Gauge(nome, ajuda, rotulos, coletar))
+
+
+def histograma(nome, ajuda, rotulos=(), buckets=BUCKETS_PADRAO):
+    return REGISTRO.registrar(Histograma(nome, ajuda, rotulos, buckets))
+
+
+HTTP_SEGUNDOS = histograma('http_requisicao_segundos', 'Duração das requisições por rota.', ('rota', 'metodo', 'status'))
+STORAGE_SEGUNDOS = histograma('storage_operacao_segundos', 'Duração das funções de storage.py.', ('funcao',))
+FILA_SEGUNDOS = histograma('fila_operacao_segundos', 'Duração das operações de fila.', ('backend', 'operacao'))
+ATRIBUICOES = contador('atribuicoes_total', 'Entregas atribuídas.', ('origem',))
+REENFILEIRADAS = contador('worker_reenfileiradas_total', 'Entregas reenfileiradas pelo worker.', ('motivo',))
+MENSAGENS_DLQ = contador('fila_dlq_total', 'Mensagens movidas para a dead-letter queue.', ('motivo',))
+ATRIBUICAO_LATENCIA = histograma('atribuicao_latencia_segundos', 'Tempo do enqueue até a atribuição.', ('origem',), BUCKETS_LATENCIA)
+ATRIBUICOES_POR_SEGUNDO = gauge('worker_atribuicoes_por_segundo', 'Atribuições/s do worker no último intervalo de relatório.')
+
+
+def registrar_atribuicao(origem, enfileirado_em=None):
+    """Conta uma atribuição e, se o corpo trouxe `enfileirado_em`, a latência desde o enqueue."""
+    ATRIBUICOES.inc(origem=origem)
+    if enfileirado_em:
+        ATRIBUICAO_LATENCIA.observar(max(0.0, time.time() - float(enfileirado_em)), origem=origem)
+
+
+def medir_storage(nome, func):
+    return STORAGE_SEGUNDOS.cronometrar(funcao=nome)(func)
+
+
+def medir_fila(backend, operacao):
+    return FILA_SEGUNDOS.cronometrar(backend=backend, operacao=operacao)
+
+
+def init_app(app):
+    """Histograma por rota (template da URL) e endpoint `/metrics`."""
+    from flask import Response, g, request
+
+    @app.before_request
+    def _inicio_requisicao():
+        g._metricas_inicio = time.perf_counter()
+
+    @app.after_request
+    def _fim_requisicao(resposta):
+        inicio = g.pop('_metricas_inicio', None)
+        if inicio is not None:
+            rota = request.url_rule.rule if request.url_rule is not None else 'desconhecida'
+            HTTP_SEGUNDOS.observar(time.perf_counter() - inicio, rota=rota, metodo=request.method, status=resposta.status_code)
+        return resposta
+
+    @app.route('/metrics', methods=['GET'])
+    def metrics():
+        # cada coleta consulta a fila (no SQS, chamadas cobradas): só com o token
+        if not autorizado(request.headers.get('Authorization')):
+            return Response('acesso proibido\n', status=403, content_type='text/plain; charset=utf-8')
+        return Response(REGISTRO.expor(), content_type=CONTENT_TYPE)
+
+
+def autorizado(cabecalho, exigir=True):
+    """Confere o header Authorization contra `METRICS_TOKEN`; sem token configurado, vale `not exigir`."""
+    if not METRICS_TOKEN:
+        return not exigir
+    return hmac.compare_digest((cabecalho or '').encode(), ('Bearer ' + METRICS_TOKEN).encode())
+
+
+class _Handler(BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        if self.path.split('?')[0] != '/metrics':
+            self.send_error(404)
+            return
+        if not autorizado(self.headers.get('Authorization'), exigir=False):
+            self.send_error(403)
+            return
+        corpo = REGISTRO.expor().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', CONTENT_TYPE)
+        self.send_header('Content-Length', str(len(corpo)))
+        self.end_headers()
+        self.wfile.write(corpo)
+
+    def log_message(self, *args):
+        pass
+
+
+def servir(porta=WORKER_METRICS_PORT, host=WORKER_METRICS_HOST):
+    """Sobe `/metrics` numa thread daemon (usado pelo worker; porta 0 = porta livre qualquer).
+
+    Retorna o servidor, ou None se a porta não pôde ser aberta.
+    """
+    try:
+        servidor = ThreadingHTTPServer((host, porta), _Handler)
+    except OSError as e:
+        logger.warning('não foi possível expor métricas na porta %s: %s', porta, e)
+        return None
+    servidor.daemon_threads = True
+    threading.Thread(target=servidor.serve_forever, name='metricas-http', daemon=True).start()
+    logger.info('Métricas em http://%s:%s/metrics', host, servidor.server_address[1])
+    return servidor
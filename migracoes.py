@@ -0,0 +1,155 @@
+"""Migrações versionadas do schema SQLAlchemy.
+
+`db.create_all()` só cria tabelas que ainda não existem; índices e restrições
+adicionados depois aos modelos não chegam a um `app.db`/Postgres já em uso.
+Cada migração abaixo é aplicada uma única vez e registrada na tabela
+`schema_versao`.
+
+Os comandos são idempotentes (`IF NOT EXISTS`), então rodar as migrações num
+banco recém-criado por `create_all` apenas registra as versões. No Postgres os
+índices são criados com `CONCURRENTLY`, sem bloquear escritas nas tabelas; um
+build concorrente que falha deixa o índice INVALID (que o `IF NOT EXISTS`
+pularia), então ele é removido e a migração falha sem ser registrada. No
+SQLite o `CREATE INDEX` segura o lock de escrita só durante a construção.
+
+Uso: `python migracoes.py` (usa DATABASE_URL) ou `aplicar_migracoes()` dentro
+de um app context.
+"""
+from datetime import datetime
+
+from sqlalchemy import inspect, text
+from sqlalchemy.exc import IntegrityError
+
+from modelos import db
+
+
+def _indice(dialeto, nome, tabela, colunas, unico=False):
+    return 'CREATE %sINDEX %sIF NOT EXISTS %s ON %s (%s)' % (
+        'UNIQUE ' if unico else '',
+        'CONCURRENTLY ' if dialeto == 'postgresql' else '',
+        nome,
+        tabela,
+        ', '.join(colunas),
+    )
+
+
+def _indice_valido(conn, nome):
+    """`pg_index.indisvalid` do índice `nome`; None se ele não existe."""
+    return conn.execute(text('SELECT indisvalid FROM pg_index WHERE indexrelid = to_regclass(:nome)'), {'nome': nome}).scalar()
+
+
+def _criar_indice(conn, dialeto, nome, tabela, colunas, unico=False):
+    """CREATE INDEX idempotente; no Postgres não deixa para trás um índice INVALID."""
+    if dialeto != 'postgresql':
+        conn.execute(text(_indice(dialeto, nome, tabela, colunas, unico)))
+        return
+    if _indice_valido(conn, nome) is False:
+        # sobra de um build concorrente interrompido numa execução anterior
+        conn.execute(text('DROP INDEX CONCURRENTLY IF EXISTS %s' % nome))
+    erro = None
+    try:
+        conn.execute(text(_indice(dialeto, nome, tabela, colunas, unico)))
+    except Exception as e:
+        erro = e
+    if _indice_valido(conn, nome) is False:
+        conn.execute(text('DROP INDEX CONCURRENTLY IF EXISTS %s' % nome))
+        raise RuntimeError('índice %s ficou INVALID após CREATE INDEX CONCURRENTLY e foi removido' % nome) from erro
+    if erro is not None:
+        raise erro
+
+
+def _verificar_nomes_unicos(conn):
+    duplicados = [r[0] for r in conn.execute(text('SELECT name FROM entregador GROUP BY name HAVING COUNT(*) > 1'))]
+    if duplicados:
+        raise RuntimeError('nomes de entregador duplicados impedem o índice único: %s' % ', '.join(duplicados))
+
+
+def _m001_indices(conn, dialeto):
+    for nome, tabela, colunas in (
+        ('ix_entrega_status_id', 'entrega', ['status', 'id']),
+        ('ix_entrega_assigned_driver_id_id', 'entrega', ['assigned_driver_id', 'id']),
+        ('ix_entrega_created_at', 'entrega', ['created_at']),
+        ('ix_entregador_created_at', 'entregador', ['created_at']),
+    ):
+        _criar_indice(conn, dialeto, nome, tabela, colunas)
+
+
+def _m002_nome_entregador_unico(conn, dialeto):
+    _verificar_nomes_unicos(conn)
+    _criar_indice(conn, dialeto, 'ix_entregador_name', 'entregador', ['name'], unico=True)
+
+
+def _m003_outbox(conn, dialeto):
+    colunas = {c['name'] for c in inspect(conn).get_columns('mensagem_fila')}
+    if 'enviada_em' not in colunas:
+        conn.execute(text('ALTER TABLE mensagem_fila ADD COLUMN enviada_em TIMESTAMP'))
+    if 'tentativas' not in colunas:
+        conn.execute(text('ALTER TABLE mensagem_fila ADD COLUMN tentativas INTEGER NOT NULL DEFAULT 0'))
+    _criar_indice(conn, dialeto, 'ix_mensagem_fila_enviada_em_id', 'mensagem_fila', ['enviada_em', 'id'])
+
+
+def _m004_arquivamento(conn, dialeto):
+    # a tabela entrega_arquivada vem do create_all; aqui só a coluna nova de entrega
+    if 'atualizado_em' not in {c['name'] for c in inspect(conn).get_columns('entrega')}:
+        conn.execute(text('ALTER TABLE entrega ADD COLUMN atualizado_em TIMESTAMP'))
+
+
+# (versão, descrição, função(conn, dialeto)) — nunca reordenar nem editar migrações já publicadas
+MIGRACOES = [
+    (1, 'índices de entrega (status, entregador, created_at) e entregador (created_at)', _m001_indices),
+    (2, 'índice único em entregador.name', _m002_nome_entregador_unico),
+    (3, 'mensagem_fila como outbox (enviada_em, tentativas)', _m003_outbox),
+    (4, 'entrega.atualizado_em para o arquivamento', _m004_arquivamento),
+]
+
+
+def _garantir_tabela_versao(conn):
+    conn.execute(text(
+        'CREATE TABLE IF NOT EXISTS schema_versao ('
+        'versao INTEGER PRIMARY KEY, descricao VARCHAR(200), aplicada_em TIMESTAMP)'
+    ))
+
+
+def versoes_aplicadas(engine=None):
+    engine = engine or db.engine
+    with engine.connect().execution_options(isolation_level='AUTOCOMMIT') as conn:
+        _garantir_tabela_versao(conn)
+        return {r[0] for r in conn.execute(text('SELECT versao FROM schema_versao'))}
+
+
+def aplicar_migracoes(engine=None):
+    """Aplica, em ordem, as migrações ainda não registradas. Retorna as versões aplicadas."""
+    engine = engine or db.engine
+    aplicadas = versoes_aplicadas(engine)
+    novas = []
+    # AUTOCOMMIT: CREATE INDEX CONCURRENTLY não pode rodar dentro de transação
+    with engine.connect().execution_options(isolation_level='AUTOCOMMIT') as conn:
+        for versao, descricao, migrar in MIGRACOES:
+            if versao in aplicadas:
+                continue
+            migrar(conn, engine.dialect.name)
+            try:
+                conn.execute(
+                    text('INSERT INTO schema_versao (versao, descricao, aplicada_em) VALUES (:v, :d, :t)'),
+                    {'v': versao, 'd': descricao, 't': datetime.utcnow()},
+                )
+            except IntegrityError:
+                # outro processo aplicou a mesma migração em paralelo
+                pass
+            novas.append(versao)
+    return novas
+
+
+if __name__ == '__main__':
+    import os
+    from flask import Flask
+    from storage import iniciar_armazenamento
+
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = os.getenv('DATABASE_URL', 'sqlite:///app.db')
+    iniciar_armazenamento(app)
+    with app.app_context():
+        db.create_all()
+        novas = aplicar_migracoes()
+        print('migrações aplicadas agora:', novas or 'nenhuma')
+        print('versões no banco:', sorted(versoes_aplicadas()))
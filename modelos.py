@@ -5,6 +5,11 @@ db = SQLAlchemy()
 
 
 class Entregador(db.Model):
+    __table_args__ = (
+        db.Index('ix_entregador_name', 'name', unique=True),
+        db.Index('ix_entregador_created_at', 'created_at'),
+    )
+
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(120), nullable=False)
     phone = db.Column(db.String(40), nullable=True)
@@ -13,6 +18,13 @@ class Entregador(db.Model):
 
 
 class Entrega(db.Model):
+    # os índices compostos terminam em id para servir filtros + paginação por keyset
+    __table_args__ = (
+        db.Index('ix_entrega_status_id', 'status', 'id'),
+        db.Index('ix_entrega_assigned_driver_id_id', 'assigned_driver_id', 'id'),
+        db.Index('ix_entrega_created_at', 'created_at'),
+    )
+
     id = db.Column(db.Integer, primary_key=True)
     restaurant = db.Column(db.String(200), nullable=False)
     pickup_address = db.Column(db.String(300), nullable=False)
@@ -20,13 +32,46 @@ class Entrega(db.Model):
     status = db.Column(db.String(50), default='enfileirado')
     assigned_driver_id = db.Column(db.Integer, db.ForeignKey('entregador.id'), nullable=True)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    # última mudança de status; o arquivamento conta a retenção a partir daqui
+    atualizado_em = db.Column(db.DateTime, nullable=True)
+
+
+class EntregaArquivada(db.Model):
+    """Entregas `entregue` movidas para fora de `entrega` pelo arquivamento (ver arquivamento.py).
+
+    Mesmas colunas de `Entrega`, com o mesmo id; `obter_entrega` procura aqui
+    quando o id não está mais na tabela ativa.
+    """
+    id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    restaurant = db.Column(db.String(200), nullable=False)
+    pickup_address = db.Column(db.String(300), nullable=False)
+    customer_address = db.Column(db.String(300), nullable=False)
+    status = db.Column(db.String(50))
+    assigned_driver_id = db.Column(db.Integer, nullable=True)
+    created_at = db.Column(db.DateTime)
+    atualizado_em = db.Column(db.DateTime, nullable=True)
+    arquivada_em = db.Column(db.DateTime, default=datetime.utcnow)
 
 
 class MensagemFila(db.Model):
-    """Tabela de fila persistente simples que armazena IDs de entregas em ordem FIFO.
-    Este modelo era usado para simular uma fila SQS em cenários de demonstração.
+    """Outbox transacional da fila de entregas.
+
+    Cada entrega criada grava aqui uma linha no mesmo commit; o relay em
+    `outbox.py` publica as linhas pendentes (`enviada_em` nulo) na fila em
+    lotes e as marca como enviadas.
     """
+    __table_args__ = (
+        db.Index('ix_mensagem_fila_enviada_em_id', 'enviada_em', 'id'),
+    )
+
     id = db.Column(db.Integer, primary_key=True)
     delivery_id = db.Column(db.Integer, db.ForeignKey('entrega.id'), nullable=False)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    enviada_em = db.Column(db.DateTime, nullable=True)
+    tentativas = db.Column(db.Integer, nullable=False, default=0)
+
 
+class CursorDispatch(db.Model):
+    """Contadores compartilhados entre processos do worker (ex.: cursor do round-robin)."""
+    nome = db.Column(db.String(50), primary_key=True)
+    valor = db.Column(db.Integer, nullable=False, default=0)
@@ -0,0 +1,112 @@
+"""Relay do outbox transacional (`MensagemFila`) para a fila.
+
+`POST /orders` grava a entrega e a linha do outbox no mesmo commit e responde
+sem falar com o SQS. Este relay lê as linhas pendentes em lotes, publica com
+`send_messages` (send_message_batch) e marca as enviadas; falhas ficam
+pendentes para o próximo ciclo, com `tentativas` incrementado.
+
+A entrega é at-least-once: se o processo cair entre o envio e o commit, a
+mensagem é publicada de novo e o worker descarta a duplicata na atribuição
+(compare-and-set). Roda como thread dentro da API (`OUTBOX_RELAY=app`, padrão)
+ou como processo separado: `python outbox.py`.
+"""
+import logging
+import os
+import threading
+from datetime import datetime, timedelta
+
+from fila import get_queue
+from storage import listar_outbox_pendente, marcar_outbox_enviada, registrar_falha_outbox, limpar_outbox_enviado, encerrar_sessao
+
+OUTBOX_LOTE = int(os.getenv('OUTBOX_BATCH_SIZE', '100'))
+OUTBOX_INTERVALO = float(os.getenv('OUTBOX_POLL_INTERVAL', '0.5'))
+# linhas já publicadas são apagadas depois deste período (horas)
+OUTBOX_RETENCAO_HORAS = float(os.getenv('OUTBOX_RETENTION_HOURS', '24'))
+
+logger = logging.getLogger('outbox-relay')
+
+
+class RelayOutbox:
+
+    def __init__(self, app, q=None, lote=OUTBOX_LOTE, intervalo=OUTBOX_INTERVALO):
+        self.app = app
+        self.q = q
+        self.lote = lote
+        self.intervalo = intervalo
+        self.publicadas = 0
+        self.parar = threading.Event()
+        self._thread = None
+        self._ultima_limpeza = None
+
+    def publicar_pendentes(self):
+        """Um ciclo: publica até `lote` linhas pendentes. Retorna quantas foram publicadas."""
+        pendentes = listar_outbox_pendente(self.lote)
+        if not pendentes:
+            marcar_outbox_enviada([])  # encerra a transação (e os locks no Postgres)
+            return 0
+        if self.q is None:
+            self.q = get_queue()
+        try:
+            res = self.q.send_messages([entrega for _, entrega in pendentes])
+            enviadas = {r['id_entrega'] for r in res.get('Successful', [])}
+        except Exception as e:
+            logger.error('falha ao publicar lote do outbox: %s', e)
+            enviadas = set()
+        ok = [id_outbox for id_outbox, entrega in pendentes if entrega['id'] in enviadas]
+        falhas = [id_outbox for id_outbox, entrega in pendentes if entrega['id'] not in enviadas]
+        marcar_outbox_enviada(ok)
+        if falhas:
+            logger.warning('%s mensagens do outbox não publicadas; nova tentativa no próximo ciclo', len(falhas))
+            registrar_falha_outbox(falhas)
+        self.publicadas += len(ok)
+        return len(ok)
+
+    def _limpar(self):
+        agora = datetime.utcnow()
+        if self._ultima_limpeza and agora - self._ultima_limpeza < timedelta(hours=1):
+            return
+        self._ultima_limpeza = agora
+        n = limpar_outbox_enviado(agora - timedelta(hours=OUTBOX_RETENCAO_HORAS))
+        if n:
+            logger.info('%s linhas antigas do outbox removidas', n)
+
+    def executar(self):
+        with self.app.app_context():
+            while not self.parar.is_set():
+                try:
+                    publicadas = self.publicar_pendentes()
+                    self._limpar()
+                except Exception as e:
+                    logger.exception('erro no relay do outbox: %s', e)
+                    publicadas = 0
+                finally:
+                    encerrar_sessao()
+                # lote cheio: provavelmente há mais pendentes, seguir sem esperar
+                if publicadas < self.lote:
+                    self.parar.wait(self.intervalo)
+
+    def iniciar(self):
+        self._thread = threading.Thread(target=self.executar, name='outbox-relay', daemon=True)
+        self._thread.start()
+        return self
+
+    def encerrar(self, timeout=None):
+        self.parar.set()
+        if self._thread:
+            self._thread.join(timeout)
+
+
+if __name__ == '__main__':
+    import signal
+
+    logging.basicConfig(level=logging.INFO, format='[%(asctime)s] %(levelname)s: %(message)s')
+    os.environ['OUTBOX_RELAY'] = 'off'
+    from app import create_app
+
+    relay = RelayOutbox(create_app())
+    signal.signal(signal.SIGTERM, lambda *_: relay.parar.set())
+    try:
+        relay.executar()
+    except KeyboardInterrupt:
+        pass
+    logger.info('relay encerrado: %s mensagens publicadas', relay.publicadas)
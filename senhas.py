@@ -0,0 +1,114 @@
+"""Política de hash de senhas dos entregadores.
+
+O custo do hash é configurável (`PASSWORD_HASH_METHOD`, no formato do
+werkzeug, ex.: `pbkdf2:sha256:600000` ou `scrypt:32768:8:1`) e o cálculo roda
+num pool de processos (`PASSWORD_HASH_WORKERS`; 0 = na própria thread), de modo
+que rajadas de login não ocupam as threads do Flask nem o GIL. Hashes gravados
+com outro método são refeitos no próximo login bem-sucedido (`precisa_rehash`).
+
+Logins repetidos dentro de `LOGIN_CACHE_TTL` segundos não recalculam o hash: o
+resultado de cada verificação bem-sucedida fica num cache LRU chaveado por um
+HMAC (com chave aleatória do processo) de nome, senha e hash armazenado. Trocar
+a senha muda o hash armazenado e invalida a entrada automaticamente.
+"""
+import atexit
+import hashlib
+import hmac
+import multiprocessing
+import os
+import secrets
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+
+from werkzeug.security import generate_password_hash, check_password_hash
+
+HASH_METHOD = os.getenv('PASSWORD_HASH_METHOD', 'pbkdf2:sha256:600000')
+HASH_WORKERS = int(os.getenv('PASSWORD_HASH_WORKERS', str(os.cpu_count() or 1)))
+LOGIN_CACHE_TTL = float(os.getenv('LOGIN_CACHE_TTL', '300'))
+LOGIN_CACHE_MAX = int(os.getenv('LOGIN_CACHE_MAX', '10000'))
+
+_pool = None
+_pool_lock = threading.Lock()
+_metodo = None
+
+_cache = OrderedDict()
+_cache_lock = threading.Lock()
+_cache_chave = secrets.token_bytes(32)
+
+
+def _executor():
+    global _pool
+    if HASH_WORKERS <= 0:
+        return None
+    with _pool_lock:
+        if _pool is None:
+            # spawn: o processo da API tem várias threads, fork não é seguro
+            _pool = ProcessPoolExecutor(max_workers=HASH_WORKERS, mp_context=multiprocessing.get_context('spawn'))
+            atexit.register(encerrar_pool)
+    return _pool
+
+
+def encerrar_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.shutdown(wait=False, cancel_futures=True)
+            _pool = None
+
+
+def _executar(func, *args):
+    pool = _executor()
+    if pool is None:
+        return func(*args)
+    return pool.submit(func, *args).result()
+
+
+def gerar_hash(senha):
+    return _executar(generate_password_hash, senha, HASH_METHOD)
+
+
+def verificar_senha(password_hash, senha):
+    return _executar(check_password_hash, password_hash, senha)
+
+
+def precisa_rehash(password_hash):
+    """True se o hash foi gerado com um método/custo diferente da política atual."""
+    global _metodo
+    if _metodo is None:
+        # o werkzeug normaliza o método (ex.: acrescenta as iterações padrão)
+        _metodo = _executar(generate_password_hash, '', HASH_METHOD).split('$', 1)[0]
+    return password_hash.split('$', 1)[0] != _metodo
+
+
+def _chave_cache(nome, senha, password_hash):
+    msg = '\0'.join((nome, senha, password_hash)).encode('utf-8')
+    return hmac.new(_cache_chave, msg, hashlib.sha256).digest()
+
+
+def verificar_login(nome, senha, password_hash):
+    """Verifica a senha, consultando antes o cache de credenciais verificadas."""
+    chave = _chave_cache(nome, senha, password_hash)
+    agora = time.monotonic()
+    with _cache_lock:
+        expira_em = _cache.get(chave)
+        if expira_em is not None:
+            if expira_em > agora:
+                _cache.move_to_end(chave)
+                return True
+            del _cache[chave]
+    if not verificar_senha(password_hash, senha):
+        return False
+    if LOGIN_CACHE_TTL > 0:
+        with _cache_lock:
+            _cache[chave] = agora + LOGIN_CACHE_TTL
+            _cache.move_to_end(chave)
+            while len(_cache) > LOGIN_CACHE_MAX:
+                _cache.popitem(last=False)
+    return True
+
+
+def limpar_cache():
+    with _cache_lock:
+        _cache.clear()
@@ -1,32 +1,162 @@
+import functools
+import logging
 import os
+from datetime import datetime, timezone
 from typing import Optional
 
+import cache_entregas
+import metricas
+
 USAR_TINYDB = os.getenv('USE_TINYDB', 'false').lower() == 'true'
+# perfil do engine SQLAlchemy: 'producao' (PRAGMAs no SQLite, pool no Postgres,
+# sem expire_on_commit) ou 'padrao' (defaults do SQLAlchemy)
+PERFIL_ENGINE = os.getenv('DB_ENGINE_PROFILE', 'producao')
+SQLITE_BUSY_TIMEOUT_MS = int(os.getenv('SQLITE_BUSY_TIMEOUT_MS', '5000'))
+SQLITE_SYNCHRONOUS = os.getenv('SQLITE_SYNCHRONOUS', 'NORMAL').upper()
+DB_POOL_SIZE = int(os.getenv('DB_POOL_SIZE', '10'))
+DB_MAX_OVERFLOW = int(os.getenv('DB_MAX_OVERFLOW', '20'))
+DB_POOL_RECYCLE = int(os.getenv('DB_POOL_RECYCLE', '1800'))
 
 if USAR_TINYDB:
     from tiny_store import (
         init_tinydb,
         criar_entregador_td,
         obter_entregador_por_nome_td,
+        atualizar_hash_entregador_td,
         listar_entregadores_td,
+        listar_entregadores_resumo_td,
         criar_entrega_td,
+        criar_entregas_td,
         listar_entregas_td,
         atribuir_entrega_td,
         atualizar_status_entrega_td,
+        listar_entregas_ativas_td,
         obter_entrega_td,
-        enviar_mensagem_td,
-        receber_mensagem_td,
-        deletar_mensagem_td,
+        obter_entregas_td,
+        avancar_cursor_td,
+        arquivar_entregas_td,
     )
 else:
-    from models import db, Entregador as Driver, Entrega as Delivery
+    from sqlalchemy import delete, event, func, insert, literal, select, update, DateTime
+    from sqlalchemy.exc import IntegrityError
+    from modelos import db, Entregador as Driver, Entrega as Delivery, EntregaArquivada, CursorDispatch, MensagemFila
+
+# exceção compartilhada pelos dois backends; a fila local tem arquivo próprio
+# e funciona com qualquer um deles
+from tiny_store import (
+    EntregaJaAtribuida,
+    enviar_mensagem_td,
+    enviar_mensagens_td,
+    receber_mensagem_td,
+    receber_mensagens_td,
+    deletar_mensagem_td,
+    deletar_mensagens_td,
+    estatisticas_fila_td,
+    adiar_mensagens_td,
+    mover_para_dlq_td,
+    listar_dlq_td,
+    reprocessar_dlq_td,
+)
+
+logger = logging.getLogger('storage')
+
+# status em que a entrega ocupa o entregador
+STATUS_ATIVOS = ('atribuido', 'coletado')
+
+# funções chamadas com a entrega depois de cada atribuição/mudança de status
+_ouvintes = []
+
+# cache de leitura de obter_entrega (ver cache_entregas.py); None se desligado
+_cache_entregas = cache_entregas.criar_cache()
+metricas.gauge('cache_entregas_consultas', 'Consultas ao cache de obter_entrega por resultado.', ('resultado',), coletar=lambda: {
+    k: v for k, v in (estatisticas_cache_entregas() or {}).items() if k in ('hits', 'misses', 'erros')
+})
 
 
 def iniciar_armazenamento(app):
     if USAR_TINYDB:
         init_tinydb()
     else:
-        db.init_app(app)
+        _configurar_engine(app)
+    if _cache_entregas is not None:
+        _cache_entregas.limpar()
+
+def opcoes_engine(url, perfil=None):
+    """SQLALCHEMY_ENGINE_OPTIONS do perfil para a URL do banco."""
+    if (perfil or PERFIL_ENGINE) == 'padrao':
+        return {}
+    if url.startswith('postgres'):
+        # pre_ping descarta conexões derrubadas pelo servidor/proxy antes de usá-las
+        return {'pool_size': DB_POOL_SIZE, 'max_overflow': DB_MAX_OVERFLOW, 'pool_pre_ping': True, 'pool_recycle': DB_POOL_RECYCLE}
+    return {}
+
+def _pragmas_sqlite(conexao, _registro):
+    # WAL: leitores não bloqueiam o escritor (API e worker no mesmo arquivo);
+    # busy_timeout: escritores concorrentes esperam em vez de falhar com "database is locked"
+    cursor = conexao.cursor()
+    try:
+        cursor.execute('PRAGMA journal_mode=WAL')
+        cursor.execute('PRAGMA synchronous=%s' % SQLITE_SYNCHRONOUS)
+        cursor.execute('PRAGMA busy_timeout=%d' % SQLITE_BUSY_TIMEOUT_MS)
+    finally:
+        cursor.close()
+
+def _configurar_engine(app):
+    """Aplica `PERFIL_ENGINE` ao engine e às sessões do Flask-SQLAlchemy."""
+    if SQLITE_SYNCHRONOUS not in ('OFF', 'NORMAL', 'FULL', 'EXTRA'):
+        raise ValueError('SQLITE_SYNCHRONOUS inválido: %s' % SQLITE_SYNCHRONOUS)
+    opcoes = app.config.setdefault('SQLALCHEMY_ENGINE_OPTIONS', {})
+    for chave, valor in opcoes_engine(app.config.get('SQLALCHEMY_DATABASE_URI', '')).items():
+        opcoes.setdefault(chave, valor)
+    db.init_app(app)
+    producao = PERFIL_ENGINE != 'padrao'
+    # criar_entrega/atualizar_status montam o dict depois do commit: sem expirar, isso não relê a linha.
+    # Processos com app context longo (worker, relay) chamam `encerrar_sessao` a cada lote.
+    db.session.session_factory.configure(expire_on_commit=not producao)
+    with app.app_context():
+        if producao and db.engine.dialect.name == 'sqlite':
+            event.listen(db.engine, 'connect', _pragmas_sqlite)
+
+def encerrar_sessao():
+    """Descarta a sessão SQLAlchemy da thread (identity map incluído); no TinyDB não faz nada."""
+    if not USAR_TINYDB:
+        db.session.remove()
+
+
+def _invalida_entrega(func):
+    """Remove a entrega do cache depois da escrita, inclusive quando ela falha."""
+    @functools.wraps(func)
+    def wrapper(delivery_id, *args, **kwargs):
+        try:
+            return func(delivery_id, *args, **kwargs)
+        finally:
+            if _cache_entregas is not None:
+                _cache_entregas.invalidar(delivery_id)
+    return wrapper
+
+def registrar_ouvinte(func):
+    """Chama `func(entrega)` depois de cada `atribuir_entrega`/`atualizar_status_entrega` bem-sucedido.
+
+    `entrega` tem ao menos `id` e `status` (e `id_entregador` quando conhecido).
+    Vale só para as escritas feitas neste processo.
+    """
+    _ouvintes.append(func)
+    return func
+
+def remover_ouvinte(func):
+    if func in _ouvintes:
+        _ouvintes.remove(func)
+
+def _publicar_alteracao(entrega):
+    for func in list(_ouvintes):
+        try:
+            func(entrega)
+        except Exception as e:
+            logger.warning('falha no ouvinte %s: %s', getattr(func, '__name__', func), e)
+
+def estatisticas_cache_entregas():
+    """Contadores de hits/misses do cache de `obter_entrega` (None se desligado)."""
+    return _cache_entregas.estatisticas() if _cache_entregas is not None else None
 
 # Drivers
 def criar_entregador(name, phone, password_hash):
@@ -34,7 +164,12 @@ def criar_entregador(name, phone, password_hash):
         return criar_entregador_td(name, phone, password_hash)
     d = Driver(name=name, phone=phone, password_hash=password_hash)
     db.session.add(d)
-    db.session.commit()
+    try:
+        db.session.commit()
+    except IntegrityError:
+        # nome já cadastrado (índice único em entregador.name)
+        db.session.rollback()
+        return None
     return {'id': d.id, 'name': d.name, 'phone': d.phone, 'password_hash': d.password_hash}
 
 def obter_entregador_por_nome(name):
@@ -45,6 +180,13 @@ def obter_entregador_por_nome(name):
         return None
     return {'id': d.id, 'name': d.name, 'phone': d.phone, 'password_hash': d.password_hash}
 
+def atualizar_hash_entregador(driver_id, password_hash):
+    if USAR_TINYDB:
+        return atualizar_hash_entregador_td(driver_id, password_hash)
+    db.session.execute(update(Driver).where(Driver.id == int(driver_id)).values(password_hash=password_hash).execution_options(synchronize_session=False))
+    db.session.commit()
+    return True
+
 def listar_entregadores():
     if USAR_TINYDB:
         return listar_entregadores_td()
@@ -54,75 +196,336 @@ def listar_entregadores():
         out.append({'id': d.id, 'name': d.name, 'phone': d.phone, 'password_hash': d.password_hash})
     return out
 
+def listar_entregadores_resumo():
+    """Lista só os campos usados no dispatch (id e nome), sem password_hash."""
+    if USAR_TINYDB:
+        return listar_entregadores_resumo_td()
+    query = db.session.query(Driver.id, Driver.name)
+    return [{'id': i, 'name': n} for i, n in query.order_by(Driver.created_at.desc()).all()]
+
 # Deliveries
-def criar_entrega(restaurant, pickup_address, customer_address, status='enfileirado'):
+def criar_entrega(restaurant, pickup_address, customer_address, status='enfileirado', outbox=False):
+    """Cria a entrega. Com `outbox=True` grava também a linha do outbox no mesmo commit."""
     if USAR_TINYDB:
         return criar_entrega_td(restaurant, pickup_address, customer_address, status)
     o = Delivery(restaurant=restaurant, pickup_address=pickup_address, customer_address=customer_address, status=status)
     db.session.add(o)
+    if outbox:
+        db.session.flush()
+        db.session.add(MensagemFila(delivery_id=o.id))
     db.session.commit()
     return {'id': o.id, 'restaurante': o.restaurant, 'endereco_retirada': o.pickup_address, 'endereco_cliente': o.customer_address, 'status': o.status, 'id_entregador': o.assigned_driver_id}
 
-def listar_entregas():
+def criar_entregas(itens, status='enfileirado', outbox=False):
+    """Cria várias entregas num único insert/commit. `itens`: [(restaurante, retirada, cliente)].
+
+    Retorna as entregas na mesma ordem de `itens`. Com `outbox=True` as linhas do
+    outbox entram no mesmo commit.
+    """
+    itens = list(itens)
+    if not itens:
+        return []
     if USAR_TINYDB:
-        return listar_entregas_td()
-    items = Delivery.query.order_by(Delivery.created_at.desc()).all()
-    out = []
-    for o in items:
-        out.append({'id': o.id, 'restaurante': o.restaurant, 'endereco_retirada': o.pickup_address, 'endereco_cliente': o.customer_address, 'status': o.status, 'id_entregador': o.assigned_driver_id})
-    return out
+        return criar_entregas_td(itens, status)
+    agora = datetime.utcnow()
+    linhas = [{'restaurant': r, 'pickup_address': p, 'customer_address': c, 'status': status, 'created_at': agora} for r, p, c in itens]
+    # INSERT ... RETURNING em lote (insertmanyvalues), ids na ordem dos parâmetros
+    ids = db.session.scalars(insert(Delivery).returning(Delivery.id, sort_by_parameter_order=True), linhas).all()
+    if outbox:
+        db.session.execute(insert(MensagemFila), [{'delivery_id': i, 'created_at': agora} for i in ids])
+    db.session.commit()
+    return [
+        {'id': i, 'restaurante': l['restaurant'], 'endereco_retirada': l['pickup_address'], 'endereco_cliente': l['customer_address'], 'status': status, 'id_entregador': None}
+        for i, l in zip(ids, linhas)
+    ]
+
+def _entrega_para_dict(o):
+    return {'id': o.id, 'restaurante': o.restaurant, 'endereco_retirada': o.pickup_address, 'endereco_cliente': o.customer_address, 'status': o.status, 'id_entregador': o.assigned_driver_id}
+
+def listar_entregas(limit=None, after_id=None, status=None, id_entregador=None):
+    """Lista entregas da mais recente para a mais antiga (id decrescente).
+
+    Paginação por keyset: `after_id` é o último id da página anterior e a
+    próxima página começa no id imediatamente menor. `status` e
+    `id_entregador` filtram o resultado.
+    """
+    if USAR_TINYDB:
+        return listar_entregas_td(limit, after_id, status, id_entregador)
+    query = Delivery.query
+    if status:
+        query = query.filter(Delivery.status == status)
+    if id_entregador is not None:
+        query = query.filter(Delivery.assigned_driver_id == int(id_entregador))
+    if after_id is not None:
+        query = query.filter(Delivery.id < int(after_id))
+    query = query.order_by(Delivery.id.desc())
+    if limit is not None:
+        query = query.limit(int(limit))
+    return [_entrega_para_dict(o) for o in query.all()]
+
+def iterar_entregas(status=None, id_entregador=None, tamanho_pagina=500):
+    """Gera todas as entregas filtradas, página a página, sem materializar a tabela."""
+    if USAR_TINYDB:
+        # o TinyDB lê o arquivo inteiro a cada consulta: uma única passada é mais barata
+        yield from listar_entregas_td(None, None, status, id_entregador)
+        return
+    after_id = None
+    while True:
+        pagina = listar_entregas(tamanho_pagina, after_id, status, id_entregador)
+        yield from pagina
+        if len(pagina) < tamanho_pagina:
+            return
+        after_id = pagina[-1]['id']
 
-def obter_entrega(delivery_id):
+def obter_entrega(delivery_id, usar_cache=True):
+    """Entrega por id, via cache de leitura. `usar_cache=False` vai direto ao banco."""
+    if _cache_entregas is None or not usar_cache:
+        return _carregar_entrega(delivery_id)
+    return _cache_entregas.obter(delivery_id, _carregar_entrega)
+
+def _carregar_entrega(delivery_id):
     if USAR_TINYDB:
         return obter_entrega_td(delivery_id)
-    o = Delivery.query.get(delivery_id)
+    # populate_existing: sem expire_on_commit o identity map pode ter uma cópia antiga
+    o = db.session.get(Delivery, int(delivery_id), populate_existing=True)
     if not o:
-        return None
-    return {'id': o.id, 'restaurante': o.restaurant, 'endereco_retirada': o.pickup_address, 'endereco_cliente': o.customer_address, 'status': o.status, 'id_entregador': o.assigned_driver_id}
+        # fora da tabela ativa: talvez já arquivada
+        o = db.session.get(EntregaArquivada, int(delivery_id))
+        if not o:
+            return None
+    return _entrega_para_dict(o)
 
-def atribuir_entrega(delivery_id, driver_id, status='atribuido'):
+def obter_entregas(delivery_ids):
+    """Busca várias entregas com um único `IN (...)`. Retorna {id: entrega}."""
+    ids = sorted({int(d) for d in delivery_ids})
+    if not ids:
+        return {}
     if USAR_TINYDB:
-        return atribuir_entrega_td(delivery_id, driver_id, status)
-    o = Delivery.query.get(delivery_id)
-    if not o:
-        return None
-    o.assigned_driver_id = driver_id
-    o.status = status
-    db.session.commit()
-    return {'id': o.id, 'restaurante': o.restaurant, 'endereco_retirada': o.pickup_address, 'endereco_cliente': o.customer_address, 'status': o.status, 'id_entregador': o.assigned_driver_id}
+        return obter_entregas_td(ids)
+    return {o.id: _entrega_para_dict(o) for o in Delivery.query.filter(Delivery.id.in_(ids)).all()}
+
+@_invalida_entrega
+def atribuir_entrega(delivery_id, driver_id, status='atribuido', status_esperado='enfileirado'):
+    """Atribui a entrega com compare-and-set: só altera se o status atual for `status_esperado`.
+
+    Retorna a entrega atribuída, None se ela não existir, e levanta
+    `EntregaJaAtribuida` quando outro worker/entregador ganhou a corrida.
+    """
+    if USAR_TINYDB:
+        res = atribuir_entrega_td(delivery_id, driver_id, status, status_esperado)
+    else:
+        res = _atribuir_entrega_sql(delivery_id, driver_id, status, status_esperado)
+    if res is not None:
+        _publicar_alteracao(res)
+    return res
+
+def _atribuir_entrega_sql(delivery_id, driver_id, status, status_esperado):
+    stmt = (
+        update(Delivery)
+        .where(Delivery.id == int(delivery_id), Delivery.status == status_esperado)
+        .values(assigned_driver_id=int(driver_id), status=status, atualizado_em=datetime.utcnow())
+        .execution_options(synchronize_session=False)
+    )
+    if db.engine.dialect.update_returning:
+        row = db.session.execute(stmt.returning(Delivery.id, Delivery.restaurant, Delivery.pickup_address, Delivery.customer_address, Delivery.status, Delivery.assigned_driver_id)).first()
+        db.session.commit()
+    else:
+        atualizado = db.session.execute(stmt).rowcount
+        db.session.commit()
+        row = db.session.get(Delivery, int(delivery_id), populate_existing=True) if atualizado else None
+    if row is None:
+        if db.session.get(Delivery, int(delivery_id)) is None:
+            return None
+        raise EntregaJaAtribuida(delivery_id)
+    return {'id': row.id, 'restaurante': row.restaurant, 'endereco_retirada': row.pickup_address, 'endereco_cliente': row.customer_address, 'status': row.status, 'id_entregador': row.assigned_driver_id}
 
+@_invalida_entrega
 def atualizar_status_entrega(delivery_id, status):
     if USAR_TINYDB:
-        return atualizar_status_entrega_td(delivery_id, status)
-    o = Delivery.query.get(delivery_id)
-    if not o:
-        return None
-    o.status = status
-    db.session.commit()
-    return {'id': o.id, 'status': o.status}
+        res = atualizar_status_entrega_td(delivery_id, status)
+    else:
+        o = db.session.get(Delivery, int(delivery_id), populate_existing=True)
+        if not o:
+            return None
+        o.status = status
+        o.atualizado_em = datetime.utcnow()
+        db.session.commit()
+        res = {'id': o.id, 'status': o.status, 'id_entregador': o.assigned_driver_id}
+    if res is not None:
+        _publicar_alteracao(res)
+    return res
 
-# Queue wrappers for tinydb (if used)
-def enviar_mensagem_fila(delivery_id):
+def listar_entregas_ativas():
+    """[(id_entrega, id_entregador)] das entregas em `STATUS_ATIVOS`, numa única consulta."""
     if USAR_TINYDB:
-        return enviar_mensagem_td(delivery_id)
-    raise RuntimeError('enviar_mensagem_fila: apenas suportado quando USE_TINYDB=true')
+        return listar_entregas_ativas_td(STATUS_ATIVOS)
+    rows = (
+        db.session.query(Delivery.id, Delivery.assigned_driver_id)
+        .filter(Delivery.status.in_(STATUS_ATIVOS), Delivery.assigned_driver_id.isnot(None))
+        .all()
+    )
+    return [(i, d) for i, d in rows]
 
-def receber_mensagem_fila():
+def arquivar_entregas(antes_de, limite=500, status='entregue'):
+    """Move até `limite` entregas em `status` sem mudança desde `antes_de` (datetime UTC) para o arquivo.
+
+    SQLAlchemy: `entrega_arquivada`, numa transação (com as linhas do outbox da
+    entrega); TinyDB: um arquivo gzip por lote. `obter_entrega` continua achando
+    as arquivadas; listagens e varreduras veem só a tabela ativa. A entrega de
+    maior id fica sempre na tabela ativa, senão o SQLite/TinyDB reusaria o id.
+    Retorna quantas foram arquivadas.
+    """
     if USAR_TINYDB:
-        return receber_mensagem_td()
-    raise RuntimeError('receber_mensagem_fila: apenas suportado quando USE_TINYDB=true')
+        return arquivar_entregas_td(antes_de, limite, status)
+    concluida = func.coalesce(Delivery.atualizado_em, Delivery.created_at)
+    ids = db.session.scalars(
+        select(Delivery.id)
+        .where(Delivery.status == status, concluida < antes_de, Delivery.id < select(func.max(Delivery.id)).scalar_subquery())
+        .order_by(Delivery.id)
+        .limit(int(limite))
+        .with_for_update(skip_locked=True)
+    ).all()
+    if not ids:
+        db.session.commit()
+        return 0
+    colunas = ['id', 'restaurant', 'pickup_address', 'customer_address', 'status', 'assigned_driver_id', 'created_at', 'atualizado_em']
+    origem = select(*[getattr(Delivery, c) for c in colunas], literal(datetime.utcnow(), DateTime)).where(Delivery.id.in_(ids))
+    db.session.execute(insert(EntregaArquivada).from_select(colunas + ['arquivada_em'], origem))
+    db.session.execute(delete(MensagemFila).where(MensagemFila.delivery_id.in_(ids)))
+    db.session.execute(delete(Delivery).where(Delivery.id.in_(ids)).execution_options(synchronize_session=False))
+    db.session.commit()
+    return len(ids)
+
+# Fila local (TinyDB, arquivo próprio; ver tiny_store.caminho_fila)
+def enviar_mensagem_fila(corpo):
+    return enviar_mensagem_td(corpo)
+
+def enviar_mensagens_fila(corpos):
+    return enviar_mensagens_td(corpos)
+
+def receber_mensagem_fila():
+    return receber_mensagem_td()
+
+def receber_mensagens_fila(max_n=10):
+    return receber_mensagens_td(max_n)
 
 def deletar_mensagem_fila(receipt_handle):
-    """Apaga mensagem da fila (apenas TinyDB suportado nesta camada).
+    """Apaga mensagem da fila local.
+
+    Para SQS use o adaptador em `fila.py` que expõe `delete_message`.
+    """
+    return deletar_mensagem_td(receipt_handle)
+
+def deletar_mensagens_fila(receipt_handles):
+    return deletar_mensagens_td(receipt_handles)
+
+def estatisticas_fila():
+    """`{'visiveis', 'em_voo', 'idade_mais_antiga'}` da fila local."""
+    return estatisticas_fila_td()
 
-    Para SQS use o adaptador em `queue.py` que expõe `delete_message`.
+def adiar_mensagens_fila(itens):
+    """[(receipt_handle, segundos)]: encerra os leases e atrasa a próxima entrega de cada mensagem."""
+    return adiar_mensagens_td(itens)
+
+def mover_para_dlq_fila(itens):
+    """[(receipt_handle, info)]: move as mensagens para a dead-letter queue local."""
+    return mover_para_dlq_td(itens)
+
+def listar_dlq_fila(limite=100):
+    return listar_dlq_td(limite)
+
+def reprocessar_dlq_fila(ids=None, limite=100):
+    return reprocessar_dlq_td(ids, limite)
+
+# Outbox (apenas SQLAlchemy)
+def listar_outbox_pendente(limite=100):
+    """Linhas do outbox ainda não publicadas, com os dados da entrega, numa única consulta.
+
+    No Postgres as linhas ficam travadas (FOR UPDATE SKIP LOCKED) até o próximo
+    commit, de modo que relays concorrentes não publicam as mesmas mensagens.
+    Retorna [(id_outbox, entrega)], com `enfileirado_em` = criação da linha.
+    """
+    if USAR_TINYDB:
+        raise RuntimeError('listar_outbox_pendente: apenas suportado com SQLAlchemy')
+    rows = (
+        db.session.query(MensagemFila.id, MensagemFila.created_at, Delivery)
+        .join(Delivery, Delivery.id == MensagemFila.delivery_id)
+        .filter(MensagemFila.enviada_em.is_(None))
+        .order_by(MensagemFila.id)
+        .limit(int(limite))
+        .with_for_update(skip_locked=True, of=MensagemFila)
+        .all()
+    )
+    out = []
+    for id_outbox, criada_em, o in rows:
+        entrega = _entrega_para_dict(o)
+        entrega['enfileirado_em'] = criada_em.replace(tzinfo=timezone.utc).timestamp() if criada_em else None
+        out.append((id_outbox, entrega))
+    return out
+
+def marcar_outbox_enviada(ids_outbox):
+    if USAR_TINYDB:
+        raise RuntimeError('marcar_outbox_enviada: apenas suportado com SQLAlchemy')
+    if ids_outbox:
+        db.session.execute(update(MensagemFila).where(MensagemFila.id.in_(list(ids_outbox))).values(enviada_em=datetime.utcnow()).execution_options(synchronize_session=False))
+    db.session.commit()
+
+def registrar_falha_outbox(ids_outbox):
+    if USAR_TINYDB:
+        raise RuntimeError('registrar_falha_outbox: apenas suportado com SQLAlchemy')
+    if ids_outbox:
+        db.session.execute(update(MensagemFila).where(MensagemFila.id.in_(list(ids_outbox))).values(tentativas=MensagemFila.tentativas + 1).execution_options(synchronize_session=False))
+    db.session.commit()
+
+def limpar_outbox_enviado(antes_de):
+    """Apaga linhas já publicadas antes de `antes_de` (datetime UTC). Retorna quantas."""
+    if USAR_TINYDB:
+        raise RuntimeError('limpar_outbox_enviado: apenas suportado com SQLAlchemy')
+    n = MensagemFila.query.filter(MensagemFila.enviada_em.isnot(None), MensagemFila.enviada_em < antes_de).delete(synchronize_session=False)
+    db.session.commit()
+    return n
+
+def avancar_cursor(nome='round_robin'):
+    """Incrementa atomicamente o cursor `nome` e retorna o valor anterior.
+
+    Um único UPDATE ... RETURNING, de modo que vários processos do worker
+    compartilham o mesmo cursor sem perder incrementos.
     """
     if USAR_TINYDB:
-        return deletar_mensagem_td(receipt_handle)
-    raise RuntimeError('deletar_mensagem_fila: apenas suportado quando USE_TINYDB=true')
+        return avancar_cursor_td(nome)
+    stmt = update(CursorDispatch).where(CursorDispatch.nome == nome).values(valor=CursorDispatch.valor + 1).returning(CursorDispatch.valor)
+    valor = db.session.execute(stmt).scalar()
+    if valor is None:
+        db.session.add(CursorDispatch(nome=nome, valor=1))
+        try:
+            db.session.commit()
+        except IntegrityError:
+            # outro processo criou o cursor ao mesmo tempo
+            db.session.rollback()
+            return avancar_cursor(nome)
+        return 0
+    db.session.commit()
+    return valor - 1
 
 def criar_tabelas():
-    """Cria as tabelas quando usando SQLAlchemy. No-op para TinyDB."""
+    """Cria as tabelas e aplica as migrações pendentes quando usando SQLAlchemy. No-op para TinyDB."""
     if not USAR_TINYDB:
+        from migracoes import aplicar_migracoes
         db.create_all()
- 
\ No newline at end of file
+        aplicar_migracoes()
+ 
+
+
+# histograma de duração por função (ver metricas.py); iterar_entregas é um
+# gerador e fica de fora (o tempo é o das listar_entregas que ele chama)
+for _nome in (
+    'criar_entregador', 'obter_entregador_por_nome', 'atualizar_hash_entregador', 'listar_entregadores',
+    'listar_entregadores_resumo', 'criar_entrega', 'criar_entregas', 'listar_entregas', 'obter_entrega', '_carregar_entrega', 'obter_entregas',
+    'atribuir_entrega', 'atualizar_status_entrega', 'listar_entregas_ativas', 'arquivar_entregas', 'enviar_mensagem_fila', 'enviar_mensagens_fila',
+    'receber_mensagem_fila', 'receber_mensagens_fila', 'deletar_mensagem_fila', 'deletar_mensagens_fila',
+    'estatisticas_fila', 'adiar_mensagens_fila', 'mover_para_dlq_fila', 'listar_dlq_fila', 'reprocessar_dlq_fila',
+    'listar_outbox_pendente', 'marcar_outbox_enviada', 'registrar_falha_outbox',
+    'limpar_outbox_enviado', 'avancar_cursor', 'criar_tabelas',
+):
+    globals()[_nome] = metricas.medir_storage(_nome, globals()[_nome])
+del _nome
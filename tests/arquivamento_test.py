@@ -0,0 +1,67 @@
+import gzip
+import json
+import os
+from datetime import datetime, timedelta
+
+import pytest
+
+import arquivamento
+import storage
+import tiny_store
+
+
+@pytest.fixture
+def banco(tmp_path, monkeypatch):
+    monkeypatch.setenv('TINYDB_PATH', str(tmp_path / 'tinydb.json'))
+    tiny_store.fechar_tinydb()
+    tiny_store.init_tinydb()
+    yield tmp_path
+    tiny_store.fechar_tinydb()
+
+
+def test_arquiva_entregues_antigas_e_continua_lendo(banco):
+    ids = [storage.criar_entrega('R%d' % i, 'A', 'B')['id'] for i in range(4)]
+    for i in ids[:2] + ids[3:]:
+        storage.atribuir_entrega(i, 7)
+        storage.atualizar_status_entrega(i, 'entregue')
+
+    # dentro da retenção nada sai
+    assert arquivamento.arquivar(retencao_dias=1) == 0
+    depois = datetime.utcnow() + timedelta(days=2)
+    # a de maior id fica na tabela ativa mesmo entregue (o id seria reusado)
+    assert arquivamento.arquivar(retencao_dias=1, lote=1, agora=depois) == 2
+    assert arquivamento.arquivar(retencao_dias=1, agora=depois) == 0
+
+    assert [o['id'] for o in storage.listar_entregas()] == [ids[3], ids[2]]
+    arquivada = storage.obter_entrega(ids[0], usar_cache=False)
+    assert arquivada['status'] == 'entregue' and arquivada['id_entregador'] == 7 and arquivada['restaurante'] == 'R0'
+    assert storage.obter_entrega(999, usar_cache=False) is None
+
+    arquivos = sorted(os.listdir(str(banco / 'tinydb.json.arquivo')))
+    assert len(arquivos) == 2
+    with gzip.open(str(banco / 'tinydb.json.arquivo' / arquivos[0]), 'rt') as f:
+        assert [json.loads(l)['id'] for l in f] == [ids[0]]
+    assert storage.criar_entrega('R', 'A', 'B')['id'] == ids[3] + 1
+
+
+def test_arquiva_no_sqlite(banco_sql):
+    from modelos import EntregaArquivada, MensagemFila
+
+    ids = [banco_sql.criar_entrega('R%d' % i, 'A', 'B', outbox=True)['id'] for i in range(4)]
+    for i in ids[:2] + ids[3:]:
+        banco_sql.atribuir_entrega(i, 7)
+        banco_sql.atualizar_status_entrega(i, 'entregue')
+
+    assert arquivamento.arquivar(retencao_dias=1) == 0
+    depois = datetime.utcnow() + timedelta(days=2)
+    assert arquivamento.arquivar(retencao_dias=1, lote=1, agora=depois) == 2
+    assert arquivamento.arquivar(retencao_dias=1, agora=depois) == 0
+
+    assert [o['id'] for o in banco_sql.listar_entregas()] == [ids[3], ids[2]]
+    assert sorted(a.id for a in EntregaArquivada.query.all()) == ids[:2]
+    # as linhas do outbox das arquivadas saem junto
+    assert sorted(m.delivery_id for m in MensagemFila.query.all()) == ids[2:]
+    arquivada = banco_sql.obter_entrega(ids[0], usar_cache=False)
+    assert arquivada['status'] == 'entregue' and arquivada['id_entregador'] == 7 and arquivada['restaurante'] == 'R0'
+    assert banco_sql.obter_entrega(999, usar_cache=False) is None
+    assert banco_sql.criar_entrega('R', 'A', 'B')['id'] == ids[3] + 1
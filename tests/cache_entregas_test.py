@@ -0,0 +1,96 @@
+import time
+
+import pytest
+
+import storage
+import tiny_store
+from cache_entregas import CacheEntregas, CacheLocal, CacheRedis
+
+
+class RedisFalso:
+    def __init__(self):
+        self.dados = {}
+
+    def get(self, chave):
+        return self.dados.get(chave)
+
+    def set(self, chave, valor, ex=None):
+        self.dados[chave] = valor.encode()
+
+    def delete(self, *chaves):
+        for chave in chaves:
+            self.dados.pop(chave, None)
+
+    def scan_iter(self, match):
+        return [c for c in self.dados if c.startswith(match.rstrip('*'))]
+
+
+def test_lru_com_ttl():
+    cache = CacheLocal(max_itens=2, ttl=0.1)
+    cache.gravar(1, 'a')
+    cache.gravar(2, 'b')
+    assert cache.obter(1) == 'a'
+    cache.gravar(3, 'c')
+    # 2 era o menos usado
+    assert cache.obter(2) is None
+    assert cache.obter(1) == 'a'
+    time.sleep(0.15)
+    assert cache.obter(3) is None
+
+
+def test_read_through_e_contadores_no_redis():
+    redis = RedisFalso()
+    cache = CacheEntregas(CacheRedis(redis, ttl=30))
+    lidos = []
+
+    def carregar(delivery_id):
+        lidos.append(delivery_id)
+        return {'id': int(delivery_id), 'status': 'enfileirado'}
+
+    assert cache.obter(5, carregar) == {'id': 5, 'status': 'enfileirado'}
+    assert cache.obter('5', carregar)['status'] == 'enfileirado'
+    assert lidos == [5]
+    # outro processo com o mesmo Redis enxerga a entrada e a invalidação
+    outro = CacheEntregas(CacheRedis(redis, ttl=30))
+    outro.invalidar(5)
+    cache.obter(5, carregar)
+    assert lidos == [5, 5]
+    assert cache.estatisticas() == {'hits': 1, 'misses': 2, 'erros': 0, 'tamanho': None}
+
+
+def test_falha_do_redis_vira_miss():
+    class RedisFora:
+        def get(self, chave):
+            raise ConnectionError('fora')
+        set = delete = get
+
+    cache = CacheEntregas(CacheRedis(RedisFora()))
+    assert cache.obter(1, lambda d: {'id': d}) == {'id': 1}
+    assert cache.estatisticas()['erros'] == 2
+
+
+@pytest.fixture
+def banco(tmp_path, monkeypatch):
+    monkeypatch.setattr(storage, '_cache_entregas', CacheEntregas(CacheLocal(100, 60)))
+    tiny_store.fechar_tinydb()
+    tiny_store.init_tinydb(str(tmp_path / 'db.json'))
+    yield
+    tiny_store.fechar_tinydb()
+
+
+def test_escritas_invalidam_o_cache(banco):
+    entrega = storage.criar_entrega('R', 'A', 'B')
+    assert storage.obter_entrega(entrega['id'])['status'] == 'enfileirado'
+    assert storage.obter_entrega(entrega['id'])['status'] == 'enfileirado'
+
+    storage.atribuir_entrega(entrega['id'], 7)
+    assert storage.obter_entrega(entrega['id'])['id_entregador'] == 7
+    storage.atualizar_status_entrega(entrega['id'], 'coletado')
+    assert storage.obter_entrega(entrega['id'])['status'] == 'coletado'
+    assert storage.estatisticas_cache_entregas()['hits'] == 1
+    assert storage.estatisticas_cache_entregas()['misses'] == 3
+
+    # escrita que não passou por este processo: só aparece sem cache (ou após o TTL)
+    tiny_store.atualizar_status_entrega_td(entrega['id'], 'entregue')
+    assert storage.obter_entrega(entrega['id'])['status'] == 'coletado'
+    assert storage.obter_entrega(entrega['id'], usar_cache=False)['status'] == 'entregue'
@@ -0,0 +1,32 @@
+import importlib
+import os
+
+import pytest
+
+# o backend é escolhido na importação de `storage`; os testes usam TinyDB
+os.environ.setdefault('USE_TINYDB', 'true')
+# custo baixo de hash para os testes não dependerem da velocidade da máquina
+os.environ.setdefault('PASSWORD_HASH_METHOD', 'pbkdf2:sha256:1000')
+
+
+@pytest.fixture
+def banco_sql(tmp_path):
+    """`storage` no backend SQLAlchemy sobre um SQLite em `tmp_path`; roda dentro do app context."""
+    from flask import Flask
+
+    import storage
+
+    anterior = os.environ['USE_TINYDB']
+    os.environ['USE_TINYDB'] = 'false'
+    try:
+        importlib.reload(storage)
+        app = Flask(__name__)
+        app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///' + str(tmp_path / 'app.db')
+        storage.iniciar_armazenamento(app)
+        with app.app_context():
+            storage.criar_tabelas()
+            yield storage
+            storage.encerrar_sessao()
+    finally:
+        os.environ['USE_TINYDB'] = anterior
+        importlib.reload(storage)
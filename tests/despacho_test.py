@@ -0,0 +1,51 @@
+import threading
+import time
+
+from despacho import Despachante
+
+
+class FilaContada:
+    def __init__(self):
+        self.ids = []
+        self.receives = 0
+        self.lock = threading.Lock()
+
+    def receive_messages(self, n, hidratar=None, wait_seconds=0):
+        with self.lock:
+            self.receives += 1
+            lote, self.ids = self.ids[:n], self.ids[n:]
+        return [{'ReceiptHandle': 'r%d' % i, 'entrega': {'id': i}} for i in lote]
+
+
+def test_um_poller_atende_varias_esperas():
+    q = FilaContada()
+    desp = Despachante(q)
+    recebidas = []
+    esperas = [threading.Thread(target=lambda: recebidas.append(desp.aguardar(2))) for _ in range(5)]
+    for t in esperas:
+        t.start()
+    time.sleep(0.3)
+    receives_ociosos = q.receives
+    with q.lock:
+        q.ids = [1, 2, 3, 4, 5]
+    for t in esperas:
+        t.join()
+    desp.encerrar(1)
+
+    assert sorted(m['entrega']['id'] for m in recebidas) == [1, 2, 3, 4, 5]
+    # 5 entregadores ociosos por 0.3s: poucos receives, não um por entregador a cada espera
+    assert receives_ociosos <= 3
+
+
+def test_timeout_retorna_none_e_sai_da_lista():
+    q = FilaContada()
+    desp = Despachante(q)
+    inicio = time.monotonic()
+    assert desp.aguardar(0.2) is None
+    assert time.monotonic() - inicio >= 0.2
+    assert not desp._esperas
+
+    # mensagem que chega sem espera fica no buffer para o próximo
+    desp._entregar([{'ReceiptHandle': 'r9', 'entrega': {'id': 9}}])
+    assert desp.aguardar(0)['entrega']['id'] == 9
+    desp.encerrar(1)
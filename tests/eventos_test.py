@@ -0,0 +1,71 @@
+import json
+import os
+import threading
+import time
+import uuid
+
+import pytest
+
+import eventos
+
+
+def _eventos_sse(texto):
+    return [
+        dict(linha.split(': ', 1) for linha in bloco.splitlines())
+        for bloco in texto.split('\n\n') if bloco.startswith('id:')
+    ]
+
+
+def test_buffer_retoma_e_reinicia():
+    b = eventos.Barramento(capacidade=3)
+    for i in range(1, 5):
+        b.publicar({'id_entrega': i})
+
+    novos, reinicio = b.aguardar(2, 0)
+    assert [e[0] for e in novos] == [3, 4] and reinicio is None
+    # id 1 já saiu do buffer; id 9 é de outro contador
+    assert b.aguardar(0, 0) == ([], 4)
+    assert b.aguardar(9, 0) == ([], 4)
+
+    threading.Timer(0.05, b.publicar, [{'id_entrega': 5}]).start()
+    inicio = time.monotonic()
+    novos, _ = b.aguardar(4, 2)
+    assert [e[0] for e in novos] == [5] and time.monotonic() - inicio < 1
+
+
+def test_fluxo_filtra_e_avanca_o_cursor():
+    b = eventos.Barramento()
+    b.publicar({'id_entrega': 1, 'status': 'atribuido', 'id_entregador': 7})
+    b.publicar({'id_entrega': 2, 'status': 'atribuido', 'id_entregador': 8})
+
+    texto = ''.join(eventos.fluxo_sse(0, id_entrega=1, duracao=0, barramento=b))
+    assert texto.startswith('retry: ')
+    enviados = _eventos_sse(texto)
+    assert [e['id'] for e in enviados] == ['1', '2']
+    assert json.loads(enviados[0]['data'])['id_entrega'] == 1
+    # o evento filtrado só atualiza o Last-Event-ID do cliente
+    assert enviados[1] == {'id': '2'}
+
+    enviados = _eventos_sse(''.join(eventos.fluxo_sse(50, duracao=0, barramento=b)))
+    assert enviados[0]['event'] == 'reinicio' and enviados[0]['id'] == '2'
+    assert ''.join(eventos.fluxo_sse(duracao=0, barramento=b)).endswith(': ping\n\n')
+
+
+@pytest.mark.skipif(not os.getenv('REDIS_TEST_URL'), reason='REDIS_TEST_URL não definido')
+def test_redis_difunde_entre_processos():
+    import redis
+    cliente = redis.Redis.from_url(os.environ['REDIS_TEST_URL'], decode_responses=True)
+    canal = 'teste:eventos:' + uuid.uuid4().hex
+    publicador = eventos.BarramentoRedis(cliente, canal=canal)
+    api = eventos.BarramentoRedis(cliente, canal=canal)
+    try:
+        assert publicador.publicar({'id_entrega': 1}) == 1
+        # assinante novo completa o buffer com os recentes e depois recebe ao vivo
+        assert api.ultimo_id() == 1
+        threading.Timer(0.05, publicador.publicar, [{'id_entrega': 2}]).start()
+        novos, _ = api.aguardar(1, 2)
+        assert novos == [(2, {'id_entrega': 2})]
+        assert api.aguardar(0, 0)[0] == [(1, {'id_entrega': 1}), (2, {'id_entrega': 2})]
+    finally:
+        api.encerrar()
+        cliente.delete(canal + ':seq', canal + ':recentes')
@@ -0,0 +1,209 @@
+import json
+import os
+import subprocess
+import sys
+import time
+
+import pytest
+from tinydb import TinyDB
+
+from tiny_store import FilaLocal
+
+
+def _fila(tmp_path, **kwargs):
+    path = str(tmp_path / 'fila.json')
+    return FilaLocal(TinyDB(path), path, **kwargs), path
+
+
+def test_fifo_e_lease_esconde_mensagem(tmp_path):
+    fila, _ = _fila(tmp_path)
+    fila.enviar(10)
+    fila.enviar(20)
+
+    primeiro = fila.receber()
+    segundo = fila.receber()
+    assert primeiro[1] == 10
+    assert segundo[1] == 20
+    # ambas estão em lease: nada visível
+    assert fila.receber() is None
+    assert fila.tamanho() == 0
+
+
+def test_lease_expirado_volta_para_o_inicio(tmp_path):
+    fila, _ = _fila(tmp_path, visibility_timeout=0.05)
+    fila.enviar(1)
+    fila.enviar(2)
+    receipt_antigo = fila.receber()[2]
+    time.sleep(0.1)
+
+    _, delivery_id, receipt, _ = fila.receber()
+    assert delivery_id == 1
+    # o receipt do lease expirado não apaga mais a mensagem
+    assert fila.deletar(receipt_antigo) is False
+    assert fila.deletar(receipt) is True
+    assert fila.receber()[1] == 2
+
+
+def test_indice_reconstruido_do_arquivo(tmp_path):
+    fila, path = _fila(tmp_path)
+    fila.enviar(7)
+    fila.enviar(8)
+    fila.deletar(fila.receber()[2])
+
+    # outro processo abrindo o mesmo arquivo enxerga apenas o que restou
+    outra = FilaLocal(TinyDB(path), path)
+    _, delivery_id, receipt, _ = outra.receber()
+    assert delivery_id == 8
+    assert outra.receber() is None
+    outra.deletar(receipt)
+
+    # e a primeira instância percebe escritas feitas pela outra
+    outra.enviar(9)
+    assert fila.receber()[1] == 9
+
+
+def test_operacoes_em_lote(tmp_path):
+    fila, _ = _fila(tmp_path)
+    assert len(fila.enviar_lote([1, 2, 3, 4])) == 4
+
+    lote = fila.receber_lote(3)
+    assert [m[1] for m in lote] == [1, 2, 3]
+
+    res = fila.deletar_lote([m[2] for m in lote] + ['99-invalido'])
+    assert len(res['Successful']) == 3
+    assert [f['ReceiptHandle'] for f in res['Failed']] == ['99-invalido']
+    assert [m[1] for m in fila.receber_lote(10)] == [4]
+
+
+def test_adiar_conta_tentativas_e_dlq(tmp_path):
+    fila, path = _fila(tmp_path)
+    fila.enviar(1)
+    m1 = fila.receber()
+    assert m1[3]['tentativas'] == 1
+
+    assert fila.adiar_lote([(m1[2], 0.1)])['Successful'] == [m1[2]]
+    # adiada: invisível também para outro processo, que herda a contagem
+    outra = FilaLocal(TinyDB(path), path)
+    assert outra.receber() is None
+    time.sleep(0.15)
+    m1 = fila.receber()
+    assert m1[3]['tentativas'] == 2
+    # o lease está no arquivo: a outra instância não recebe a mesma mensagem
+    assert outra.receber() is None
+    assert fila.adiar_lote([(m1[2], 0)])['Successful'] == [m1[2]]
+    assert outra.receber()[3]['tentativas'] == 3
+
+    fila.enviar(2)
+    m2 = fila.receber()
+    assert fila.mover_para_dlq([(m2[2], {'motivo': 'erro'})])['Successful'] == [m2[2]]
+    assert fila.estatisticas()['dlq'] == 1
+    [morta] = fila.listar_dlq()
+    assert morta['id_entrega'] == 2 and morta['dlq']['motivo'] == 'erro' and morta['tentativas'] == 1
+
+    assert fila.reprocessar_dlq([morta['id']]) == [morta['id']]
+    assert fila.tamanho_dlq() == 0
+    _, delivery_id, _, corpo = fila.receber()
+    assert delivery_id == 2 and corpo['tentativas'] == 1 and 'dlq' not in corpo
+
+
+def test_indice_atualizado_so_com_o_que_outro_processo_gravou(tmp_path, monkeypatch):
+    from tiny_armazenamento import TinyDBLog
+
+    path = str(tmp_path / 'fila.json')
+    fila = FilaLocal(TinyDBLog(path, intervalo=0), path)
+    fila.enviar(1)
+    outra = FilaLocal(TinyDBLog(path, intervalo=0), path)
+    fila.enviar_lote([2, 3])
+    # a outra instância não relê a tabela inteira a cada escrita alheia
+    monkeypatch.setattr(outra, '_sincronizar', lambda: pytest.fail('reconstruiu o índice'))
+    _, delivery_id, receipt, _ = outra.receber()
+    assert delivery_id == 1
+
+    # o lease gravado pela outra instância também chega ao índice desta
+    assert fila.receber()[1] == 2
+    fila.enviar(4)
+    assert outra.deletar(receipt)
+    assert [m[1] for m in outra.receber_lote(10)] == [3, 4]
+    assert outra.enviar(5) == 5
+    assert fila.estatisticas()['visiveis'] == 1
+
+
+CONSUMIDOR = '''
+import json, sys, time
+sys.path.insert(0, %r)
+import tiny_store
+tiny_store.init_tinydb(sys.argv[1])
+recebidas = []
+vazias = 0
+while vazias < 20:
+    msgs = tiny_store.receber_mensagens_td(2, visibility_timeout=60)
+    if not msgs:
+        vazias += 1
+        time.sleep(0.01)
+        continue
+    vazias = 0
+    # sem delete: o lease tem que bastar para o outro processo não receber de novo
+    recebidas.extend(m['corpo']['id_entrega'] for m in msgs)
+    time.sleep(0.005)
+print(json.dumps(recebidas))
+tiny_store.fechar_tinydb()
+'''
+
+
+def test_lease_vale_entre_processos(tmp_path):
+    import tiny_store
+
+    raiz = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    path = str(tmp_path / 'tinydb.json')
+    tiny_store.fechar_tinydb()
+    tiny_store.init_tinydb(path)
+    tiny_store.enviar_mensagens_td(list(range(1, 301)))
+    tiny_store.fechar_tinydb()
+
+    script = CONSUMIDOR % raiz
+    procs = [subprocess.Popen([sys.executable, '-c', script, path], stdout=subprocess.PIPE, text=True) for _ in range(2)]
+    recebidas = [json.loads(p.communicate(timeout=60)[0]) for p in procs]
+    assert all(recebidas)
+    todas = recebidas[0] + recebidas[1]
+    assert sorted(todas) == list(range(1, 301))
+
+
+def test_get_queue_e_singleton_do_processo():
+    import threading
+
+    import fila
+
+    fila.fechar_queue()
+    vistos = []
+    threads = [threading.Thread(target=lambda: vistos.append(fila.get_queue())) for _ in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert len({id(q) for q in vistos}) == 1
+
+    fila.fechar_queue()
+    assert fila.get_queue() is not vistos[0]
+
+
+def test_fila_local_com_entregas_no_sqlalchemy(banco_sql, tmp_path, monkeypatch):
+    import fila
+    import tiny_store
+
+    # QUEUE_BACKEND=tinydb com USE_TINYDB=false: só a fila fica no TinyDB
+    monkeypatch.setenv('TINYDB_PATH', str(tmp_path / 'tinydb.json'))
+    tiny_store.fechar_tinydb()
+    try:
+        entrega = banco_sql.criar_entrega('R', 'A', 'B')
+        q = fila.TinyDBQueue()
+        q.send_messages([entrega['id']])
+        msg = q.receive_message(hidratar='sempre')
+        assert msg['entrega']['id'] == entrega['id']
+        assert msg['entrega']['restaurante'] == 'R'
+        assert q.delete_message(msg['ReceiptHandle'])
+        assert q.estatisticas()['visiveis'] == 0
+        # a fila fica sempre no modo log: até a compactação, só o log existe
+        assert (tmp_path / 'tinydb.fila.json.log').exists()
+        assert not (tmp_path / 'tinydb.json').exists()
+    finally:
+        tiny_store.fechar_tinydb()
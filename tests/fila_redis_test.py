@@ -0,0 +1,75 @@
+"""Testes da fila em Redis Streams. Precisam de um redis-server (6.2+) em REDIS_TEST_URL."""
+import os
+import time
+import uuid
+
+import pytest
+
+from fila import RedisStreamQueue
+
+REDIS_TEST_URL = os.getenv('REDIS_TEST_URL')
+
+
+@pytest.fixture
+def fila(monkeypatch):
+    if not REDIS_TEST_URL:
+        pytest.skip('REDIS_TEST_URL não definida')
+    import redis
+    cliente = redis.Redis.from_url(REDIS_TEST_URL, decode_responses=True)
+    monkeypatch.setattr('fila.obter_entregas', lambda ids: {i: {'id': i} for i in ids})
+    # stream próprio por teste: nada além das chaves dele é apagado
+    q = RedisStreamQueue(cliente, stream='teste-%s' % uuid.uuid4().hex, visibility_timeout=0.2)
+    yield q
+    cliente.delete(q.stream, q.adiadas, q.dlq)
+    cliente.close()
+
+
+def test_envio_recebimento_ack_e_lease_expirado(fila):
+    fila.send_messages([1, 2])
+    m1, m2 = fila.receive_messages(10, wait_seconds=0)
+    assert (m1['id_entrega'], m1['tentativas']) == (1, 1)
+    assert fila.estatisticas()['em_voo'] == 2
+    assert fila.delete_messages([m1['ReceiptHandle']])['Successful'] == [m1['ReceiptHandle']]
+    assert fila.receive_messages(10, wait_seconds=0) == []
+
+    # sem ack, a mensagem é retomada (XAUTOCLAIM) depois do visibility timeout
+    time.sleep(0.3)
+    fila._proximo_reclaim = 0
+    [de_novo] = fila.receive_messages(10, wait_seconds=0)
+    assert (de_novo['id_entrega'], de_novo['tentativas']) == (2, 2)
+    assert fila.delete_message(de_novo['ReceiptHandle'])
+    assert fila.estatisticas() == {'visiveis': 0, 'em_voo': 0, 'idade_mais_antiga': None, 'dlq': 0}
+
+
+def test_adiamento_dlq_e_redrive(fila):
+    fila.send_messages([1, 2])
+    m1, m2 = fila.receive_messages(10, wait_seconds=0)
+
+    assert fila.change_visibility([(m1['ReceiptHandle'], 0.1)])['Successful'] == [m1['ReceiptHandle']]
+    assert fila.move_to_dlq([(m2, {'motivo': 'erro'})])['Successful'] == [m2['ReceiptHandle']]
+    assert fila.receive_messages(10, wait_seconds=0) == []
+    time.sleep(0.15)
+    [adiada] = fila.receive_messages(10, wait_seconds=0)
+    assert (adiada['id_entrega'], adiada['tentativas']) == (1, 2)
+
+    [morta] = fila.list_dlq()
+    assert morta['id_entrega'] == 2 and morta['dlq']['motivo'] == 'erro'
+    assert fila.redrive_dlq([morta['id']]) == [morta['id']]
+    [reprocessada] = fila.receive_messages(10, wait_seconds=0)
+    assert (reprocessada['id_entrega'], reprocessada['tentativas']) == (2, 1)
+    assert fila.estatisticas()['dlq'] == 0
+
+
+def test_delete_e_dlq_sem_ack_nao_apagam_a_entrada(fila):
+    [enviada] = fila.send_messages([1])['Successful']
+    # receipt de uma entrada que não está pendente no grupo (nunca recebida)
+    falsa = {'ReceiptHandle': enviada['MessageId'], 'corpo': {'id_entrega': 1}, 'tentativas': 1}
+    assert fila.delete_messages([enviada['MessageId']])['Successful'] == []
+    assert fila.move_to_dlq([(falsa, {'motivo': 'x'})])['Successful'] == []
+    assert fila.list_dlq() == []
+
+    # o XACK falhou: a mensagem continua no stream para o consumidor legítimo
+    [m] = fila.receive_messages(10, wait_seconds=0)
+    assert m['id_entrega'] == 1
+    assert fila.delete_messages([m['ReceiptHandle']])['Successful'] == [m['ReceiptHandle']]
+    assert fila.delete_messages([m['ReceiptHandle']])['Failed'][0]['ReceiptHandle'] == m['ReceiptHandle']
@@ -0,0 +1,114 @@
+import json
+
+from fila import SQSQueue, corpo_mensagem, hidratar_mensagens
+
+
+class ClienteSQSFalso:
+    """Cliente mínimo que registra as chamadas *_batch feitas pelo SQSQueue."""
+
+    def __init__(self):
+        self.chamadas = []
+        self.enviadas = []
+
+    def send_message_batch(self, QueueUrl, Entries):
+        self.chamadas.append(('send', len(Entries)))
+        self.enviadas.append((QueueUrl, Entries))
+        # a última entrada de cada lote falha
+        return {
+            'Successful': [{'Id': e['Id'], 'MessageId': 'm' + e['Id']} for e in Entries[:-1]],
+            'Failed': [{'Id': Entries[-1]['Id'], 'Code': 'InternalError'}],
+        }
+
+    def receive_message(self, QueueUrl, MaxNumberOfMessages, WaitTimeSeconds, **kwargs):
+        self.chamadas.append(('receive', MaxNumberOfMessages))
+        return {'Messages': [
+            {'MessageId': '1', 'ReceiptHandle': 'r1', 'Body': json.dumps({'id_entrega': 1})},
+            {'MessageId': '2', 'ReceiptHandle': 'r2', 'Body': 'lixo'},
+        ]}
+
+    def delete_message_batch(self, QueueUrl, Entries):
+        self.chamadas.append(('delete', len(Entries)))
+        return {'Successful': [{'Id': e['Id']} for e in Entries], 'Failed': []}
+
+    def change_message_visibility_batch(self, QueueUrl, Entries):
+        self.chamadas.append(('visibility', [e['VisibilityTimeout'] for e in Entries]))
+        return {'Successful': [{'Id': e['Id']} for e in Entries], 'Failed': []}
+
+
+def _fila():
+    q = SQSQueue.__new__(SQSQueue)
+    q.queue_url = 'http://fila'
+    q.client = ClienteSQSFalso()
+    return q
+
+
+def test_send_messages_em_lotes_de_10():
+    q = _fila()
+    res = q.send_messages(range(1, 24))
+    assert q.client.chamadas == [('send', 10), ('send', 10), ('send', 3)]
+    assert len(res['Successful']) == 20
+    assert [f['id_entrega'] for f in res['Failed']] == [10, 20, 23]
+
+
+def test_receive_messages_limita_a_10_e_descarta_malformadas(monkeypatch):
+    monkeypatch.setattr('fila.obter_entregas', lambda ids: {i: {'id': i} for i in ids})
+    q = _fila()
+    msgs = q.receive_messages(50)
+    assert q.client.chamadas == [('receive', 10), ('delete', 1)]
+    assert [m['entrega']['id'] for m in msgs] == [1]
+
+
+def test_hidratacao_usa_payload_e_busca_o_resto_em_lote(monkeypatch):
+    consultas = []
+
+    def obter_entregas(ids):
+        consultas.append(sorted(ids))
+        return {i: {'id': i, 'status': 'enfileirado'} for i in ids}
+
+    monkeypatch.setattr('fila.obter_entregas', obter_entregas)
+    corpos = [
+        corpo_mensagem({'id': 1, 'restaurante': 'R', 'endereco_retirada': 'A', 'endereco_cliente': 'B', 'status': 'enfileirado'}),
+        corpo_mensagem(2),
+        corpo_mensagem(3),
+    ]
+
+    msgs = hidratar_mensagens([{'corpo': dict(c)} for c in corpos], 'payload')
+    assert msgs[0]['entrega'] == {'id': 1, 'restaurante': 'R', 'endereco_retirada': 'A', 'endereco_cliente': 'B'}
+    assert [m['entrega']['id'] for m in msgs] == [1, 2, 3]
+    # só as mensagens sem payload vão ao banco, numa única consulta
+    assert consultas == [[2, 3]]
+
+    msgs = hidratar_mensagens([{'corpo': dict(c)} for c in corpos], 'nunca')
+    assert [m['entrega'] for m in msgs] == [{'id': 1}, {'id': 2}, {'id': 3}]
+    assert len(consultas) == 1
+
+
+def test_delete_messages_em_lotes():
+    q = _fila()
+    res = q.delete_messages(['r%d' % i for i in range(12)])
+    assert q.client.chamadas == [('delete', 10), ('delete', 2)]
+    assert len(res['Successful']) == 12
+
+
+def test_change_visibility_em_lotes_e_limitado():
+    q = _fila()
+    res = q.change_visibility([('r0', 50000), ('r1', -3)] + [('r%d' % i, 7.9) for i in range(2, 12)])
+    assert q.client.chamadas == [('visibility', [43200, 0] + [7] * 8), ('visibility', [7, 7])]
+    assert len(res['Successful']) == 12
+
+
+def test_move_to_dlq_copia_o_corpo_e_apaga_da_fila():
+    q = _fila()
+    msgs = [{'ReceiptHandle': 'r%d' % i, 'corpo': {'id_entrega': i}, 'tentativas': 5} for i in (1, 2)]
+    assert q.move_to_dlq([(m, {'motivo': 'erro'}) for m in msgs])['Failed'][0]['erro'] == 'AWS_SQS_DLQ_URL não definida'
+    assert q.client.chamadas == []
+
+    q.dlq_url = 'http://dlq'
+    res = q.move_to_dlq([(m, {'motivo': 'erro'}) for m in msgs])
+    # o fake falha a última entrada de cada send: só r1 é copiada e apagada
+    assert res['Successful'] == ['r1']
+    assert [f['ReceiptHandle'] for f in res['Failed']] == ['r2']
+    url, entries = q.client.enviadas[0]
+    corpo = json.loads(entries[0]['MessageBody'])
+    assert url == 'http://dlq' and corpo['tentativas'] == 5 and corpo['dlq']['motivo'] == 'erro'
+    assert q.client.chamadas[-1] == ('delete', 1)
@@ -8,7 +8,7 @@ def main():
 
     # importar aqui depois de setar var de ambiente
     from app import create_app
-    from queue import get_queue
+    from fila import get_queue
     from storage import listar_entregadores, atribuir_entrega, obter_entrega
     import worker as worker_mod
 
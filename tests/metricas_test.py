@@ -0,0 +1,118 @@
+import time
+import urllib.error
+import urllib.request
+
+import pytest
+
+import metricas
+import tiny_store
+import worker
+from metricas import Registro, Contador, Gauge, Histograma
+
+
+def test_formato_texto():
+    registro = Registro()
+    h = registro.registrar(Histograma('t_segundos', 'Teste.', ('op',), buckets=(0.1, 1)))
+    c = registro.registrar(Contador('t_total', 'Teste.', ('motivo',)))
+    g = registro.registrar(Gauge('t_fila', 'Teste.', ('estado',), coletar=lambda: {'visiveis': 3, 'em_voo': None}))
+    h.observar(0.05, op='a')
+    h.observar(0.5, op='a')
+    h.observar(5, op='a')
+    c.inc(motivo='x "y"')
+    texto = registro.expor()
+
+    assert '# TYPE t_segundos histogram' in texto
+    assert 't_segundos_bucket{op="a",le="0.1"} 1' in texto
+    assert 't_segundos_bucket{op="a",le="1"} 2' in texto
+    assert 't_segundos_bucket{op="a",le="+Inf"} 3' in texto
+    assert 't_segundos_count{op="a"} 3' in texto
+    assert 't_total{motivo="x \\"y\\""} 1' in texto
+    assert 't_fila{estado="visiveis"} 3' in texto
+    assert 'em_voo' not in texto
+    assert g.expor()[1] == '# TYPE t_fila gauge'
+
+
+@pytest.fixture
+def client(tmp_path, monkeypatch):
+    monkeypatch.setenv('TINYDB_PATH', str(tmp_path / 'tinydb.json'))
+    tiny_store.fechar_tinydb()
+    from app import create_app
+    yield create_app().test_client()
+    tiny_store.fechar_tinydb()
+
+
+def test_endpoint_metrics_da_api(client, monkeypatch):
+    antes = metricas.STORAGE_SEGUNDOS.contagem(funcao='criar_entrega')
+    for _ in range(2):
+        assert client.post('/orders', json={'restaurante': 'R', 'endereco_retirada': 'A', 'endereco_cliente': 'B'}).status_code == 201
+
+    # sem METRICS_TOKEN configurado o endpoint fica fechado
+    monkeypatch.setattr(metricas, 'METRICS_TOKEN', None)
+    assert client.get('/metrics').status_code == 403
+    monkeypatch.setattr(metricas, 'METRICS_TOKEN', 'segredo')
+    assert client.get('/metrics').status_code == 403
+    assert client.get('/metrics', headers={'Authorization': 'Bearer outro'}).status_code == 403
+
+    resp = client.get('/metrics', headers={'Authorization': 'Bearer segredo'})
+    assert resp.status_code == 200
+    assert resp.headers['Content-Type'].startswith('text/plain; version=0.0.4')
+    texto = resp.get_data(as_text=True)
+    assert 'http_requisicao_segundos_count{rota="/orders",metodo="POST",status="201"}' in texto
+    assert metricas.STORAGE_SEGUNDOS.contagem(funcao='criar_entrega') == antes + 2
+    assert 'fila_operacao_segundos_count{backend="tinydb",operacao="send_message"}' in texto
+    assert 'fila_mensagens{estado="visiveis"} 2' in texto
+    assert 'fila_idade_mais_antiga_segundos ' in texto
+
+
+class FilaFalsa:
+    def __init__(self):
+        self.adiadas = []
+
+    def change_visibility(self, itens):
+        self.adiadas.extend(itens)
+        return {'Successful': [r for r, _ in itens], 'Failed': []}
+
+    def delete_messages(self, receipts):
+        return {'Successful': receipts, 'Failed': []}
+
+
+def test_worker_registra_atribuicoes_e_reenfileiramentos(monkeypatch):
+    monkeypatch.setattr(worker, 'atribuir_entrega', lambda delivery_id, driver_id: {'id': delivery_id})
+    monkeypatch.setattr(worker, 'POLL_INTERVAL', 0)
+    atribuicoes = metricas.ATRIBUICOES.valor(origem='worker')
+    latencias = metricas.ATRIBUICAO_LATENCIA.contagem(origem='worker')
+    sem_entregadores = metricas.REENFILEIRADAS.valor(motivo='sem_entregadores')
+    msgs = [{'ReceiptHandle': 'r1', 'entrega': {'id': 1}, 'enfileirado_em': time.time() - 2},
+            {'ReceiptHandle': 'r2', 'entrega': {'id': 2}}]
+
+    entregadores = worker.CacheEntregadores(carregar=lambda: [{'id': 9}])
+    assert worker.processar_lote(FilaFalsa(), msgs, {'last_index': 0}, entregadores) == 2
+    vazio = worker.CacheEntregadores(carregar=lambda: [])
+    worker.processar_lote(FilaFalsa(), msgs[:1], {'last_index': 0}, vazio)
+
+    assert metricas.ATRIBUICOES.valor(origem='worker') == atribuicoes + 2
+    # só a mensagem com enfileirado_em entra na latência
+    assert metricas.ATRIBUICAO_LATENCIA.contagem(origem='worker') == latencias + 1
+    assert metricas.REENFILEIRADAS.valor(motivo='sem_entregadores') == sem_entregadores + 1
+
+
+def test_porta_lateral_do_worker(monkeypatch):
+    monkeypatch.setattr(metricas, 'METRICS_TOKEN', None)
+    servidor = metricas.servir(0)
+    try:
+        # padrão: só a máquina local, sem token
+        assert servidor.server_address[0] == '127.0.0.1'
+        url = 'http://127.0.0.1:%d/metrics' % servidor.server_address[1]
+        texto = urllib.request.urlopen(url, timeout=5).read().decode()
+        assert '# TYPE atribuicoes_total counter' in texto
+
+        # com METRICS_TOKEN o worker também exige o bearer token
+        monkeypatch.setattr(metricas, 'METRICS_TOKEN', 'segredo')
+        with pytest.raises(urllib.error.HTTPError) as erro:
+            urllib.request.urlopen(url, timeout=5)
+        assert erro.value.code == 403
+        pedido = urllib.request.Request(url, headers={'Authorization': 'Bearer segredo'})
+        assert urllib.request.urlopen(pedido, timeout=5).status == 200
+    finally:
+        servidor.shutdown()
+        servidor.server_close()
@@ -0,0 +1,78 @@
+import pytest
+from sqlalchemy import create_engine, inspect, text
+
+from migracoes import MIGRACOES, aplicar_migracoes, versoes_aplicadas
+
+
+def _banco_antigo(tmp_path):
+    """Schema como criado por create_all antes dos índices existirem."""
+    engine = create_engine('sqlite:///%s' % (tmp_path / 'app.db'))
+    with engine.begin() as conn:
+        conn.execute(text('CREATE TABLE entregador (id INTEGER PRIMARY KEY, name VARCHAR(120) NOT NULL, phone VARCHAR(40), password_hash VARCHAR(200), created_at DATETIME)'))
+        conn.execute(text('CREATE TABLE entrega (id INTEGER PRIMARY KEY, restaurant VARCHAR(200) NOT NULL, pickup_address VARCHAR(300) NOT NULL, customer_address VARCHAR(300) NOT NULL, status VARCHAR(50), assigned_driver_id INTEGER, created_at DATETIME)'))
+        conn.execute(text('CREATE TABLE mensagem_fila (id INTEGER PRIMARY KEY, delivery_id INTEGER NOT NULL, created_at DATETIME)'))
+        conn.execute(text("INSERT INTO entregador (name) VALUES ('ana'), ('bia')"))
+    return engine
+
+
+def test_migracoes_aplicadas_uma_vez_em_banco_existente(tmp_path):
+    engine = _banco_antigo(tmp_path)
+
+    assert aplicar_migracoes(engine) == [v for v, _, _ in MIGRACOES]
+    assert aplicar_migracoes(engine) == []
+    assert versoes_aplicadas(engine) == {v for v, _, _ in MIGRACOES}
+
+    insp = inspect(engine)
+    indices = {i['name']: i for i in insp.get_indexes('entrega') + insp.get_indexes('entregador')}
+    assert {'ix_entrega_status_id', 'ix_entrega_assigned_driver_id_id', 'ix_entrega_created_at', 'ix_entregador_name'} <= set(indices)
+    assert indices['ix_entregador_name']['unique']
+    assert {'enviada_em', 'tentativas'} <= {c['name'] for c in insp.get_columns('mensagem_fila')}
+    assert 'atualizado_em' in {c['name'] for c in insp.get_columns('entrega')}
+
+
+def test_nomes_duplicados_interrompem_a_migracao(tmp_path):
+    engine = _banco_antigo(tmp_path)
+    with engine.begin() as conn:
+        conn.execute(text("INSERT INTO entregador (name) VALUES ('ana')"))
+
+    with pytest.raises(RuntimeError, match='ana'):
+        aplicar_migracoes(engine)
+    # a migração 1 foi registrada; a 2 fica pendente até os nomes serem corrigidos
+    assert versoes_aplicadas(engine) == {1}
+
+
+class ConexaoPostgresFalsa:
+    """Registra os comandos; `validos` é a sequência de respostas de pg_index.indisvalid."""
+
+    def __init__(self, validos, falhar_create=False):
+        self.validos = list(validos)
+        self.falhar_create = falhar_create
+        self.comandos = []
+
+    def execute(self, stmt, params=None):
+        sql = str(stmt)
+        self.comandos.append(sql.split(' (')[0] if sql.startswith('CREATE') else sql)
+        if sql.startswith('SELECT indisvalid'):
+            valor = self.validos.pop(0)
+            return type('R', (), {'scalar': lambda self: valor})()
+        if sql.startswith('CREATE') and self.falhar_create:
+            raise ValueError('could not create unique index')
+
+
+def test_indice_invalid_no_postgres_e_removido_e_falha():
+    from migracoes import _criar_indice
+
+    # build concorrente falhou: o índice ficou INVALID
+    conn = ConexaoPostgresFalsa([None, False], falhar_create=True)
+    with pytest.raises(RuntimeError, match='INVALID'):
+        _criar_indice(conn, 'postgresql', 'ix_entregador_name', 'entregador', ['name'], unico=True)
+    assert conn.comandos[-1] == 'DROP INDEX CONCURRENTLY IF EXISTS ix_entregador_name'
+
+    # INVALID de uma execução anterior: removido antes do IF NOT EXISTS, que o pularia
+    conn = ConexaoPostgresFalsa([False, True])
+    _criar_indice(conn, 'postgresql', 'ix_entrega_created_at', 'entrega', ['created_at'])
+    assert conn.comandos[1:] == [
+        'DROP INDEX CONCURRENTLY IF EXISTS ix_entrega_created_at',
+        'CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_entrega_created_at ON entrega',
+        conn.comandos[0],
+    ]
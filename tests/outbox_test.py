@@ -0,0 +1,50 @@
+import outbox
+
+
+class FilaFalsa:
+    def __init__(self, falhar=()):
+        self.falhar = set(falhar)
+        self.enviadas = []
+
+    def send_messages(self, entregas):
+        entregas = list(entregas)
+        self.enviadas.extend(e['id'] for e in entregas if e['id'] not in self.falhar)
+        return {
+            'Successful': [{'id_entrega': e['id']} for e in entregas if e['id'] not in self.falhar],
+            'Failed': [{'id_entrega': e['id'], 'erro': 'x'} for e in entregas if e['id'] in self.falhar],
+        }
+
+
+def test_relay_marca_enviadas_e_conta_falhas(monkeypatch):
+    pendentes = [(10, {'id': 1}), (11, {'id': 2}), (12, {'id': 3})]
+    marcadas, falhas = [], []
+    monkeypatch.setattr(outbox, 'listar_outbox_pendente', lambda limite: pendentes[:limite])
+    monkeypatch.setattr(outbox, 'marcar_outbox_enviada', lambda ids: marcadas.extend(ids))
+    monkeypatch.setattr(outbox, 'registrar_falha_outbox', lambda ids: falhas.extend(ids))
+
+    q = FilaFalsa(falhar={2})
+    relay = outbox.RelayOutbox(app=None, q=q, lote=10)
+    assert relay.publicar_pendentes() == 2
+    assert q.enviadas == [1, 3]
+    assert marcadas == [10, 12]
+    assert falhas == [11]
+
+
+def test_outbox_no_mesmo_commit_e_relay_no_sqlite(banco_sql):
+    from modelos import MensagemFila
+
+    a = banco_sql.criar_entrega('R', 'A', 'B', outbox=True)
+    b = banco_sql.criar_entrega('R', 'C', 'D', outbox=True)
+    linhas = {m.delivery_id: m for m in MensagemFila.query.all()}
+    assert set(linhas) == {a['id'], b['id']}
+    assert all(m.enviada_em is None for m in linhas.values())
+
+    q = FilaFalsa(falhar={b['id']})
+    assert outbox.RelayOutbox(app=None, q=q, lote=10).publicar_pendentes() == 1
+    assert q.enviadas == [a['id']]
+    banco_sql.encerrar_sessao()
+    linhas = {m.delivery_id: m for m in MensagemFila.query.all()}
+    assert linhas[a['id']].enviada_em is not None
+    assert (linhas[b['id']].enviada_em, linhas[b['id']].tentativas) == (None, 1)
+    # só a que falhou continua pendente
+    assert [e['id'] for _, e in banco_sql.listar_outbox_pendente(10)] == [b['id']]
@@ -0,0 +1,204 @@
+import json
+import threading
+import time
+
+import pytest
+
+import tiny_store
+
+
+@pytest.fixture
+def client(tmp_path, monkeypatch):
+    monkeypatch.setenv('TINYDB_PATH', str(tmp_path / 'tinydb.json'))
+    tiny_store.fechar_tinydb()
+    from app import create_app
+    app = create_app()
+    yield app.test_client()
+    tiny_store.fechar_tinydb()
+
+
+def _criar_pedidos(client, n):
+    ids = []
+    for i in range(n):
+        resp = client.post('/orders', json={'restaurante': 'R%d' % i, 'endereco_retirada': 'A', 'endereco_cliente': 'B'})
+        assert resp.status_code == 201
+        ids.append(resp.get_json()['id'])
+    return ids
+
+
+def test_paginacao_por_keyset(client):
+    ids = _criar_pedidos(client, 5)
+
+    pagina = client.get('/orders?limit=2').get_json()
+    assert [o['id'] for o in pagina['entregas']] == ids[::-1][:2]
+    pagina = client.get('/orders?limit=2&after_id=%d' % pagina['proximo_after_id']).get_json()
+    assert [o['id'] for o in pagina['entregas']] == ids[::-1][2:4]
+    pagina = client.get('/orders?limit=2&after_id=%d' % pagina['proximo_after_id']).get_json()
+    assert [o['id'] for o in pagina['entregas']] == ids[:1]
+    assert pagina['proximo_after_id'] is None
+
+    # sem parâmetros mantém o formato antigo
+    assert [o['id'] for o in client.get('/orders').get_json()] == ids[::-1]
+    assert client.get('/orders?limit=x').status_code == 400
+
+
+def test_filtros_e_ndjson(client):
+    import storage
+    ids = _criar_pedidos(client, 3)
+    storage.atribuir_entrega(ids[1], 7)
+
+    resp = client.get('/orders?status=atribuido')
+    assert [o['id'] for o in resp.get_json()] == [ids[1]]
+    resp = client.get('/orders?id_entregador=7&limit=10')
+    assert [o['id'] for o in resp.get_json()['entregas']] == [ids[1]]
+
+    resp = client.get('/orders?formato=ndjson&status=enfileirado')
+    assert resp.mimetype == 'application/x-ndjson'
+    linhas = [json.loads(l) for l in resp.get_data(as_text=True).splitlines()]
+    assert [o['id'] for o in linhas] == [ids[2], ids[0]]
+
+
+def test_atribuicao_compare_and_set(client):
+    import storage
+    delivery_id = _criar_pedidos(client, 1)[0]
+
+    assert storage.atribuir_entrega(delivery_id, 1)['id_entregador'] == 1
+    with pytest.raises(storage.EntregaJaAtribuida):
+        storage.atribuir_entrega(delivery_id, 2)
+    assert storage.obter_entrega(delivery_id)['id_entregador'] == 1
+    assert storage.atribuir_entrega(9999, 1) is None
+
+
+def test_fluxo_do_entregador(client):
+    driver = client.post('/drivers/register', json={'nome': 'Ana', 'senha': 's'}).get_json()
+    token = client.post('/drivers/login', json={'nome': 'Ana', 'senha': 's'}).get_json()['token_acesso']
+    headers = {'Authorization': 'Bearer ' + token}
+    delivery_id = _criar_pedidos(client, 1)[0]
+
+    resp = client.get('/driver/%d/next' % driver['id'], headers=headers)
+    assert resp.status_code == 200
+    assert resp.get_json()['id_entrega'] == delivery_id
+    # a mensagem foi consumida (ack)
+    assert client.get('/driver/%d/next' % driver['id'], headers=headers).status_code == 204
+
+    resp = client.post('/driver/%d/pickup' % driver['id'], headers=headers, json={'id_entrega': delivery_id})
+    assert resp.get_json() == {'id': delivery_id, 'status': 'coletado'}
+    resp = client.post('/driver/%d/deliver' % driver['id'], headers=headers, json={'id_entrega': delivery_id})
+    assert resp.get_json() == {'id': delivery_id, 'status': 'entregue'}
+
+
+def test_next_com_long_polling(client):
+    driver = client.post('/drivers/register', json={'nome': 'Bia', 'senha': 's'}).get_json()
+    token = client.post('/drivers/login', json={'nome': 'Bia', 'senha': 's'}).get_json()['token_acesso']
+    headers = {'Authorization': 'Bearer ' + token}
+    url = '/driver/%d/next?wait=%d' % (driver['id'], 2)
+
+    assert client.get('/driver/%d/next?wait=x' % driver['id'], headers=headers).status_code == 400
+    inicio = time.monotonic()
+    assert client.get('/driver/%d/next?wait=1' % driver['id'], headers=headers).status_code == 204
+    assert time.monotonic() - inicio >= 1
+
+    # o pedido criado durante a espera é entregue à requisição pendente
+    criador = threading.Timer(0.3, lambda: _criar_pedidos(client, 1))
+    criador.start()
+    resp = client.get(url, headers=headers)
+    criador.join()
+    assert resp.status_code == 200
+    assert resp.get_json()['status'] == 'atribuido'
+
+
+def test_next_descarta_mensagem_de_entrega_inexistente(client):
+    from fila import get_queue
+
+    driver = client.post('/drivers/register', json={'nome': 'Duda', 'senha': 's'}).get_json()
+    token = client.post('/drivers/login', json={'nome': 'Duda', 'senha': 's'}).get_json()['token_acesso']
+    headers = {'Authorization': 'Bearer ' + token}
+    url = '/driver/%d/next' % driver['id']
+    get_queue().send_message(999)
+    delivery_id = _criar_pedidos(client, 1)[0]
+
+    # a mensagem sem entrega recebe ack e a próxima é atribuída na mesma chamada
+    resp = client.get(url, headers=headers)
+    assert resp.status_code == 200 and resp.get_json()['id_entrega'] == delivery_id
+    assert get_queue().estatisticas()['em_voo'] == 0
+    assert client.get(url, headers=headers).status_code == 204
+
+
+def test_pickup_rele_sem_cache_atribuicao_de_outro_processo(client):
+    driver = client.post('/drivers/register', json={'nome': 'Caio', 'senha': 's'}).get_json()
+    token = client.post('/drivers/login', json={'nome': 'Caio', 'senha': 's'}).get_json()['token_acesso']
+    headers = {'Authorization': 'Bearer ' + token}
+    delivery_id = _criar_pedidos(client, 1)[0]
+    url = '/driver/%d/pickup' % driver['id']
+
+    # a entrega ainda não atribuída fica no cache
+    assert client.post(url, headers=headers, json={'id_entrega': delivery_id}).status_code == 404
+    # o worker (outro processo) atribui direto no banco, sem invalidar o cache desta API
+    tiny_store.atribuir_entrega_td(delivery_id, driver['id'])
+    assert client.post(url, headers=headers, json={'id_entrega': delivery_id}).get_json()['status'] == 'coletado'
+
+
+def test_criar_pedidos_em_lote(client):
+    pedidos = [
+        {'restaurante': 'R1', 'endereco_retirada': 'A', 'endereco_cliente': 'B'},
+        {'restaurante': 'R2'},
+        {'restaurant': 'R3', 'pickup_address': 'A', 'customer_address': 'B'},
+    ]
+    resp = client.post('/orders/batch', json={'pedidos': pedidos})
+    assert resp.status_code == 207
+    corpo = resp.get_json()
+    assert corpo['criados'] == 2
+    r1, r2, r3 = corpo['resultados']
+    assert [r['indice'] for r in corpo['resultados']] == [0, 1, 2]
+    assert 'erro' in r2 and 'id' not in r2
+    assert r1['status'] == r3['status'] == 'enfileirado' and r3['id'] == r1['id'] + 1
+    assert [o['restaurante'] for o in client.get('/orders').get_json()] == ['R3', 'R1']
+    assert tiny_store.estatisticas_fila_td()['visiveis'] == 2
+
+    assert client.post('/orders/batch', json=pedidos[:1]).status_code == 201
+    assert client.post('/orders/batch', json=[]).status_code == 400
+    assert client.post('/orders/batch', json=pedidos[:1] * 101).status_code == 413
+
+
+def test_admin_dlq_lista_e_reprocessa(client, monkeypatch):
+    import app as modulo_app
+    from fila import get_queue
+
+    _criar_pedidos(client, 2)
+    q = get_queue()
+    m1, m2 = q.receive_messages(2)
+    q.move_to_dlq([(m1, {'motivo': 'erro'}), (m2, {'motivo': 'erro'})])
+
+    # sem ADMIN_TOKEN configurado os endpoints ficam fechados
+    assert client.get('/admin/dlq').status_code == 403
+    monkeypatch.setattr(modulo_app, 'ADMIN_TOKEN', 'segredo')
+    assert client.get('/admin/dlq', headers={'X-Admin-Token': 'errado'}).status_code == 403
+
+    headers = {'X-Admin-Token': 'segredo'}
+    corpo = client.get('/admin/dlq', headers=headers).get_json()
+    assert corpo['total'] == 2
+    assert [m['id_entrega'] for m in corpo['mensagens']] == [m1['id_entrega'], m2['id_entrega']]
+
+    resp = client.post('/admin/dlq/redrive', headers=headers, json={'ids': [corpo['mensagens'][1]['id']]})
+    assert resp.get_json()['total'] == 1
+    assert [m['id_entrega'] for m in q.receive_messages(10)] == [m2['id_entrega']]
+    assert client.get('/admin/dlq', headers=headers).get_json()['total'] == 1
+
+
+def test_eventos_sse_retoma_do_last_event_id(client):
+    import eventos
+    import storage
+    ids = _criar_pedidos(client, 2)
+    cursor = eventos.obter_barramento().ultimo_id()
+    storage.atribuir_entrega(ids[0], 7)
+    storage.atribuir_entrega(ids[1], 8)
+    storage.atualizar_status_entrega(ids[1], 'coletado')
+
+    resp = client.get('/orders/events?timeout=0&id_entregador=8', headers={'Last-Event-ID': str(cursor)})
+    assert resp.mimetype == 'text/event-stream'
+    blocos = [b for b in resp.get_data(as_text=True).split('\n\n') if b.startswith('id:')]
+    dados = [json.loads(b.split('data: ', 1)[1]) for b in blocos]
+    assert [(d['id_entrega'], d['status']) for d in dados] == [(ids[1], 'atribuido'), (ids[1], 'coletado')]
+    assert blocos[-1].startswith('id: %d\n' % (cursor + 3))
+
+    assert client.get('/orders/events?timeout=x').status_code == 400
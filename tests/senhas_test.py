@@ -0,0 +1,43 @@
+import senhas
+
+
+def test_cache_de_login_evita_recalcular_hash(monkeypatch):
+    monkeypatch.setattr(senhas, 'HASH_WORKERS', 0)
+    monkeypatch.setattr(senhas, 'LOGIN_CACHE_TTL', 60)
+    senhas.limpar_cache()
+    password_hash = senhas.gerar_hash('segredo')
+
+    chamadas = []
+    verificar = senhas.verificar_senha
+    monkeypatch.setattr(senhas, 'verificar_senha', lambda h, s: chamadas.append(s) or verificar(h, s))
+
+    assert senhas.verificar_login('ana', 'segredo', password_hash)
+    assert senhas.verificar_login('ana', 'segredo', password_hash)
+    assert chamadas == ['segredo']
+    # senha errada nunca é servida pelo cache
+    assert not senhas.verificar_login('ana', 'outra', password_hash)
+    # hash diferente (senha trocada) é outra chave
+    assert senhas.verificar_login('ana', 'segredo', senhas.gerar_hash('segredo'))
+    assert chamadas == ['segredo', 'outra', 'segredo']
+
+
+def test_precisa_rehash_quando_a_politica_muda(monkeypatch):
+    monkeypatch.setattr(senhas, 'HASH_WORKERS', 0)
+    monkeypatch.setattr(senhas, '_metodo', None)
+    monkeypatch.setattr(senhas, 'HASH_METHOD', 'pbkdf2:sha256:1000')
+    atual = senhas.gerar_hash('x')
+    assert not senhas.precisa_rehash(atual)
+
+    monkeypatch.setattr(senhas, '_metodo', None)
+    monkeypatch.setattr(senhas, 'HASH_METHOD', 'pbkdf2:sha256:2000')
+    assert senhas.precisa_rehash(atual)
+
+
+def test_hash_no_pool_de_processos(monkeypatch):
+    monkeypatch.setattr(senhas, 'HASH_WORKERS', 1)
+    try:
+        password_hash = senhas.gerar_hash('abc')
+        assert senhas.verificar_senha(password_hash, 'abc')
+        assert not senhas.verificar_senha(password_hash, 'abd')
+    finally:
+        senhas.encerrar_pool()
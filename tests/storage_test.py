@@ -0,0 +1,74 @@
+import sqlite3
+
+import pytest
+
+import storage
+
+
+def test_perfil_de_engine(tmp_path):
+    assert storage.opcoes_engine('sqlite:///app.db') == {}
+    pg = storage.opcoes_engine('postgresql://u@h/db')
+    assert pg['pool_pre_ping'] and pg['pool_size'] == storage.DB_POOL_SIZE
+    assert storage.opcoes_engine('postgresql://u@h/db', perfil='padrao') == {}
+
+    conexao = sqlite3.connect(str(tmp_path / 'app.db'))
+    storage._pragmas_sqlite(conexao, None)
+    pragmas = [conexao.execute('PRAGMA %s' % p).fetchone()[0] for p in ('journal_mode', 'synchronous', 'busy_timeout')]
+    # synchronous=NORMAL é 1
+    assert pragmas == ['wal', 1, storage.SQLITE_BUSY_TIMEOUT_MS]
+    conexao.close()
+
+
+@pytest.mark.parametrize('returning', [True, False])
+def test_atribuicao_compare_and_set_no_sqlite(banco_sql, monkeypatch, returning):
+    # sem RETURNING (SQLite < 3.35, MySQL) a entrega é relida depois do UPDATE
+    monkeypatch.setattr(banco_sql.db.engine.dialect, 'update_returning', returning)
+    entrega = banco_sql.criar_entrega('R', 'A', 'B')
+
+    atribuida = banco_sql.atribuir_entrega(entrega['id'], 7)
+    assert (atribuida['status'], atribuida['id_entregador']) == ('atribuido', 7)
+    with pytest.raises(banco_sql.EntregaJaAtribuida):
+        banco_sql.atribuir_entrega(entrega['id'], 8)
+    assert banco_sql.obter_entrega(entrega['id'], usar_cache=False)['id_entregador'] == 7
+    assert banco_sql.atribuir_entrega(entrega['id'] + 100, 7) is None
+
+
+def test_cursor_do_round_robin_no_sqlite(banco_sql):
+    assert [banco_sql.avancar_cursor() for _ in range(3)] == [0, 1, 2]
+    # cada nome tem o próprio contador
+    assert banco_sql.avancar_cursor('outro') == 0
+    assert banco_sql.avancar_cursor() == 3
+
+
+def test_paginacao_por_keyset_no_sqlite(banco_sql):
+    ids = [banco_sql.criar_entrega('R%d' % i, 'A', 'B')['id'] for i in range(5)]
+    banco_sql.atribuir_entrega(ids[1], 7)
+
+    paginas, after_id = [], None
+    while True:
+        pagina = [o['id'] for o in banco_sql.listar_entregas(2, after_id)]
+        paginas.append(pagina)
+        if len(pagina) < 2:
+            break
+        # o `proximo_after_id` de GET /orders é o último id da página
+        after_id = pagina[-1]
+    assert paginas == [ids[4:2:-1], ids[2:0:-1], ids[:1]]
+
+    assert [o['id'] for o in banco_sql.listar_entregas(2, ids[3], status='enfileirado')] == [ids[2], ids[0]]
+    assert [o['id'] for o in banco_sql.listar_entregas(id_entregador=7)] == [ids[1]]
+    assert [o['id'] for o in banco_sql.iterar_entregas(tamanho_pagina=2)] == ids[::-1]
+
+
+def test_criar_entregas_em_lote_no_sqlite(banco_sql):
+    from modelos import MensagemFila
+
+    antes = banco_sql.criar_entrega('R', 'A', 'B')
+    itens = [('R%d' % i, 'A%d' % i, 'B%d' % i) for i in range(25)]
+    criadas = banco_sql.criar_entregas(itens, outbox=True)
+
+    # ids crescentes e na ordem de `itens`
+    assert [c['id'] for c in criadas] == list(range(antes['id'] + 1, antes['id'] + 26))
+    assert [(c['restaurante'], c['endereco_retirada'], c['endereco_cliente']) for c in criadas] == itens
+    assert banco_sql.obter_entrega(criadas[7]['id'], usar_cache=False)['restaurante'] == 'R7'
+    assert sorted(m.delivery_id for m in MensagemFila.query.all()) == [c['id'] for c in criadas]
+    assert banco_sql.criar_entregas([]) == []
@@ -0,0 +1,139 @@
+import json
+
+import pytest
+from tinydb import TinyDB
+
+import tiny_armazenamento
+import tiny_store
+from tiny_armazenamento import ArmazenamentoLog, CacheComIntervalo, JSONAtomico, TinyDBLog
+from tiny_store import FilaLocal
+
+
+def test_log_grava_apenas_alteracoes_e_reabre(tmp_path):
+    path = str(tmp_path / 'db.json')
+    db = TinyDBLog(path, intervalo=0)
+    t = db.table('deliveries')
+    ids = t.insert_multiple({'n': i} for i in range(3))
+    t.update({'status': 'entregue'}, doc_ids=[ids[1]])
+    t.remove(doc_ids=[ids[0]])
+
+    linhas = [json.loads(l) for l in open(path + '.log')]
+    assert linhas[-2:] == [['deliveries', ids[1], {'n': 1, 'status': 'entregue'}], ['deliveries', ids[0], None]]
+    db.close()
+
+    # o snapshot compactado é um arquivo TinyDB normal
+    assert sorted(d['n'] for d in TinyDB(path).table('deliveries')) == [1, 2]
+    assert TinyDBLog(path, intervalo=0).table('deliveries').get(doc_id=ids[1])['status'] == 'entregue'
+
+
+def test_log_recupera_depois_de_queda(tmp_path):
+    path = str(tmp_path / 'db.json')
+    db = TinyDBLog(path, intervalo=0)
+    db.table('t').insert({'a': 1})
+    db.table('t').insert({'a': 2})
+    # processo morre no meio de uma escrita: sem close e com linha incompleta
+    with open(path + '.log', 'a') as f:
+        f.write('["t", 3, {"a"')
+
+    reaberto = TinyDBLog(path, intervalo=0)
+    assert [d['a'] for d in reaberto.table('t')] == [1, 2]
+    assert reaberto.table('t').insert({'a': 3}) == 3
+    assert open(path + '.log').read().endswith('["t", 3, {"a": 3}]\n')
+
+
+def test_log_compacta_e_escreve_em_lote(tmp_path):
+    path = str(tmp_path / 'db.json')
+    storage = ArmazenamentoLog(path, intervalo=60, compactar_apos=5)
+    db = TinyDBLog(storage=lambda: storage)
+    t = db.table('t')
+    for i in range(4):
+        t.insert({'i': i})
+    # nada gravado antes do flush periódico
+    assert not (tmp_path / 'db.json.log').exists()
+    storage.flush()
+    assert len(open(path + '.log').readlines()) == 4
+
+    t.insert({'i': 4})
+    storage._periodico()
+    assert open(path + '.log').read() == ''
+    assert len(json.load(open(path))['t']) == 5
+    db.close()
+
+
+def test_log_enxerga_escritas_de_outro_processo(tmp_path):
+    path = str(tmp_path / 'db.json')
+    api = TinyDBLog(path, intervalo=0)
+    worker = TinyDBLog(path, intervalo=0)
+    fila_worker = FilaLocal(worker, path)
+    FilaLocal(api, path).enviar(7)
+
+    _, delivery_id, receipt, _ = fila_worker.receber()
+    assert delivery_id == 7
+    assert fila_worker.deletar(receipt)
+
+    # depois que um lado compacta, o outro recarrega snapshot + log
+    worker.storage.compactar()
+    api.table('t').insert({'x': 1})
+    assert worker.table('t').all() == [{'x': 1}]
+    assert api.table('queue').all() == []
+
+
+def test_log_informa_documentos_alterados_por_outro_processo(tmp_path):
+    path = str(tmp_path / 'db.json')
+    api = TinyDBLog(path, intervalo=0)
+    api.table('outra').insert({'x': 1})
+    worker = TinyDBLog(path, intervalo=0)
+    carga, doc_ids = worker.storage.alteracoes('queue')
+    assert doc_ids == set()
+
+    ids = api.table('queue').insert_multiple({'i': i} for i in range(3))
+    api.table('queue').remove(doc_ids=[ids[0]])
+    api.table('outra').insert({'x': 2})
+    assert worker.storage.alteracoes('queue') == (carga, set(ids))
+    assert worker.storage.alteracoes('queue') == (carga, set())
+
+    # compactação do outro lado: o worker relê tudo e a carga muda
+    api.storage.compactar()
+    api.table('queue').insert({'i': 3})
+    assert worker.storage.alteracoes('queue')[0] != carga
+
+
+def test_cache_grava_no_intervalo_e_no_close(tmp_path):
+    path = str(tmp_path / 'db.json')
+    db = TinyDB(path, storage=CacheComIntervalo(JSONAtomico, escritas=1000, intervalo=60))
+    db.table('t').insert({'a': 1})
+    assert JSONAtomico(path).read() is None
+    db.storage.flush()
+    assert JSONAtomico(path).read() == {'t': {'1': {'a': 1}}}
+    db.table('t').insert({'a': 2})
+    db.close()
+    assert len(JSONAtomico(path).read()['t']) == 2
+
+
+def test_cache_recusa_segundo_dono(tmp_path):
+    path = str(tmp_path / 'db.json')
+    db = TinyDB(path, storage=CacheComIntervalo(JSONAtomico, intervalo=0))
+    # outro processo (ou outra abertura) regravaria o arquivo por cima deste
+    with pytest.raises(RuntimeError):
+        TinyDB(path, storage=CacheComIntervalo(JSONAtomico, intervalo=0))
+    db.table('t').insert({'a': 1})
+    db.close()
+    outro = TinyDB(path, storage=CacheComIntervalo(JSONAtomico, intervalo=0))
+    assert outro.table('t').all() == [{'a': 1}]
+    outro.close()
+
+
+def test_tiny_store_no_modo_log(tmp_path, monkeypatch):
+    monkeypatch.setattr(tiny_armazenamento, 'TINYDB_STORAGE', 'log')
+    tiny_store.fechar_tinydb()
+    tiny_store.init_tinydb(str(tmp_path / 'db.json'))
+    try:
+        entrega = tiny_store.criar_entrega_td('R', 'A', 'B')
+        tiny_store.enviar_mensagem_td(entrega['id'])
+        msg = tiny_store.receber_mensagem_td()
+        assert msg['corpo']['id_entrega'] == entrega['id']
+        assert tiny_store.atribuir_entrega_td(entrega['id'], 1)['status'] == 'atribuido'
+        assert tiny_store.deletar_mensagem_td(msg['ReceiptHandle'])
+    finally:
+        tiny_store.fechar_tinydb()
+    assert TinyDB(str(tmp_path / 'db.json')).table('deliveries').get(doc_id=entrega['id'])['id_entregador'] == 1
@@ -0,0 +1,99 @@
+import json
+import os
+import subprocess
+import sys
+import threading
+import time
+
+import pytest
+
+from tiny_trava import TravaBanco, fcntl
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def test_leitores_em_paralelo_e_escritor_exclusivo(tmp_path):
+    trava = TravaBanco(str(tmp_path / 'db.json'))
+    dentro = []
+    maximo = []
+    lock = threading.Lock()
+
+    def ler():
+        with trava.leitura():
+            with lock:
+                dentro.append(1)
+                maximo.append(len(dentro))
+            time.sleep(0.05)
+            with lock:
+                dentro.pop()
+
+    def escrever():
+        with trava.escrita():
+            with lock:
+                maximo.append(-len(dentro))
+            time.sleep(0.02)
+
+    threads = [threading.Thread(target=ler) for _ in range(4)] + [threading.Thread(target=escrever)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert max(maximo) > 1
+    # o escritor nunca viu leitores ativos
+    assert all(m >= 0 for m in maximo if m <= 0)
+
+    # reentrância: leitura dentro de escrita; escrita dentro de leitura é erro
+    with trava.escrita():
+        with trava.leitura():
+            with trava.escrita():
+                pass
+    with trava.leitura():
+        with pytest.raises(RuntimeError):
+            with trava.escrita():
+                pass
+    trava.fechar()
+
+
+SCRIPT = '''
+import sys, threading
+sys.path.insert(0, %r)
+import tiny_store
+tiny_store.init_tinydb(sys.argv[1])
+ganhou = []
+
+def criar():
+    for _ in range(20):
+        tiny_store.criar_entrega_td('R', 'A', 'B')
+
+def atribuir():
+    for i in range(1, 11):
+        try:
+            tiny_store.atribuir_entrega_td(i, int(sys.argv[2]))
+            ganhou.append(i)
+        except tiny_store.EntregaJaAtribuida:
+            pass
+
+threads = [threading.Thread(target=criar) for _ in range(3)]
+for t in threads: t.start()
+for t in threads: t.join()
+atribuir()
+tiny_store.fechar_tinydb()
+print(len(ganhou))
+''' % RAIZ
+
+
+@pytest.mark.skipif(fcntl is None, reason='requer fcntl')
+@pytest.mark.parametrize('modo', ['json', 'log'])
+def test_varios_processos_no_mesmo_arquivo(tmp_path, modo):
+    path = str(tmp_path / 'db.json')
+    env = dict(os.environ, TINYDB_STORAGE=modo, TINYDB_FLUSH_INTERVAL='0')
+    procs = [subprocess.Popen([sys.executable, '-c', SCRIPT, path, str(n)], stdout=subprocess.PIPE, stderr=subprocess.PIPE, env=env) for n in range(1, 4)]
+    saidas = [p.communicate(timeout=120) for p in procs]
+    assert all(p.returncode == 0 for p in procs), [e for _, e in saidas]
+
+    # compare-and-set entre processos: cada entrega atribuída uma única vez
+    assert sum(int(o) for o, _ in saidas) == 10
+    with open(path) as f:
+        entregas = json.load(f)['deliveries']
+    assert len(entregas) == 3 * 3 * 20
+    assert len([e for e in entregas.values() if e['status'] == 'atribuido']) == 10
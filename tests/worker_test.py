@@ -0,0 +1,292 @@
+import threading
+import time
+
+import storage
+import tiny_store
+import worker
+
+
+class FilaFalsa:
+    def __init__(self, ids):
+        self.ids = list(ids)
+        self.apagadas = []
+        self.adiadas = []
+        self.dlq = []
+        self.lock = threading.Lock()
+
+    def receive_messages(self, n, hidratar=None):
+        with self.lock:
+            lote, self.ids = self.ids[:n], self.ids[n:]
+        return [{'ReceiptHandle': 'r%d' % i, 'entrega': {'id': i}} for i in lote]
+
+    def delete_messages(self, receipts):
+        with self.lock:
+            self.apagadas.extend(receipts)
+        return {'Successful': receipts, 'Failed': []}
+
+    def change_visibility(self, itens):
+        self.adiadas.extend(itens)
+        return {'Successful': [r for r, _ in itens], 'Failed': []}
+
+    def move_to_dlq(self, itens):
+        self.dlq.extend(itens)
+        return {'Successful': [m['ReceiptHandle'] for m, _ in itens], 'Failed': []}
+
+
+def test_pool_atribui_tudo_e_encerra_sem_mensagens_em_voo(monkeypatch):
+    atribuidas = []
+    lock = threading.Lock()
+
+    def atribuir(delivery_id, driver_id):
+        time.sleep(0.001)
+        with lock:
+            atribuidas.append(delivery_id)
+        return {'id': delivery_id}
+
+    monkeypatch.setattr(worker, 'roster', worker.CacheEntregadores(carregar=lambda: [{'id': 1}, {'id': 2}]))
+    monkeypatch.setattr(worker, 'atribuir_entrega', atribuir)
+    monkeypatch.setattr(worker, 'POLL_INTERVAL', 0.01)
+
+    q = FilaFalsa(range(200))
+    pool = worker.PoolWorkers(q, {'last_index': 0}, concurrency=4, batch_size=5, max_em_voo=12)
+    pool.iniciar()
+    prazo = time.monotonic() + 5
+    while q.ids and time.monotonic() < prazo:
+        time.sleep(0.01)
+    pool.encerrar(timeout=5)
+
+    assert not pool.vivo()
+    assert not pool.em_voo
+    assert pool.atribuidas == 200
+    assert sorted(atribuidas) == list(range(200))
+    assert len(q.apagadas) == 200
+
+
+def test_cache_de_entregadores_recarrega_ao_expirar():
+    banco = [{'id': 1, 'name': 'a'}, {'id': 2, 'name': 'b'}]
+    chamadas = []
+
+    def carregar():
+        chamadas.append(1)
+        return [dict(d) for d in reversed(banco)]
+
+    cache = worker.CacheEntregadores(ttl=60, carregar=carregar)
+    assert [d['id'] for d in cache.obter()] == [2, 1]
+    banco.append({'id': 3, 'name': 'c'})
+    del banco[0]
+    # dentro do TTL não consulta o storage
+    assert [d['id'] for d in cache.obter()] == [2, 1]
+    assert len(chamadas) == 1
+
+    # TTL expirado: lista inteira de novo, sem o entregador removido
+    cache._expira_em = 0
+    assert [d['id'] for d in cache.obter()] == [3, 2]
+    assert len(chamadas) == 2
+
+    cache.invalidar()
+    cache.obter()
+    assert len(chamadas) == 3
+
+
+def test_cache_nao_guarda_lista_vazia():
+    banco = []
+    cache = worker.CacheEntregadores(ttl=60, carregar=lambda: list(banco))
+    assert cache.obter() == ()
+    banco.append({'id': 5, 'name': 'x'})
+    assert [d['id'] for d in cache.obter()] == [5]
+
+
+def test_estado_arquivo_checkpoint_a_cada_n(tmp_path):
+    path = str(tmp_path / 'estado.json')
+    estado = worker.EstadoArquivo(path, a_cada=3, intervalo=3600)
+    drivers = [{'id': 1}, {'id': 2}]
+
+    picks = [worker.selecionar_entregador_round_robin(drivers, estado)['id'] for _ in range(4)]
+    assert picks == [1, 2, 1, 2]
+    # checkpoint só na 3ª escolha
+    assert worker.load_state(path) == {'last_index': 3}
+
+    estado.fechar()
+    assert worker.load_state(path) == {'last_index': 4}
+    # reiniciar continua de onde parou
+    assert worker.EstadoArquivo(path).avancar() == 4
+
+
+def test_duplicata_recebe_ack_sem_reenfileirar(monkeypatch):
+    def atribuir(delivery_id, driver_id):
+        raise worker.EntregaJaAtribuida(delivery_id)
+
+    monkeypatch.setattr(worker, 'atribuir_entrega', atribuir)
+    q = FilaFalsa([])
+    roster = worker.CacheEntregadores(carregar=lambda: [{'id': 1}])
+
+    feitas = worker.processar_lote(q, [{'ReceiptHandle': 'r1', 'entrega': {'id': 1}}], {'last_index': 0}, roster)
+    assert feitas == 0
+    assert q.apagadas == ['r1']
+    assert q.adiadas == [] and q.dlq == []
+
+
+def test_erro_adia_com_backoff_e_vai_para_dlq_no_limite(monkeypatch):
+    def atribuir(delivery_id, driver_id):
+        raise RuntimeError('banco fora')
+
+    monkeypatch.setattr(worker, 'atribuir_entrega', atribuir)
+    monkeypatch.setattr(worker, 'MAX_ATTEMPTS', 3)
+    monkeypatch.setattr(worker, 'RETRY_BASE_SECONDS', 2)
+    roster = worker.CacheEntregadores(carregar=lambda: [{'id': 1}])
+    q = FilaFalsa([])
+    msgs = [{'ReceiptHandle': 'r%d' % n, 'entrega': {'id': n}, 'tentativas': n} for n in (1, 2, 3)]
+
+    assert worker.processar_lote(q, msgs, {'last_index': 0}, roster) == 0
+    assert q.apagadas == []
+    assert [r for r, _ in q.adiadas] == ['r1', 'r2']
+    # metade fixa + jitter: [1, 2) na 1ª tentativa, [2, 4) na 2ª
+    assert 1 <= q.adiadas[0][1] <= 2 and 2 <= q.adiadas[1][1] <= 4
+    [(morta, info)] = q.dlq
+    assert morta['ReceiptHandle'] == 'r3' and info == {'motivo': 'erro', 'erro': 'banco fora'}
+
+
+def test_sem_entregadores_adia_a_propria_mensagem():
+    vazio = worker.CacheEntregadores(carregar=lambda: [])
+    q = FilaFalsa([])
+    msgs = [{'ReceiptHandle': 'r1', 'entrega': {'id': 1}, 'tentativas': 50}]
+
+    worker.processar_lote(q, msgs, {'last_index': 0}, vazio)
+    # nada de cópia reenviada nem de DLQ: a original fica invisível até o backoff
+    assert q.apagadas == [] and q.dlq == []
+    assert [r for r, _ in q.adiadas] == ['r1']
+    assert q.adiadas[0][1] <= worker.RETRY_MAX_SECONDS
+
+
+def test_pool_sem_entregadores_encerra_sem_esperar_o_poll(monkeypatch):
+    monkeypatch.setattr(worker, 'roster', worker.CacheEntregadores(carregar=lambda: []))
+    monkeypatch.setattr(worker, 'POLL_INTERVAL', 60)
+    q = FilaFalsa([1])
+    pool = worker.PoolWorkers(q, {'last_index': 0}, concurrency=1, batch_size=1)
+    pool.iniciar()
+    prazo = time.monotonic() + 5
+    while not q.adiadas and time.monotonic() < prazo:
+        time.sleep(0.01)
+
+    inicio = time.monotonic()
+    pool.encerrar(timeout=5)
+    assert not pool.vivo()
+    assert time.monotonic() - inicio < 1
+
+
+def test_indice_carga_menos_carregado_com_limite():
+    indice = worker.IndiceCarga(ttl=60, carregar=lambda: [(10, 1), (11, 1)])
+    try:
+        drivers = ({'id': 1}, {'id': 2}, {'id': 3})
+        indice.sincronizar(drivers)
+        picks = [indice.reservar(i)['id'] for i in (20, 21, 22)]
+        # 2 e 3 começam vazios; no empate vence quem está há mais tempo sem receber
+        assert picks == [2, 3, 2]
+        assert [indice.carga(d) for d in (1, 2, 3)] == [2, 2, 1]
+        assert indice.reservar(23, limite=2)['id'] == 3
+        assert indice.reservar(24, limite=2) is None
+
+        indice.ao_alterar({'id': 10, 'status': 'entregue'})
+        indice.liberar(22, 2)
+        assert [indice.carga(d) for d in (1, 2, 3)] == [1, 1, 2]
+        # roster novo: o entregador entra com carga zero sem recarregar do banco
+        indice.sincronizar(drivers + ({'id': 4},))
+        assert indice.reservar(25, limite=2)['id'] == 4
+    finally:
+        indice.fechar()
+
+
+def test_capacidade_segura_mensagem_ate_entregador_liberar(tmp_path):
+    tiny_store.fechar_tinydb()
+    tiny_store.init_tinydb(str(tmp_path / 'db.json'))
+    consultas = []
+
+    def carregar():
+        consultas.append(1)
+        return storage.listar_entregas_ativas()
+
+    estrategia = worker.EstrategiaCapacidade(worker.IndiceCarga(ttl=60, carregar=carregar), capacidade=1)
+    try:
+        ids = [storage.criar_entrega('R', 'A', 'B')['id'] for _ in range(3)]
+        roster = worker.CacheEntregadores(carregar=lambda: [{'id': 1}, {'id': 2}])
+        q = FilaFalsa([])
+        msgs = [{'ReceiptHandle': 'r%d' % i, 'entrega': {'id': i}} for i in ids]
+
+        assert worker.processar_lote(q, msgs, estrategia, roster) == 2
+        # a terceira fica sem ack e é adiada com backoff
+        assert q.apagadas == ['r%d' % i for i in ids[:2]]
+        assert [r for r, _ in q.adiadas] == ['r%d' % ids[2]]
+        donos = {storage.obter_entrega(i)['id_entregador'] for i in ids[:2]}
+        assert donos == {1, 2}
+
+        storage.atualizar_status_entrega(ids[0], 'coletado')
+        assert worker.processar_lote(q, msgs[2:], estrategia, roster) == 0
+        storage.atualizar_status_entrega(ids[0], 'entregue')
+        assert worker.processar_lote(q, msgs[2:], estrategia, roster) == 1
+        assert storage.obter_entrega(ids[2])['id_entregador'] == storage.obter_entrega(ids[0])['id_entregador']
+        # uma única consulta agregada; o resto veio das notificações do storage
+        assert consultas == [1]
+    finally:
+        estrategia.fechar()
+        tiny_store.fechar_tinydb()
+
+
+def test_executar_para_com_evento(monkeypatch):
+    import flask
+
+    q = FilaFalsa(range(30))
+    monkeypatch.setattr(worker, 'get_queue', lambda: q)
+    monkeypatch.setattr(worker, '_criar_app', lambda: flask.Flask('teste'))
+    monkeypatch.setattr(worker, 'atribuir_entrega', lambda delivery_id, driver_id: {'id': delivery_id})
+    monkeypatch.setattr(worker, 'roster', worker.CacheEntregadores(carregar=lambda: [{'id': 1}]))
+    monkeypatch.setattr(worker.metricas, 'WORKER_METRICS_PORT', 0)
+    monkeypatch.setattr(worker, 'POLL_INTERVAL', 0.01)
+    # sem checkpoint em worker_state.json
+    monkeypatch.setattr(worker, 'criar_estrategia', lambda: worker.EstrategiaRoundRobin({'last_index': 0}))
+
+    parar = threading.Event()
+    resultado = []
+    t = threading.Thread(target=lambda: resultado.append(worker.executar(1, parar)))
+    t.start()
+    prazo = time.monotonic() + 5
+    while q.ids and time.monotonic() < prazo:
+        time.sleep(0.01)
+    parar.set()
+    t.join(5)
+    assert not t.is_alive()
+    assert resultado == [30]
+
+
+def test_executar_sem_pausa_entre_lotes_e_para_com_sigterm(monkeypatch):
+    import os
+    import signal
+
+    import flask
+
+    q = FilaFalsa(range(500))
+    monkeypatch.setattr(worker, 'get_queue', lambda: q)
+    monkeypatch.setattr(worker, '_criar_app', lambda: flask.Flask('teste'))
+    monkeypatch.setattr(worker, 'atribuir_entrega', lambda delivery_id, driver_id: {'id': delivery_id})
+    monkeypatch.setattr(worker, 'roster', worker.CacheEntregadores(carregar=lambda: [{'id': 1}]))
+    monkeypatch.setattr(worker.metricas, 'WORKER_METRICS_PORT', 0)
+    monkeypatch.setattr(worker, 'POLL_INTERVAL', 60)
+    monkeypatch.setattr(worker, 'BATCH_SIZE', 10)
+    monkeypatch.setattr(worker, 'criar_estrategia', lambda: worker.EstrategiaRoundRobin({'last_index': 0}))
+
+    def sinalizar():
+        while q.ids:
+            time.sleep(0.01)
+        os.kill(os.getpid(), signal.SIGTERM)
+
+    anteriores = signal.getsignal(signal.SIGTERM), signal.getsignal(signal.SIGINT)
+    threading.Thread(target=sinalizar, daemon=True).start()
+    inicio = time.monotonic()
+    try:
+        # thread principal: o worker instala o handler de SIGTERM
+        assert worker.executar(1) == 500
+    finally:
+        signal.signal(signal.SIGTERM, anteriores[0])
+        signal.signal(signal.SIGINT, anteriores[1])
+    # 50 lotes sem o antigo delay fixo de 0,1s; o SIGTERM interrompe a espera de 60s da fila vazia
+    assert time.monotonic() - inicio < 3
+    assert len(q.apagadas) == 500
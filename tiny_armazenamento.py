@@ -0,0 +1,447 @@
+"""Modos de persistência do TinyDB com escrita adiada (`TINYDB_STORAGE`).
+
+O JSONStorage padrão relê e regrava o `tinydb.json` inteiro a cada operação,
+então o custo de cada escrita cresce com o tamanho do banco. Além dele
+(`json`, padrão) há dois modos:
+
+- `cache`: `CachingMiddleware` do TinyDB. As escritas ficam em memória e o
+  arquivo é regravado a cada `TINYDB_CACHE_WRITES` escritas ou
+  `TINYDB_FLUSH_INTERVAL` segundos. A regravação é atômica (arquivo temporário
+  + `os.replace`), mas continua O(tamanho do banco).
+- `log`: o banco fica em memória e cada escrita acrescenta só os documentos
+  alterados, uma linha JSON por documento, em `<arquivo>.log`. O log é gravado
+  em lote a cada `TINYDB_FLUSH_INTERVAL` segundos e compactado para o snapshot
+  (`<arquivo>`, no formato normal do TinyDB) depois de `TINYDB_COMPACT_AFTER`
+  linhas. Se o processo cair, a abertura seguinte reaplica o log sobre o
+  snapshot e descarta uma última linha incompleta.
+
+Todos os processos que abrem o mesmo arquivo precisam usar o mesmo modo. No
+modo `log`, um processo enxerga as escritas de outro quando elas chegam ao log
+(depois do flush). O modo `cache` é de um processo só: cada flush regrava o
+arquivo com a cópia em memória e apagaria as escritas de outro processo, então
+a abertura falha se outro processo já tem o arquivo aberto nesse modo (trava em
+`<arquivo>.cache.lock`).
+"""
+import json
+import logging
+import os
+import threading
+from collections.abc import MutableMapping
+from contextlib import nullcontext
+
+from tinydb import TinyDB
+from tinydb.middlewares import CachingMiddleware
+from tinydb.storages import Storage
+from tinydb.table import Table
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+TINYDB_STORAGE = os.getenv('TINYDB_STORAGE', 'json').lower()
+FLUSH_INTERVAL = float(os.getenv('TINYDB_FLUSH_INTERVAL', '1'))
+COMPACT_AFTER = int(os.getenv('TINYDB_COMPACT_AFTER', '50000'))
+CACHE_WRITES = int(os.getenv('TINYDB_CACHE_WRITES', '1000'))
+FSYNC = os.getenv('TINYDB_FSYNC', 'true').lower() == 'true'
+
+logger = logging.getLogger('tiny_armazenamento')
+
+
+def gravar_atomico(path, texto, fsync=FSYNC):
+    """Grava `texto` em `path` via arquivo temporário e `os.replace`."""
+    tmp = '%s.tmp.%d' % (path, os.getpid())
+    with open(tmp, 'w', encoding='utf-8') as f:
+        f.write(texto)
+        if fsync:
+            f.flush()
+            os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+
+class _Flusher:
+    """Thread que chama `alvo()` a cada `intervalo` segundos até `parar()`."""
+
+    def __init__(self, alvo, intervalo, nome):
+        self._alvo = alvo
+        self._intervalo = intervalo
+        self._parar = threading.Event()
+        self._thread = threading.Thread(target=self._executar, name=nome, daemon=True)
+        self._thread.start()
+
+    def _executar(self):
+        while not self._parar.wait(self._intervalo):
+            try:
+                self._alvo()
+            except RuntimeError:
+                # documento alterado por outra thread durante a serialização; tenta de novo no próximo ciclo
+                pass
+            except Exception as e:
+                logger.error('falha ao gravar o TinyDB: %s', e)
+
+    def parar(self):
+        self._parar.set()
+        if self._thread is not threading.current_thread():
+            self._thread.join()
+
+
+class JSONAtomico(Storage):
+    """JSONStorage que regrava o arquivo de forma atômica."""
+
+    def __init__(self, path, fsync=FSYNC):
+        self._path = path
+        self._fsync = fsync
+
+    def read(self):
+        try:
+            with open(self._path, encoding='utf-8') as f:
+                texto = f.read()
+        except FileNotFoundError:
+            return None
+        return json.loads(texto) if texto.strip() else None
+
+    def write(self, data):
+        gravar_atomico(self._path, json.dumps(data), self._fsync)
+
+
+class CacheComIntervalo(CachingMiddleware):
+    """CachingMiddleware que também grava o cache a cada `intervalo` segundos.
+
+    Exclusivo de um processo: a abertura toma um `flock` não bloqueante em
+    `<arquivo>.cache.lock`, mantido até `close()`, e levanta RuntimeError se
+    outro processo já usa o arquivo no modo `cache`.
+    """
+
+    def __init__(self, storage_cls=JSONAtomico, escritas=None, intervalo=None):
+        super().__init__(storage_cls)
+        self.WRITE_CACHE_SIZE = CACHE_WRITES if escritas is None else escritas
+        self._intervalo = FLUSH_INTERVAL if intervalo is None else intervalo
+        self._lock = threading.RLock()
+        self._flusher = None
+        self._fd_dono = None
+
+    def __call__(self, path, *args, **kwargs):
+        if fcntl is not None:
+            fd = os.open(path + '.cache.lock', os.O_RDWR | os.O_CREAT, 0o644)
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                os.close(fd)
+                raise RuntimeError('%s já está aberto no modo cache por outro processo; '
+                                   'com vários processos use TINYDB_STORAGE=log ou json' % path)
+            self._fd_dono = fd
+        return super().__call__(path, *args, **kwargs)
+
+    def write(self, data):
+        with self._lock:
+            super().write(data)
+            if self._flusher is None and self._intervalo > 0:
+                self._flusher = _Flusher(self.flush, self._intervalo, 'tinydb-cache-flush')
+
+    def flush(self):
+        with self._lock:
+            super().flush()
+
+    def assinatura(self):
+        # escritas de outros processos não são lidas enquanto o cache existir
+        return None
+
+    def close(self):
+        if self._flusher is not None:
+            self._flusher.parar()
+        super().close()
+        if self._fd_dono is not None:
+            os.close(self._fd_dono)
+            self._fd_dono = None
+
+
+class ArmazenamentoLog(Storage):
+    """Snapshot JSON + log de documentos alterados (modo `log`).
+
+    Usado com `TabelaLog`, que informa quais documentos cada operação alterou;
+    escritas que passam pelo `write()` genérico do TinyDB (ex.: `drop_table`)
+    regravam o snapshot inteiro. Com uma `trava` (ver `tiny_trava.py`), o flush
+    periódico e a compactação rodam dentro da escrita exclusiva do banco.
+    """
+
+    trava = None
+
+    def __init__(self, path, intervalo=None, compactar_apos=None, fsync=FSYNC):
+        self._path = path
+        self._path_log = path + '.log'
+        self._intervalo = FLUSH_INTERVAL if intervalo is None else intervalo
+        self._compactar_apos = COMPACT_AFTER if compactar_apos is None else compactar_apos
+        self._fsync = fsync
+        self._lock = threading.RLock()
+        self._buffer = []
+        self._linhas_log = 0
+        self._offset = 0
+        self._assinatura_log = None
+        self.versao_externa = 0
+        self.carga = 0
+        self._observadas = {}
+        self._dados = {}
+        self._carregar(recuperar=True)
+        self._flusher = _Flusher(self._periodico, self._intervalo, 'tinydb-log-flush') if self._intervalo > 0 else None
+
+    # leitura / recuperação
+
+    def _carregar(self, recuperar=False):
+        dados = JSONAtomico(self._path).read() or {}
+        self._dados = dados
+        self._offset = 0
+        self._linhas_log = 0
+        # relido inteiro: quem observa uma tabela relê tudo (ver `alteracoes`)
+        self.carga += 1
+        for doc_ids in self._observadas.values():
+            doc_ids.clear()
+        self._reaplicar_log(recuperar)
+
+    def _reaplicar_log(self, recuperar=False):
+        try:
+            f = open(self._path_log, 'rb')
+        except FileNotFoundError:
+            self._assinatura_log = None
+            return
+        with f:
+            f.seek(self._offset)
+            bruto = f.read()
+        fim = bruto.rfind(b'\n') + 1
+        for linha in bruto[:fim].splitlines():
+            try:
+                tabela, doc_id, doc = json.loads(linha)
+            except ValueError:
+                continue
+            self._aplicar(tabela, doc_id, doc)
+            self._linhas_log += 1
+        if recuperar and fim < len(bruto):
+            # última linha incompleta de uma queda durante a escrita: descarta
+            # (fora da abertura, pode ser outro processo escrevendo; fica para a próxima leitura)
+            with open(self._path_log, 'r+b') as f:
+                f.truncate(self._offset + fim)
+        self._offset += fim
+        self._assinatura_log = self._stat_log()
+
+    def _aplicar(self, tabela, doc_id, doc):
+        observados = self._observadas.get(tabela)
+        if observados is not None:
+            if doc_id is None:
+                self.carga += 1
+            else:
+                observados.add(int(doc_id))
+        if doc_id is None:
+            self._dados[tabela] = {}
+        elif doc is None:
+            self._dados.get(tabela, {}).pop(str(doc_id), None)
+        else:
+            self._dados.setdefault(tabela, {})[str(doc_id)] = doc
+
+    def _stat_log(self):
+        try:
+            st = os.stat(self._path_log)
+        except OSError:
+            return None
+        return (st.st_ino, st.st_size)
+
+    def _verificar_externo(self):
+        """Reaplica escritas que outro processo acrescentou ao log."""
+        if self._stat_log() == self._assinatura_log:
+            return
+        with self._lock:
+            self._flush()
+            self._atualizar_externo()
+
+    def _atualizar_externo(self):
+        atual = self._stat_log()
+        if atual == self._assinatura_log:
+            return
+        if atual is None or self._assinatura_log is None or atual[0] != self._assinatura_log[0] or atual[1] < self._offset:
+            # o outro processo compactou: recarrega snapshot + log
+            self._carregar()
+        else:
+            self._reaplicar_log()
+        self.versao_externa += 1
+
+    def assinatura(self):
+        self._verificar_externo()
+        return self.versao_externa
+
+    def alteracoes(self, tabela):
+        """(carga, doc_ids de `tabela` lidos do log desde a chamada anterior).
+
+        A primeira chamada passa a observar a tabela. Se `carga` mudou, o arquivo
+        foi relido inteiro (ex.: compactado por outro processo) e os doc_ids não
+        bastam: quem observa relê a tabela.
+        """
+        self._verificar_externo()
+        with self._lock:
+            doc_ids = self._observadas.get(tabela, set())
+            self._observadas[tabela] = set()
+            return self.carga, doc_ids
+
+    def read(self):
+        self._verificar_externo()
+        return self._dados
+
+    def tabela(self, nome):
+        self._verificar_externo()
+        return self._dados.setdefault(nome, {})
+
+    # escrita
+
+    def registrar(self, tabela, doc_ids, limpa=False):
+        """Enfileira no log o estado atual de `doc_ids` (ou a remoção) em `tabela`."""
+        docs = self._dados.get(tabela, {})
+        linhas = []
+        if limpa:
+            linhas.append(json.dumps([tabela, None, None]))
+        for doc_id in doc_ids:
+            linhas.append(json.dumps([tabela, int(doc_id), docs.get(str(doc_id))]))
+        with self._lock:
+            self._buffer.extend(linhas)
+            if self._flusher is None:
+                self._flush()
+                self._compactar_se_preciso()
+
+    def write(self, data):
+        with self._lock:
+            self._dados = data
+            self._buffer = []
+            self._compactar()
+
+    def _exclusivo(self):
+        return self.trava.escrita() if self.trava is not None else nullcontext()
+
+    def _flush(self):
+        if not self._buffer:
+            return
+        dados = ('\n'.join(self._buffer) + '\n').encode('utf-8')
+        # um único write com O_APPEND: linhas de outro processo não se intercalam
+        fd = os.open(self._path_log, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        try:
+            alheio = os.fstat(fd).st_size != self._offset
+            os.write(fd, dados)
+            if self._fsync:
+                os.fsync(fd)
+            fim = os.lseek(fd, 0, os.SEEK_CUR)
+            inode = os.fstat(fd).st_ino
+        finally:
+            os.close(fd)
+        self._linhas_log += len(self._buffer)
+        self._buffer = []
+        if alheio:
+            # havia linhas de outro processo ainda não lidas antes das nossas:
+            # a próxima leitura reaplica o log a partir do offset atual
+            self._assinatura_log = (inode, -1)
+        else:
+            self._offset = fim
+            self._assinatura_log = self._stat_log()
+
+    def _compactar(self):
+        # o snapshot precisa incluir o que outros processos já gravaram no log
+        self._atualizar_externo()
+        gravar_atomico(self._path, json.dumps(self._dados), self._fsync)
+        # se cair aqui, reaplicar o log inteiro sobre o novo snapshot chega ao mesmo estado;
+        # o log vazio é um arquivo novo para outros processos perceberem a compactação
+        gravar_atomico(self._path_log, '', self._fsync)
+        self._offset = 0
+        self._linhas_log = 0
+        self._assinatura_log = self._stat_log()
+
+    def _compactar_se_preciso(self):
+        if self._linhas_log >= max(self._compactar_apos, 1):
+            self._compactar()
+
+    def _periodico(self):
+        if not self._buffer and self._linhas_log < max(self._compactar_apos, 1):
+            return
+        with self._exclusivo(), self._lock:
+            self._flush()
+            self._compactar_se_preciso()
+
+    def flush(self):
+        with self._exclusivo(), self._lock:
+            self._flush()
+
+    def compactar(self):
+        with self._exclusivo(), self._lock:
+            self._flush()
+            self._compactar()
+
+    def close(self):
+        if self._flusher is not None:
+            self._flusher.parar()
+            self._flusher = None
+        with self._exclusivo(), self._lock:
+            self._flush()
+            if self._linhas_log:
+                self._compactar()
+
+
+class _VisaoTabela(MutableMapping):
+    """Tabela com ids inteiros sobre o dict do armazenamento, anotando o que mudou."""
+
+    def __init__(self, bruta):
+        self._bruta = bruta
+        self.alteradas = set()
+        self.limpa = False
+
+    def __getitem__(self, doc_id):
+        doc = self._bruta[str(doc_id)]
+        # updates alteram o documento retornado aqui
+        self.alteradas.add(doc_id)
+        return doc
+
+    def __setitem__(self, doc_id, doc):
+        self._bruta[str(doc_id)] = doc
+        self.alteradas.add(doc_id)
+
+    def __delitem__(self, doc_id):
+        del self._bruta[str(doc_id)]
+        self.alteradas.add(doc_id)
+
+    def __contains__(self, doc_id):
+        return str(doc_id) in self._bruta
+
+    def __iter__(self):
+        return (int(doc_id) for doc_id in list(self._bruta))
+
+    def __len__(self):
+        return len(self._bruta)
+
+    def clear(self):
+        self._bruta.clear()
+        self.alteradas.clear()
+        self.limpa = True
+
+
+class TabelaLog(Table):
+    """Tabela que altera só os documentos afetados, sem reconstruir a tabela inteira."""
+
+    def _update_table(self, updater):
+        storage = self._storage
+        if not isinstance(storage, ArmazenamentoLog):
+            return super()._update_table(updater)
+        visao = _VisaoTabela(storage.tabela(self.name))
+        try:
+            updater(visao)
+        finally:
+            storage.registrar(self.name, visao.alteradas, visao.limpa)
+            self.clear_cache()
+
+
+class TinyDBLog(TinyDB):
+    table_class = TabelaLog
+    default_storage_class = ArmazenamentoLog
+
+
+def abrir_tinydb(path, modo=None):
+    """Abre o banco no modo de persistência configurado (`json`, `cache` ou `log`)."""
+    modo = (modo or TINYDB_STORAGE).lower()
+    if modo == 'log':
+        return TinyDBLog(path)
+    if modo == 'cache':
+        return TinyDB(path, storage=CacheComIntervalo(JSONAtomico))
+    if modo != 'json':
+        raise ValueError('TINYDB_STORAGE inválido: %s' % modo)
+    return TinyDB(path)
@@ -1,25 +1,82 @@
-from tinydb import TinyDB, Query
-from datetime import datetime
+from tinydb import Query
+from datetime import datetime, timezone
+from collections import deque
+from contextlib import nullcontext
+import functools
+import gzip
+import heapq
+import json
 import os
+import re
 import threading
+import time
+import uuid
+
+from mensagens import corpo_reprocessado
+from tiny_armazenamento import TinyDBLog, abrir_tinydb
+from tiny_trava import TravaBanco
 
 _db = None
+_db_path = None
+_fila = None
+_fila_db = None
+_fila_trava = None
+_trava = None
 _db_lock = threading.Lock()
 
 def init_tinydb(path=None):
-    global _db
+    global _db, _db_path, _trava
     with _db_lock:
         if _db is None:
-            path = path or os.getenv('TINYDB_PATH', 'tinydb.json')
-            _db = TinyDB(path)
+            _db_path = path or os.getenv('TINYDB_PATH', 'tinydb.json')
+            _trava = TravaBanco(_db_path, ao_mudar=_descartar_proximos_ids)
+            _db = abrir_tinydb(_db_path)
+            if hasattr(_db.storage, 'trava'):
+                _db.storage.trava = _trava
     return _db
 
+def obter_trava():
+    """Trava de leitura/escrita do banco aberto por `init_tinydb` (ver tiny_trava.py)."""
+    init_tinydb()
+    return _trava
+
+def _descartar_proximos_ids(db=None):
+    # outro processo escreveu no banco: o próximo doc_id que cada tabela
+    # guarda em memória pode já ter sido usado
+    db = db or _db
+    if db is not None:
+        for tabela in db._tables.values():
+            tabela._next_id = None
+
+def fechar_tinydb():
+    """Fecha o banco (e o da fila) e descarta o estado em memória (usado em testes)."""
+    global _db, _db_path, _fila, _fila_db, _fila_trava, _trava
+    with _db_lock:
+        if _fila_db is not None and _fila_db is not _db:
+            _fila_db.close()
+            _fila_trava.fechar()
+        if _db is not None:
+            _db.close()
+        if _trava is not None:
+            _trava.fechar()
+        _db = None
+        _db_path = None
+        _fila = None
+        _fila_db = None
+        _fila_trava = None
+        _trava = None
+
 # Drivers
 def criar_entregador_td(name, phone, password_hash):
     db = init_tinydb()
     drivers = db.table('drivers')
+    Driver = Query()
     doc = {'name': name, 'phone': phone, 'password_hash': password_hash, 'created_at': datetime.utcnow().isoformat()}
-    doc_id = drivers.insert(doc)
+    # verificação e inserção na mesma escrita: nomes únicos também entre processos
+    with _trava.escrita():
+        if drivers.contains(Driver.name == name):
+            return None
+        doc_id = drivers.insert(doc)
     doc['id'] = doc_id
     return doc
 
@@ -27,90 +84,671 @@ def obter_entregador_por_nome_td(name):
     db = init_tinydb()
     drivers = db.table('drivers')
     Driver = Query()
-    res = drivers.get(Driver.name == name)
+    with _trava.leitura():
+        res = drivers.get(Driver.name == name)
     if not res:
         return None
     res['id'] = res.doc_id
     return res
 
+def atualizar_hash_entregador_td(driver_id, password_hash):
+    db = init_tinydb()
+    drivers = db.table('drivers')
+    with _trava.escrita():
+        drivers.update({'password_hash': password_hash}, doc_ids=[int(driver_id)])
+    return True
+
 def listar_entregadores_td():
     db = init_tinydb()
     drivers = db.table('drivers')
     res = []
+    with _trava.leitura():
+        todos = drivers.all()
     # retornar em ordem decrescente de criação
-    for item in drivers.all()[::-1]:
+    for item in todos[::-1]:
         item['id'] = item.doc_id
         res.append(item)
     return res
 
+def listar_entregadores_resumo_td():
+    db = init_tinydb()
+    drivers = db.table('drivers')
+    res = []
+    with _trava.leitura():
+        todos = drivers.all()
+    for item in todos[::-1]:
+        res.append({'id': item.doc_id, 'name': item.get('name')})
+    return res
+
 # Deliveries
 def criar_entrega_td(restaurant, pickup_address, customer_address, status='enfileirado'):
     db = init_tinydb()
     deliveries = db.table('deliveries')
     doc = {'restaurante': restaurant, 'endereco_retirada': pickup_address, 'endereco_cliente': customer_address, 'status': status, 'id_entregador': None, 'created_at': datetime.utcnow().isoformat()}
-    doc_id = deliveries.insert(doc)
+    with _trava.escrita():
+        doc_id = deliveries.insert(doc)
     doc['id'] = doc_id
     return doc
 
-def listar_entregas_td():
+def criar_entregas_td(itens, status='enfileirado'):
+    """Insere várias entregas com uma única escrita. `itens`: [(restaurante, retirada, cliente)]."""
     db = init_tinydb()
     deliveries = db.table('deliveries')
-    res = []
-    for item in deliveries.all()[::-1]:
+    agora = datetime.utcnow().isoformat()
+    docs = [{'restaurante': r, 'endereco_retirada': p, 'endereco_cliente': c, 'status': status, 'id_entregador': None, 'created_at': agora} for r, p, c in itens]
+    if not docs:
+        return []
+    with _trava.escrita():
+        doc_ids = deliveries.insert_multiple(docs)
+    for doc_id, doc in zip(doc_ids, docs):
+        doc['id'] = doc_id
+    return docs
+
+def listar_entregas_td(limit=None, after_id=None, status=None, id_entregador=None):
+    db = init_tinydb()
+    deliveries = db.table('deliveries')
+    # uma passada em ordem crescente de doc_id, parando em after_id; com limit
+    # só os `limit` maiores ids ficam em memória
+    res = deque(maxlen=int(limit)) if limit is not None else []
+    with _trava.leitura():
+        for item in deliveries:
+            if after_id is not None and item.doc_id >= int(after_id):
+                break
+            if status and item.get('status') != status:
+                continue
+            if id_entregador is not None and (item.get('id_entregador') or item.get('assigned_driver_id')) != int(id_entregador):
+                continue
+            res.append(item)
+    out = []
+    for item in reversed(res):
         item['id'] = item.doc_id
-        res.append(item)
-    return res
+        out.append(item)
+    return out
 
 def obter_entrega_td(delivery_id):
     db = init_tinydb()
     deliveries = db.table('deliveries')
-    res = deliveries.get(doc_id=int(delivery_id))
+    with _trava.leitura():
+        res = deliveries.get(doc_id=int(delivery_id))
     if not res:
-        return None
+        return obter_entrega_arquivada_td(delivery_id)
     res['id'] = res.doc_id
     return res
 
-def atribuir_entrega_td(delivery_id, driver_id, status='atribuido'):
+class EntregaJaAtribuida(Exception):
+    """A entrega não estava mais no status esperado (outro consumidor a atribuiu)."""
+
+
+def obter_entregas_td(delivery_ids):
+    """Várias entregas com uma única leitura da tabela. Retorna {id: entrega}."""
     db = init_tinydb()
     deliveries = db.table('deliveries')
-    deliveries.update({'assigned_driver_id': int(driver_id), 'status': status}, doc_ids=[int(delivery_id)])
-    return obter_entrega_td(delivery_id)
+    procurados = {int(d) for d in delivery_ids}
+    res = {}
+    with _trava.leitura():
+        for item in deliveries:
+            if item.doc_id in procurados:
+                item['id'] = item.doc_id
+                res[item.doc_id] = item
+    return res
+
+def atribuir_entrega_td(delivery_id, driver_id, status='atribuido', status_esperado='enfileirado'):
+    db = init_tinydb()
+    deliveries = db.table('deliveries')
+    # compare-and-set: leitura e update na mesma escrita (exclusiva também entre processos)
+    with _trava.escrita():
+        res = deliveries.get(doc_id=int(delivery_id))
+        if not res:
+            return None
+        if res.get('status') != status_esperado:
+            raise EntregaJaAtribuida(delivery_id)
+        mudancas = {'id_entregador': int(driver_id), 'status': status, 'atualizado_em': datetime.utcnow().isoformat()}
+        deliveries.update(mudancas, doc_ids=[int(delivery_id)])
+    res.update(mudancas)
+    res['id'] = res.doc_id
+    return res
 
 def atualizar_status_entrega_td(delivery_id, status):
     db = init_tinydb()
     deliveries = db.table('deliveries')
-    deliveries.update({'status': status}, doc_ids=[int(delivery_id)])
-    return obter_entrega_td(delivery_id)
+    with _trava.escrita():
+        deliveries.update({'status': status, 'atualizado_em': datetime.utcnow().isoformat()}, doc_ids=[int(delivery_id)])
+        res = deliveries.get(doc_id=int(delivery_id))
+    if not res:
+        return None
+    res['id'] = res.doc_id
+    return res
 
-# Fila usando TinyDB (FIFO simples)
-def enviar_mensagem_td(delivery_id):
+def listar_entregas_ativas_td(status_ativos):
     db = init_tinydb()
-    queue = db.table('queue')
-    doc = {'id_entrega': int(delivery_id), 'created_at': datetime.utcnow().isoformat()}
-    doc_id = queue.insert(doc)
-    return {'MessageId': doc_id}
+    deliveries = db.table('deliveries')
+    out = []
+    with _trava.leitura():
+        for item in deliveries:
+            driver_id = item.get('id_entregador') or item.get('assigned_driver_id')
+            if driver_id is not None and item.get('status') in status_ativos:
+                out.append((item.doc_id, int(driver_id)))
+    return out
+
+# Arquivamento: lotes de entregas concluídas em `<TINYDB_PATH>.arquivo/`, um
+# JSON Lines gzip por lote com a faixa de ids no nome (entregas-<min>-<max>-<ts>.jsonl.gz)
+_RE_ARQUIVO = re.compile(r'^entregas-(\d+)-(\d+)-\d+\.jsonl\.gz$')
+
+def _dir_arquivo():
+    init_tinydb()
+    return os.getenv('TINYDB_ARCHIVE_DIR') or _db_path + '.arquivo'
 
-def receber_mensagem_td():
+def arquivar_entregas_td(antes_de, limite=500, status='entregue'):
+    """Move até `limite` entregas em `status` sem mudança desde `antes_de` (datetime UTC) para um arquivo gzip.
+
+    A entrega de maior id nunca é arquivada: o TinyDB reusaria o id na próxima inserção.
+    """
     db = init_tinydb()
-    queue = db.table('queue')
-    all_msgs = queue.all()
-    if not all_msgs:
-        return None
-    # FIFO: take the first inserted
-    first = all_msgs[0]
-    msg_id = first.doc_id
-    delivery_id = first.get('id_entrega')
-    # NOTA: não deletar imediatamente — retornar ReceiptHandle para permitir ack/delete explícito
-    delivery = obter_entrega_td(delivery_id)
-    return {'MessageId': msg_id, 'ReceiptHandle': msg_id, 'entrega': delivery}
+    deliveries = db.table('deliveries')
+    limite_iso = antes_de.isoformat()
+    with _trava.escrita():
+        maior = 0
+        docs = []
+        for item in deliveries:
+            maior = max(maior, item.doc_id)
+            if len(docs) < int(limite) and item.get('status') == status and (item.get('atualizado_em') or item.get('created_at') or '') < limite_iso:
+                docs.append(item)
+        docs = [d for d in docs if d.doc_id != maior]
+        if not docs:
+            return 0
+        agora = datetime.utcnow()
+        pasta = _dir_arquivo()
+        os.makedirs(pasta, exist_ok=True)
+        nome = 'entregas-%d-%d-%d.jsonl.gz' % (docs[0].doc_id, docs[-1].doc_id, int(agora.timestamp() * 1000))
+        tmp = os.path.join(pasta, nome + '.tmp')
+        with gzip.open(tmp, 'wt', encoding='utf-8') as f:
+            for d in docs:
+                f.write(json.dumps(dict(d, id=d.doc_id, arquivada_em=agora.isoformat())) + '\n')
+        # o arquivo completo existe antes de remover da tabela: uma queda no meio só duplica
+        os.replace(tmp, os.path.join(pasta, nome))
+        deliveries.remove(doc_ids=[d.doc_id for d in docs])
+    return len(docs)
 
+@functools.lru_cache(maxsize=8)
+def _ler_arquivo(caminho):
+    # arquivos de lote são imutáveis depois do os.replace
+    with gzip.open(caminho, 'rt', encoding='utf-8') as f:
+        return {d['id']: d for d in map(json.loads, f)}
 
-def deletar_mensagem_td(receipt_handle):
+def obter_entrega_arquivada_td(delivery_id):
+    pasta = _dir_arquivo()
+    try:
+        nomes = os.listdir(pasta)
+    except FileNotFoundError:
+        return None
+    delivery_id = int(delivery_id)
+    for nome in sorted(nomes):
+        m = _RE_ARQUIVO.match(nome)
+        if m and int(m.group(1)) <= delivery_id <= int(m.group(2)):
+            doc = _ler_arquivo(os.path.join(pasta, nome)).get(delivery_id)
+            if doc:
+                return dict(doc)
+    return None
+
+def avancar_cursor_td(nome):
     db = init_tinydb()
-    queue = db.table('queue')
+    estado = db.table('estado')
+    Cursor = Query()
+    with _trava.escrita():
+        doc = estado.get(Cursor.nome == nome)
+        if not doc:
+            estado.insert({'nome': nome, 'valor': 1})
+            return 0
+        estado.update({'valor': doc['valor'] + 1}, doc_ids=[doc.doc_id])
+        return doc['valor']
+
+# Fila usando TinyDB (FIFO com visibility timeout, no estilo SQS)
+VISIBILITY_TIMEOUT = float(os.getenv('TINYDB_VISIBILITY_TIMEOUT', '30'))
+# campos de controle do documento que não fazem parte do corpo entregue ao consumidor
+CAMPOS_LEASE = ('lease', 'visivel_em')
+
+
+class FilaLocal:
+    """Motor de fila local sobre a tabela `queue` do TinyDB.
+
+    A tabela é a fonte de verdade (mensagens sobrevivem a reinícios) e também
+    guarda os leases: receber grava no documento o token do ReceiptHandle
+    (`lease`), o instante em que ele expira (`visivel_em`) e a contagem de
+    recebimentos (`tentativas`, como o ApproximateReceiveCount do SQS), numa
+    única escrita exclusiva para o lote. Com uma `trava` (`TravaBanco`) a
+    escrita é exclusiva também entre processos, então a API e os workers não
+    recebem a mesma mensagem enquanto o lease vale. Delete, `adiar_lote` e
+    `mover_para_dlq` conferem o token gravado: o receipt de um lease expirado
+    (talvez já recebido por outro processo) falha.
+
+    Em memória fica só o índice: a fila FIFO de doc_ids visíveis e um heap dos
+    invisíveis por `visivel_em`, de modo que receber não percorre a tabela.
+    Quando outro processo alterou a fila (contador de versão da trava; sem
+    trava, assinatura do arquivo), o índice é atualizado só com os documentos
+    que ele gravou no log (`ArmazenamentoLog.alteracoes`), então o custo não
+    cresce com o backlog. Em outros modos, ou depois de uma compactação, o
+    índice é reconstruído da tabela. Por isso a fila fica num arquivo próprio,
+    sempre no modo `log` (ver `obter_fila_td`).
+    """
+
+    def __init__(self, db, path, visibility_timeout=None, trava=None):
+        self._table = db.table('queue')
+        self._dlq = db.table('queue_dlq')
+        self._trava = trava
+        self._path = path
+        self._assinatura_storage = getattr(db.storage, 'assinatura', None)
+        self._flush_storage = getattr(db.storage, 'flush', None)
+        self._alteracoes_storage = getattr(db.storage, 'alteracoes', None)
+        self.visibility_timeout = VISIBILITY_TIMEOUT if visibility_timeout is None else float(visibility_timeout)
+        self._lock = threading.Lock()
+        self._pendentes = deque()
+        self._corpos = {}
+        self._invisiveis = []
+        self._assinatura = None
+        self._carga = None
+        self._proximo_id = 1
+        with self._leitura(), self._lock:
+            self._sincronizar()
+
+    def _leitura(self):
+        return self._trava.leitura() if self._trava is not None else nullcontext()
+
+    def _escrita(self):
+        return self._trava.escrita() if self._trava is not None else nullcontext()
+
+    def _assinatura_arquivo(self):
+        versao = self._trava.versao() if self._trava is not None else None
+        if versao is not None:
+            return versao
+        if self._assinatura_storage is not None:
+            return self._assinatura_storage()
+        try:
+            st = os.stat(self._path)
+        except OSError:
+            return None
+        return (st.st_mtime_ns, st.st_size)
+
+    def _sincronizar(self):
+        if self._alteracoes_storage is not None:
+            self._carga, _ = self._alteracoes_storage(self._table.name)
+        corpos = {doc.doc_id: dict(doc) for doc in self._table.all()}
+        agora = time.time()
+        self._corpos = corpos
+        self._pendentes = deque(sorted(d for d, c in corpos.items() if (c.get('visivel_em') or 0) <= agora))
+        self._invisiveis = [(c['visivel_em'], d) for d, c in corpos.items() if (c.get('visivel_em') or 0) > agora]
+        heapq.heapify(self._invisiveis)
+        self._proximo_id = max(corpos, default=0) + 1
+        self._dlq._next_id = None
+        self._assinatura = self._assinatura_arquivo()
+
+    def _sincronizar_se_mudou(self):
+        if self._assinatura_arquivo() == self._assinatura:
+            return
+        if self._alteracoes_storage is None:
+            self._sincronizar()
+            return
+        carga, doc_ids = self._alteracoes_storage(self._table.name)
+        if carga != self._carga:
+            self._sincronizar()
+            return
+        self._aplicar_alteracoes(doc_ids)
+        self._dlq._next_id = None
+        self._assinatura = self._assinatura_arquivo()
+
+    def _aplicar_alteracoes(self, doc_ids):
+        """Atualiza o índice com os documentos que outro processo gravou."""
+        tabela = self._table._read_table()
+        agora = time.time()
+        # inserções de outro processo têm doc_ids maiores que os já vistos: vão para o fim
+        for doc_id in sorted(doc_ids):
+            doc = tabela.get(str(doc_id))
+            if doc is None:
+                self._corpos.pop(doc_id, None)
+                continue
+            antigo = self._corpos.get(doc_id)
+            corpo = self._corpos[doc_id] = dict(doc)
+            self._proximo_id = max(self._proximo_id, doc_id + 1)
+            if antigo is None and (corpo.get('visivel_em') or 0) <= agora:
+                self._pendentes.append(doc_id)
+            elif corpo.get('visivel_em'):
+                # lease ou adiamento de outro processo; se já venceu, `_liberar_invisiveis` devolve à fila
+                heapq.heappush(self._invisiveis, (corpo['visivel_em'], doc_id))
+
+    def _registrar_escrita(self):
+        # dentro da escrita exclusiva, depois de alterar o arquivo: nos modos de
+        # escrita adiada o lease tem que chegar ao disco antes de soltar a trava
+        if self._flush_storage is not None:
+            self._flush_storage()
+        versao = self._trava.incrementar_versao() if self._trava is not None else None
+        self._assinatura = versao if versao is not None else self._assinatura_arquivo()
+
+    def _liberar_invisiveis(self, agora):
+        prontas = []
+        while self._invisiveis and self._invisiveis[0][0] <= agora:
+            visivel_em, doc_id = heapq.heappop(self._invisiveis)
+            corpo = self._corpos.get(doc_id)
+            # entrada antiga (mensagem apagada, com lease novo ou adiada de novo)
+            if corpo is not None and corpo.get('visivel_em') == visivel_em:
+                prontas.append(doc_id)
+        # lease expirado volta ao início da fila, preservando a ordem FIFO original
+        for doc_id in sorted(prontas, reverse=True):
+            self._pendentes.appendleft(doc_id)
+
+    def _gravar(self, alteracoes):
+        """Aplica `{doc_id: campos}` na tabela (uma escrita) e no índice."""
+        def atualizar(tabela):
+            for doc_id, campos in alteracoes.items():
+                tabela[doc_id].update(campos)
+        self._table._update_table(atualizar)
+        for doc_id, campos in alteracoes.items():
+            corpo = self._corpos[doc_id]
+            corpo.update(campos)
+            if corpo.get('visivel_em'):
+                heapq.heappush(self._invisiveis, (corpo['visivel_em'], doc_id))
+        self._registrar_escrita()
+
+    def enviar(self, corpo):
+        return self.enviar_lote([corpo])[0]
+
+    def enviar_lote(self, corpos):
+        """Insere várias mensagens com uma única escrita no arquivo.
+
+        Cada corpo é um id de entrega ou um dict com `id_entrega` (e campos extras
+        que são devolvidos como estão no receive).
+        """
+        agora = datetime.utcnow().isoformat()
+        docs = []
+        for corpo in corpos:
+            doc = dict(corpo) if isinstance(corpo, dict) else {'id_entrega': corpo}
+            doc['id_entrega'] = int(doc['id_entrega'])
+            doc['created_at'] = agora
+            docs.append(doc)
+        if not docs:
+            return []
+        with self._escrita(), self._lock:
+            self._sincronizar_se_mudou()
+            # o TinyDB recalcularia o próximo doc_id percorrendo a tabela
+            self._table._next_id = self._proximo_id
+            doc_ids = self._table.insert_multiple(docs)
+            self._proximo_id = self._table._next_id
+            for doc_id, doc in zip(doc_ids, docs):
+                self._corpos[doc_id] = doc
+                self._pendentes.append(doc_id)
+            self._registrar_escrita()
+        return doc_ids
+
+    def receber(self, visibility_timeout=None):
+        """Retorna (doc_id, id_entrega, receipt_handle, corpo) da cabeça da fila ou None."""
+        res = self.receber_lote(1, visibility_timeout)
+        return res[0] if res else None
+
+    def receber_lote(self, max_n, visibility_timeout=None):
+        """Faz lease de até `max_n` mensagens da cabeça da fila."""
+        timeout = self.visibility_timeout if visibility_timeout is None else float(visibility_timeout)
+        with self._lock:
+            # nada visível e ninguém mexeu na fila: sem escrita exclusiva
+            vencida = self._invisiveis and self._invisiveis[0][0] <= time.time()
+            if not self._pendentes and not vencida and self._assinatura_arquivo() == self._assinatura:
+                return []
+        with self._escrita(), self._lock:
+            self._sincronizar_se_mudou()
+            agora = time.time()
+            self._liberar_invisiveis(agora)
+            doc_ids = []
+            while self._pendentes and len(doc_ids) < max_n:
+                doc_id = self._pendentes.popleft()
+                corpo = self._corpos.get(doc_id)
+                if corpo is not None and (corpo.get('visivel_em') or 0) <= agora and doc_id not in doc_ids:
+                    doc_ids.append(doc_id)
+            if not doc_ids:
+                return []
+            token = uuid.uuid4().hex
+            self._gravar({
+                doc_id: {'lease': token, 'visivel_em': agora + timeout, 'tentativas': (self._corpos[doc_id].get('tentativas') or 0) + 1}
+                for doc_id in doc_ids
+            })
+            out = []
+            for doc_id in doc_ids:
+                corpo = {k: v for k, v in self._corpos[doc_id].items() if k not in CAMPOS_LEASE}
+                out.append((doc_id, corpo['id_entrega'], '%d-%s' % (doc_id, token), corpo))
+        return out
+
+    def _doc_do_lease(self, receipt, agora):
+        try:
+            doc_id, token = str(receipt).split('-', 1)
+            doc_id = int(doc_id)
+        except (TypeError, ValueError):
+            return None, 'receipt inválido'
+        corpo = self._corpos.get(doc_id)
+        if not corpo or corpo.get('lease') != token or (corpo.get('visivel_em') or 0) <= agora:
+            return None, 'lease expirado ou inexistente'
+        return doc_id, None
+
+    def _validar_leases(self, receipts):
+        """([(receipt, doc_id)] dos leases válidos, falhas); chamado dentro da escrita, já sincronizado."""
+        agora = time.time()
+        validos, falhas, vistos = [], [], set()
+        for receipt in receipts:
+            doc_id, erro = self._doc_do_lease(receipt, agora)
+            if not erro and doc_id in vistos:
+                erro = 'receipt repetido'
+            if erro:
+                falhas.append({'ReceiptHandle': receipt, 'erro': erro})
+                continue
+            vistos.add(doc_id)
+            validos.append((receipt, doc_id))
+        return validos, falhas
+
+    def adiar_lote(self, itens):
+        """Encerra os leases e deixa cada mensagem invisível por mais `segundos`.
+
+        `itens`: [(receipt_handle, segundos)]. Retorna `{'Successful', 'Failed'}` por ReceiptHandle.
+        """
+        itens = list(itens)
+        segundos = dict(itens)
+        with self._escrita(), self._lock:
+            self._sincronizar_se_mudou()
+            validos, falhas = self._validar_leases([r for r, _ in itens])
+            agora = time.time()
+            if validos:
+                self._gravar({
+                    doc_id: {'lease': None, 'visivel_em': agora + max(0.0, float(segundos[receipt]))}
+                    for receipt, doc_id in validos
+                })
+        return {'Successful': [r for r, _ in validos], 'Failed': falhas}
+
+    def mover_para_dlq(self, itens):
+        """Move as mensagens dos leases para a tabela `queue_dlq`.
+
+        `itens`: [(receipt_handle, info)]; `info` (ex.: motivo) fica em `corpo['dlq']`.
+        """
+        itens = list(itens)
+        infos = dict(itens)
+        with self._escrita(), self._lock:
+            self._sincronizar_se_mudou()
+            validos, falhas = self._validar_leases([r for r, _ in itens])
+            if validos:
+                docs = []
+                for receipt, doc_id in validos:
+                    corpo = {k: v for k, v in self._corpos[doc_id].items() if k not in CAMPOS_LEASE}
+                    corpo['dlq'] = dict(infos[receipt] or {}, movida_em=time.time())
+                    docs.append(corpo)
+                self._dlq.insert_multiple(docs)
+                self._remover([doc_id for _, doc_id in validos])
+        return {'Successful': [r for r, _ in validos], 'Failed': falhas}
+
+    def _remover(self, doc_ids):
+        self._table.remove(doc_ids=doc_ids)
+        for doc_id in doc_ids:
+            self._corpos.pop(doc_id, None)
+        self._registrar_escrita()
+
+    def listar_dlq(self, limite=100):
+        """Até `limite` mensagens da DLQ, das mais antigas para as mais novas, com `id`."""
+        out = []
+        with self._leitura():
+            for doc in self._dlq:
+                if len(out) >= limite:
+                    break
+                out.append(dict(doc, id=doc.doc_id))
+        return out
+
+    def reprocessar_dlq(self, ids=None, limite=100):
+        """Devolve mensagens da DLQ à fila (as de `ids` ou as `limite` mais antigas), com tentativas zeradas."""
+        with self._escrita():
+            if ids is not None:
+                procurados = {int(i) for i in ids}
+                docs = [d for d in self._dlq if d.doc_id in procurados]
+            else:
+                docs = self._dlq.all()[:limite]
+            if not docs:
+                return []
+            self._dlq.remove(doc_ids=[d.doc_id for d in docs])
+            self.enviar_lote([corpo_reprocessado(doc) for doc in docs])
+        return [d.doc_id for d in docs]
+
+    def deletar(self, receipt_handle):
+        """Apaga a mensagem do lease. Retorna False se o lease expirou ou não existe."""
+        return not self.deletar_lote([receipt_handle])['Failed']
+
+    def deletar_lote(self, receipt_handles):
+        """Apaga as mensagens dos leases válidos com uma única escrita.
+
+        Retorna `{'Successful': [...], 'Failed': [...]}` por ReceiptHandle.
+        """
+        with self._escrita(), self._lock:
+            self._sincronizar_se_mudou()
+            validos, falhas = self._validar_leases(receipt_handles)
+            if validos:
+                self._remover([doc_id for _, doc_id in validos])
+        return {'Successful': [r for r, _ in validos], 'Failed': falhas}
+
+    def tamanho(self):
+        """Mensagens visíveis (sem lease nem adiamento)."""
+        agora = time.time()
+        with self._lock:
+            return sum(1 for c in self._corpos.values() if (c.get('visivel_em') or 0) <= agora)
+
+    def tamanho_dlq(self):
+        with self._leitura():
+            return len(self._dlq)
+
+    def estatisticas(self):
+        """Mensagens visíveis, em lease/adiadas e idade (s) da mais antiga ainda não apagada."""
+        with self._leitura(), self._lock:
+            self._sincronizar_se_mudou()
+            agora = time.time()
+            self._liberar_invisiveis(agora)
+            invisiveis = {d for _, d in self._invisiveis if (self._corpos.get(d, {}).get('visivel_em') or 0) > agora}
+            candidatas = list(invisiveis)
+            for doc_id in self._pendentes:
+                if doc_id in self._corpos and doc_id not in invisiveis:
+                    candidatas.append(doc_id)
+                    break
+            instantes = [_enfileirado_em(self._corpos[d]) for d in candidatas if d in self._corpos]
+            visiveis = len(self._corpos) - len(invisiveis)
+        instantes = [t for t in instantes if t is not None]
+        idade = max(0.0, time.time() - min(instantes)) if instantes else None
+        return {'visiveis': visiveis, 'em_voo': len(invisiveis), 'idade_mais_antiga': idade, 'dlq': self.tamanho_dlq()}
+
+
+def _enfileirado_em(corpo):
+    if corpo.get('enfileirado_em'):
+        return float(corpo['enfileirado_em'])
     try:
-        queue.remove(doc_ids=[int(receipt_handle)])
-        return True
-    except Exception:
-        return False
- 
\ No newline at end of file
+        return datetime.fromisoformat(corpo['created_at']).replace(tzinfo=timezone.utc).timestamp()
+    except (KeyError, TypeError, ValueError):
+        return None
+
+
+def caminho_fila():
+    """Arquivo da fila local: `TINYDB_QUEUE_PATH` ou o do banco com `.fila` antes da extensão."""
+    if os.getenv('TINYDB_QUEUE_PATH'):
+        return os.getenv('TINYDB_QUEUE_PATH')
+    base, ext = os.path.splitext(_db_path or os.getenv('TINYDB_PATH', 'tinydb.json'))
+    return base + '.fila' + (ext or '.json')
+
+
+def _migrar_fila_do_banco(fila_db, fila_trava):
+    # versões anteriores guardavam a fila nas tabelas `queue`/`queue_dlq` do banco principal
+    with _trava.escrita(), fila_trava.escrita():
+        nomes = [n for n in ('queue', 'queue_dlq') if n in _db.tables()]
+        for nome in nomes:
+            docs = [dict(d) for d in _db.table(nome)]
+            if docs:
+                fila_db.table(nome).insert_multiple(docs)
+            _db.drop_table(nome)
+        if nomes:
+            fila_trava.incrementar_versao()
+
+
+def obter_fila_td():
+    """Fila local do processo, num arquivo TinyDB próprio (ver `caminho_fila`).
+
+    Separada do banco de entregas, escritas em outras tabelas não invalidam o
+    índice da fila nem disputam a mesma trava. O arquivo é sempre aberto no modo
+    `log`, seja qual for `TINYDB_STORAGE` (o snapshot tem o formato normal do
+    TinyDB, então um arquivo gravado no modo `json` abre sem conversão). Com
+    `TINYDB_QUEUE_PATH` igual ao `TINYDB_PATH` a fila volta a ficar no banco
+    principal, no modo dele.
+    """
+    global _fila, _fila_db, _fila_trava
+    with _db_lock:
+        if _fila is None:
+            path = caminho_fila()
+            if _db is not None and os.path.abspath(path) == os.path.abspath(_db_path):
+                _fila_db, _fila_trava = _db, _trava
+            else:
+                # sempre `log` com escrita imediata: o lease grava só os documentos
+                # alterados e está no arquivo antes de soltar a trava
+                _fila_db = TinyDBLog(path, intervalo=0)
+                _fila_trava = TravaBanco(path, ao_mudar=functools.partial(_descartar_proximos_ids, _fila_db))
+                if hasattr(_fila_db.storage, 'trava'):
+                    _fila_db.storage.trava = _fila_trava
+                if _db is not None:
+                    _migrar_fila_do_banco(_fila_db, _fila_trava)
+            _fila = FilaLocal(_fila_db, path, trava=_fila_trava)
+    return _fila
+
+
+def enviar_mensagem_td(corpo):
+    doc_id = obter_fila_td().enviar(corpo)
+    return {'MessageId': doc_id}
+
+def enviar_mensagens_td(corpos):
+    corpos = list(corpos)
+    doc_ids = obter_fila_td().enviar_lote(corpos)
+    return {'Successful': [{'id_entrega': int(c['id_entrega'] if isinstance(c, dict) else c), 'MessageId': m} for c, m in zip(corpos, doc_ids)], 'Failed': []}
+
+def receber_mensagem_td(visibility_timeout=None):
+    res = receber_mensagens_td(1, visibility_timeout)
+    return res[0] if res else None
+
+def receber_mensagens_td(max_n=10, visibility_timeout=None):
+    """Mensagens cruas: `corpo` é o documento enfileirado; a hidratação fica com `fila.py`."""
+    out = []
+    for msg_id, _, receipt, corpo in obter_fila_td().receber_lote(max_n, visibility_timeout):
+        out.append({'MessageId': msg_id, 'ReceiptHandle': receipt, 'corpo': corpo})
+    return out
+
+
+def deletar_mensagem_td(receipt_handle):
+    return obter_fila_td().deletar(receipt_handle)
+
+def deletar_mensagens_td(receipt_handles):
+    return obter_fila_td().deletar_lote(receipt_handles)
+
+def estatisticas_fila_td():
+    return obter_fila_td().estatisticas()
+
+def adiar_mensagens_td(itens):
+    return obter_fila_td().adiar_lote(itens)
+
+def mover_para_dlq_td(itens):
+    return obter_fila_td().mover_para_dlq(itens)
+
+def listar_dlq_td(limite=100):
+    return obter_fila_td().listar_dlq(limite)
+
+def reprocessar_dlq_td(ids=None, limite=100):
+    return obter_fila_td().reprocessar_dlq(ids, limite)
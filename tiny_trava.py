@@ -0,0 +1,141 @@
+"""Trava de leitura/escrita do banco TinyDB, na thread e entre processos.
+
+A API (servidor com threads) e os workers abrem o mesmo `tinydb.json`. Cada
+operação do `tiny_store` roda dentro de `leitura()` ou `escrita()`:
+
+- no processo, uma trava de leitores/escritor com preferência para escritores
+  (várias leituras em paralelo, uma escrita por vez);
+- entre processos, `fcntl.flock` em `<arquivo>.lock`, compartilhado enquanto
+  houver leitores no processo e exclusivo durante uma escrita. Sem `fcntl`
+  (Windows) só a trava do processo é usada.
+
+Ao entrar numa escrita, se os arquivos do banco mudaram desde a última escrita
+deste processo, `ao_mudar()` é chamado (o `tiny_store` descarta os próximos
+doc_ids que o TinyDB guarda em memória).
+
+O `.lock` guarda também um contador de versão (`versao()`), incrementado por
+quem escreve com `incrementar_versao()` dentro da escrita. A fila local usa o
+contador para saber se outro processo alterou a fila sem depender do mtime do
+arquivo (que tem resolução de milissegundos e não distingue escritas de
+tamanho igual).
+"""
+import os
+import struct
+import threading
+from contextlib import contextmanager
+
+try:
+    import fcntl
+    LOCK_SH, LOCK_EX, LOCK_UN = fcntl.LOCK_SH, fcntl.LOCK_EX, fcntl.LOCK_UN
+except ImportError:  # Windows
+    fcntl = None
+    LOCK_SH = LOCK_EX = LOCK_UN = None
+
+
+class TravaBanco:
+
+    def __init__(self, path, ao_mudar=None):
+        self._cond = threading.Condition(threading.Lock())
+        self._leitores = 0
+        self._escritores_esperando = 0
+        self._escritor = None
+        self._local = threading.local()
+        self._arquivos = (path, path + '.log')
+        self._fd = os.open(path + '.lock', os.O_RDWR | os.O_CREAT, 0o644) if fcntl is not None else None
+        self._assinatura = self._assinatura_arquivos()
+        self.ao_mudar = ao_mudar
+
+    def _flock(self, operacao):
+        if self._fd is not None:
+            fcntl.flock(self._fd, operacao)
+
+    def _assinatura_arquivos(self):
+        out = []
+        for path in self._arquivos:
+            try:
+                st = os.stat(path)
+            except OSError:
+                out.append(None)
+                continue
+            out.append((st.st_ino, st.st_mtime_ns, st.st_size))
+        return tuple(out)
+
+    @contextmanager
+    def leitura(self):
+        profundidade = getattr(self._local, 'leituras', 0)
+        if profundidade or self._escritor == threading.get_ident():
+            # já dentro de uma leitura ou escrita desta thread
+            self._local.leituras = profundidade + 1
+            try:
+                yield
+            finally:
+                self._local.leituras = profundidade
+            return
+        with self._cond:
+            while self._escritor is not None or self._escritores_esperando:
+                self._cond.wait()
+            if self._leitores == 0:
+                self._flock(LOCK_SH)
+            self._leitores += 1
+        self._local.leituras = 1
+        try:
+            yield
+        finally:
+            self._local.leituras = 0
+            with self._cond:
+                self._leitores -= 1
+                if self._leitores == 0:
+                    self._flock(LOCK_UN)
+                    self._cond.notify_all()
+
+    @contextmanager
+    def escrita(self):
+        eu = threading.get_ident()
+        if self._escritor == eu:
+            yield
+            return
+        if getattr(self._local, 'leituras', 0):
+            raise RuntimeError('escrita pedida dentro de uma leitura do TinyDB')
+        with self._cond:
+            self._escritores_esperando += 1
+            try:
+                while self._escritor is not None or self._leitores:
+                    self._cond.wait()
+            finally:
+                self._escritores_esperando -= 1
+            self._escritor = eu
+        try:
+            self._flock(LOCK_EX)
+            try:
+                if self._assinatura_arquivos() != self._assinatura and self.ao_mudar:
+                    self.ao_mudar()
+                yield
+            finally:
+                self._assinatura = self._assinatura_arquivos()
+                self._flock(LOCK_UN)
+        finally:
+            with self._cond:
+                self._escritor = None
+                self._cond.notify_all()
+
+    def versao(self):
+        """Contador de versão compartilhado entre processos; None sem `fcntl`."""
+        if self._fd is None:
+            return None
+        dados = os.pread(self._fd, 8, 0)
+        return struct.unpack('<Q', dados)[0] if len(dados) == 8 else 0
+
+    def incrementar_versao(self):
+        """Incrementa o contador (só dentro de `escrita()`) e retorna o novo valor."""
+        if self._escritor != threading.get_ident():
+            raise RuntimeError('incrementar_versao fora de uma escrita do TinyDB')
+        if self._fd is None:
+            return None
+        versao = self.versao() + 1
+        os.pwrite(self._fd, struct.pack('<Q', versao), 0)
+        return versao
+
+    def fechar(self):
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
@@ -1,131 +1,654 @@
 import time
 import os
 import json
+import heapq
+import itertools
 import logging
+import random
+import argparse
+import signal
+import threading
+from contextlib import nullcontext
 
-from queue import get_queue
-from storage import listar_entregadores, atribuir_entrega
+import metricas
+import storage
+from fila import get_queue
+from storage import listar_entregadores_resumo, atribuir_entrega, avancar_cursor, listar_entregas_ativas, EntregaJaAtribuida
 
 POLL_INTERVAL = float(os.getenv('WORKER_POLL_INTERVAL', '2'))
+BATCH_SIZE = int(os.getenv('WORKER_BATCH_SIZE', '10'))
+CONCURRENCY = int(os.getenv('WORKER_CONCURRENCY', '1'))
+REPORT_INTERVAL = float(os.getenv('WORKER_REPORT_INTERVAL', '10'))
+ROSTER_TTL = float(os.getenv('WORKER_ROSTER_TTL', '30'))
 STATE_FILE = os.path.join(os.path.dirname(__file__), 'worker_state.json')
+# 'arquivo' (checkpoint em STATE_FILE) ou 'banco' (cursor compartilhado via storage)
+STATE_BACKEND = os.getenv('WORKER_STATE_BACKEND', 'arquivo')
+CHECKPOINT_EVERY = int(os.getenv('WORKER_CHECKPOINT_EVERY', '100'))
+CHECKPOINT_INTERVAL = float(os.getenv('WORKER_CHECKPOINT_INTERVAL', '5'))
+# 'round_robin', 'menos_carregado' ou 'capacidade'
+DISPATCH_STRATEGY = os.getenv('WORKER_DISPATCH_STRATEGY', 'round_robin')
+# máximo de entregas ativas (atribuido/coletado) por entregador na estratégia 'capacidade'
+DRIVER_CAPACITY = int(os.getenv('WORKER_DRIVER_CAPACITY', '3'))
+# de quanto em quanto tempo o índice de carga é reconciliado com o banco
+LOAD_RESYNC = float(os.getenv('WORKER_LOAD_RESYNC', '30'))
+# recebimentos de uma mensagem com erro antes de ela ir para a dead-letter queue
+MAX_ATTEMPTS = int(os.getenv('WORKER_MAX_ATTEMPTS', '5'))
+# backoff exponencial da reentrega: base * 2^(tentativas-1), com jitter, até o máximo
+RETRY_BASE_SECONDS = float(os.getenv('WORKER_RETRY_BASE_SECONDS', '2'))
+RETRY_MAX_SECONDS = float(os.getenv('WORKER_RETRY_MAX_SECONDS', '300'))
 
 logging.basicConfig(level=logging.INFO, format='[%(asctime)s] %(levelname)s: %(message)s')
 logger = logging.getLogger('delivery-worker')
 
+# protege o cursor do round-robin quando várias threads consomem a fila
+_state_lock = threading.Lock()
 
-def load_state():
-    if not os.path.exists(STATE_FILE):
+
+class CacheEntregadores:
+    """Cache da lista de entregadores usada no dispatch.
+
+    Guarda apenas id e nome. Quando o TTL expira, recarrega a lista inteira:
+    entregadores novos, removidos ou alterados aparecem em até `ttl` segundos.
+    `invalidar()` força a recarga na próxima leitura. Uma lista vazia não é
+    mantida em cache, para que o primeiro entregador cadastrado seja visto no
+    próximo lote.
+    """
+
+    def __init__(self, ttl=ROSTER_TTL, carregar=None):
+        self.ttl = ttl
+        self._carregar = carregar
+        self._lock = threading.Lock()
+        self._entregadores = ()
+        self._expira_em = 0.0
+
+    def _valido(self):
+        return bool(self._entregadores) and time.monotonic() < self._expira_em
+
+    def obter(self):
+        if self._valido():
+            return self._entregadores
+        with self._lock:
+            if self._valido():
+                return self._entregadores
+            carregar = self._carregar or listar_entregadores_resumo
+            try:
+                self._entregadores = tuple(carregar())
+            except Exception as e:
+                if not self._entregadores:
+                    raise
+                logger.warning('falha ao atualizar entregadores, usando lista em cache: %s', e)
+            self._expira_em = time.monotonic() + self.ttl
+            return self._entregadores
+
+    def invalidar(self):
+        with self._lock:
+            self._entregadores = ()
+            self._expira_em = 0.0
+
+
+roster = CacheEntregadores()
+
+
+def load_state(path=STATE_FILE):
+    if not os.path.exists(path):
         return {'last_index': 0}
     try:
-        with open(STATE_FILE, 'r', encoding='utf-8') as f:
+        with open(path, 'r', encoding='utf-8') as f:
             return json.load(f)
     except Exception:
         return {'last_index': 0}
 
 
-def save_state(state):
+def save_state(state, path=STATE_FILE):
+    """Grava o estado de forma atômica: arquivo temporário + os.replace."""
+    tmp = '%s.%d.tmp' % (path, os.getpid())
     try:
-        with open(STATE_FILE, 'w', encoding='utf-8') as f:
+        with open(tmp, 'w', encoding='utf-8') as f:
             json.dump(state, f)
+        os.replace(tmp, path)
     except Exception as e:
         logger.warning('falha ao salvar estado: %s', e)
 
 
+class EstadoArquivo:
+    """Cursor do round-robin em memória com checkpoint em arquivo.
+
+    Grava a cada `a_cada` escolhas ou quando `intervalo` segundos se passaram
+    desde o último checkpoint, e sempre em `fechar()`. Adequado a um único
+    processo de worker; com vários processos use `EstadoBanco`.
+    """
+
+    def __init__(self, path=STATE_FILE, a_cada=CHECKPOINT_EVERY, intervalo=CHECKPOINT_INTERVAL):
+        self.path = path
+        self.a_cada = a_cada
+        self.intervalo = intervalo
+        self.estado = load_state(path)
+        self._lock = threading.Lock()
+        self._pendentes = 0
+        self._ultimo = time.monotonic()
+
+    def avancar(self):
+        with self._lock:
+            idx = self.estado.get('last_index', 0) or 0
+            self.estado['last_index'] = idx + 1
+            self._pendentes += 1
+            if self._pendentes >= self.a_cada or time.monotonic() - self._ultimo >= self.intervalo:
+                self._checkpoint()
+        return idx
+
+    def _checkpoint(self):
+        save_state(dict(self.estado), self.path)
+        self._pendentes = 0
+        self._ultimo = time.monotonic()
+
+    def fechar(self):
+        with self._lock:
+            if self._pendentes:
+                self._checkpoint()
+
+
+class EstadoBanco:
+    """Cursor do round-robin no banco, compartilhado por todos os processos do worker."""
+
+    def __init__(self, nome='round_robin'):
+        self.nome = nome
+
+    def avancar(self):
+        return avancar_cursor(self.nome)
+
+    def fechar(self):
+        pass
+
+
+def carregar_estado(backend=None):
+    if (backend or STATE_BACKEND) == 'banco':
+        return EstadoBanco()
+    return EstadoArquivo()
+
+
 def selecionar_entregador_round_robin(drivers, state):
+    """Escolhe o próximo entregador.
+
+    `state` pode ser um store (`EstadoArquivo`/`EstadoBanco`) ou um dict simples
+    com `last_index`, que é apenas atualizado em memória.
+    """
     if not drivers:
         return None
-    idx = state.get('last_index', 0) or 0
-    pick = drivers[idx % len(drivers)]
-    state['last_index'] = (idx + 1) % max(1, len(drivers))
-    save_state(state)
-    return pick
+    if isinstance(state, dict):
+        with _state_lock:
+            idx = state.get('last_index', 0) or 0
+            state['last_index'] = (idx + 1) % max(1, len(drivers))
+    else:
+        idx = state.avancar()
+    return drivers[idx % len(drivers)]
 
 
-def executar():
-    logger.info('Worker iniciado. Poll interval=%ss', POLL_INTERVAL)
-    q = get_queue()
-    state = load_state()
+class IndiceCarga:
+    """Número de entregas ativas (`storage.STATUS_ATIVOS`) por entregador, em memória.
 
-    try:
-        while True:
-            try:
-                msg = q.receive_message()
-            except Exception as e:
-                logger.error('erro ao receber mensagem da fila: %s', e)
-                time.sleep(POLL_INTERVAL)
-                continue
-
-            if not msg:
-                time.sleep(POLL_INTERVAL)
-                continue
-
-            delivery = msg.get('entrega') or msg.get('delivery')
-            receipt = msg.get('ReceiptHandle') or msg.get('receipt')
-            if not delivery:
-                logger.warning('mensagem sem payload válido: %s', msg)
-                continue
-
-            delivery_id = delivery.get('id')
-            logger.info('Recebida mensagem para entrega id=%s', delivery_id)
-
-            drivers = listar_entregadores()
-            if not drivers:
-                logger.warning('Nenhum entregador cadastrado. Re-enfileirando a entrega %s', delivery_id)
-                try:
-                    q.send_message(delivery_id)
-                except Exception as e:
-                    logger.error('falha ao reenfileirar: %s', e)
-                time.sleep(POLL_INTERVAL)
-                continue
+    Carregado com uma única consulta (`listar_entregas_ativas`) e mantido pelas
+    notificações de `atribuir_entrega`/`atualizar_status_entrega` deste processo
+    (`storage.registrar_ouvinte`). Coletas e entregas confirmadas pela API
+    acontecem em outro processo, por isso o índice é reconciliado com o banco a
+    cada `ttl` segundos.
 
-            driver = selecionar_entregador_round_robin(drivers, state)
-            if not driver:
-                logger.error('falha ao selecionar entregador para entrega %s', delivery_id)
-                time.sleep(POLL_INTERVAL)
-                continue
+    Um heap (carga, sequência, id) com invalidação preguiçosa dá o entregador
+    menos carregado em O(log n); entre cargas iguais vence quem está há mais
+    tempo sem mudar, o que reparte os empates em rodízio.
+    """
 
-            try:
-                assigned = atribuir_entrega(delivery_id, driver.get('id'))
-                if not assigned:
-                    logger.error('falha ao atribuir entrega %s ao entregador %s', delivery_id, driver.get('id'))
-                    # opcional: reenfileirar
+    def __init__(self, ttl=LOAD_RESYNC, carregar=None):
+        self.ttl = ttl
+        self._carregar = carregar or listar_entregas_ativas
+        self._lock = threading.Lock()
+        self._carga = {}
+        self._ativas = {}
+        self._entregadores = {}
+        self._heap = []
+        self._seq = itertools.count()
+        self._roster = None
+        self._expira_em = 0.0
+        storage.registrar_ouvinte(self.ao_alterar)
+
+    def _empurrar(self, driver_id):
+        heapq.heappush(self._heap, (self._carga[driver_id], next(self._seq), driver_id))
+        if len(self._heap) > 2 * len(self._carga) + 64:
+            self._reconstruir_heap()
+
+    def _reconstruir_heap(self):
+        self._heap = [(c, next(self._seq), d) for d, c in self._carga.items()]
+        heapq.heapify(self._heap)
+
+    def _mover(self, delivery_id, driver_id):
+        anterior = self._ativas.get(delivery_id)
+        if anterior == driver_id:
+            return
+        if anterior is not None:
+            del self._ativas[delivery_id]
+            if anterior in self._carga:
+                self._carga[anterior] -= 1
+                self._empurrar(anterior)
+        if driver_id is not None:
+            self._ativas[delivery_id] = driver_id
+            if driver_id in self._carga:
+                self._carga[driver_id] += 1
+                self._empurrar(driver_id)
+
+    def sincronizar(self, drivers):
+        """Inclui entregadores novos do roster e recarrega do banco quando o TTL expira."""
+        if drivers is self._roster and time.monotonic() < self._expira_em:
+            return
+        with self._lock:
+            if time.monotonic() >= self._expira_em:
+                ativas = {int(e): int(d) for e, d in self._carregar()}
+                self._entregadores = {d['id']: d for d in drivers}
+                self._ativas = ativas
+                self._carga = dict.fromkeys(self._entregadores, 0)
+                for driver_id in ativas.values():
+                    if driver_id in self._carga:
+                        self._carga[driver_id] += 1
+                self._reconstruir_heap()
+                self._expira_em = time.monotonic() + self.ttl
+            elif drivers is not self._roster:
+                for d in drivers:
+                    if d['id'] not in self._entregadores:
+                        self._entregadores[d['id']] = d
+                        self._carga[d['id']] = sum(1 for x in self._ativas.values() if x == d['id'])
+                        self._empurrar(d['id'])
+            self._roster = drivers
+
+    def reservar(self, delivery_id, limite=None):
+        """Conta a entrega para o entregador menos carregado e o retorna.
+
+        Retorna None se não houver entregador com carga abaixo de `limite`.
+        """
+        with self._lock:
+            while self._heap:
+                carga, _, driver_id = self._heap[0]
+                if self._carga.get(driver_id) != carga:
+                    heapq.heappop(self._heap)
+                    continue
+                if limite is not None and carga >= limite:
+                    return None
+                self._mover(int(delivery_id), driver_id)
+                return self._entregadores[driver_id]
+            return None
+
+    def liberar(self, delivery_id, driver_id):
+        """Desfaz `reservar` quando a atribuição não aconteceu.
+
+        Se nesse meio-tempo a entrega foi atribuída a outro entregador (ex.: pela
+        API neste processo), a contagem dele é mantida.
+        """
+        with self._lock:
+            if self._ativas.get(int(delivery_id)) == driver_id:
+                self._mover(int(delivery_id), None)
+
+    def ao_alterar(self, entrega):
+        delivery_id = int(entrega['id'])
+        with self._lock:
+            if entrega.get('status') in storage.STATUS_ATIVOS:
+                driver_id = entrega.get('id_entregador')
+                self._mover(delivery_id, int(driver_id) if driver_id is not None else self._ativas.get(delivery_id))
+            else:
+                self._mover(delivery_id, None)
+
+    def carga(self, driver_id):
+        return self._carga.get(driver_id, 0)
+
+    def fechar(self):
+        storage.remover_ouvinte(self.ao_alterar)
+
+
+class EstrategiaRoundRobin:
+    """Rodízio sobre o roster, com o cursor em `state` (ver `selecionar_entregador_round_robin`)."""
+
+    def __init__(self, state):
+        self.state = state
+
+    def escolher(self, drivers, delivery_id):
+        return selecionar_entregador_round_robin(drivers, self.state)
+
+    def cancelar(self, delivery_id, driver):
+        pass
+
+    def fechar(self):
+        fechar = getattr(self.state, 'fechar', None)
+        if fechar:
+            fechar()
+
+
+class EstrategiaMenosCarregado:
+    """Entregador com menos entregas ativas; com `capacidade`, nunca acima dela."""
+
+    def __init__(self, indice=None, capacidade=None):
+        self.indice = indice or IndiceCarga()
+        self.capacidade = capacidade
+
+    def escolher(self, drivers, delivery_id):
+        self.indice.sincronizar(drivers)
+        return self.indice.reservar(delivery_id, self.capacidade)
+
+    def cancelar(self, delivery_id, driver):
+        self.indice.liberar(delivery_id, driver['id'])
+
+    def fechar(self):
+        self.indice.fechar()
+
+
+class EstrategiaCapacidade(EstrategiaMenosCarregado):
+    """Menos carregado, limitado a `capacidade` entregas ativas por entregador.
+
+    Sem vaga, `processar_lote` adia a própria mensagem com `change_visibility`
+    pelo backoff de `_atraso_backoff`, sem contar como erro nem ir para a DLQ.
+    """
+
+    def __init__(self, indice=None, capacidade=DRIVER_CAPACITY):
+        super().__init__(indice, capacidade)
+
+
+def criar_estrategia(nome=None, state=None):
+    nome = nome or DISPATCH_STRATEGY
+    if nome == 'round_robin':
+        return EstrategiaRoundRobin(state if state is not None else carregar_estado())
+    if nome == 'menos_carregado':
+        return EstrategiaMenosCarregado()
+    if nome == 'capacidade':
+        return EstrategiaCapacidade()
+    raise ValueError('estratégia de dispatch desconhecida: %s' % nome)
+
+
+def _atraso_backoff(tentativas):
+    """Segundos até a próxima entrega de uma mensagem recebida `tentativas` vezes (metade fixa, metade jitter)."""
+    atraso = min(RETRY_MAX_SECONDS, RETRY_BASE_SECONDS * 2 ** max(0, int(tentativas) - 1))
+    return atraso / 2 + random.uniform(0, atraso / 2)
+
+
+def processar_lote(q, msgs, state, entregadores=None, parar=None):
+    """Atribui as entregas de um lote de mensagens e faz ack/adiamento/DLQ em lote.
+
+    `state` é uma estratégia (`escolher`/`cancelar`) ou, como antes, o cursor do
+    round-robin. Sem entregador disponível ou com erro, a própria mensagem fica
+    invisível por `_atraso_backoff` (nada é reenviado); com erro na tentativa
+    `MAX_ATTEMPTS` ela vai para a dead-letter queue. Sem nenhum entregador
+    cadastrado espera `POLL_INTERVAL` em `parar` (threading.Event), que
+    interrompe a espera no encerramento. Retorna o número de entregas atribuídas.
+    """
+    ack = []
+    adiar = []
+    dlq = []
+    atribuidas = 0
+    estrategia = state if hasattr(state, 'escolher') else EstrategiaRoundRobin(state)
+
+    drivers = (entregadores if entregadores is not None else roster).obter()
+    for msg in msgs:
+        delivery = msg.get('entrega') or msg.get('delivery')
+        receipt = msg.get('ReceiptHandle') or msg.get('receipt')
+        if not delivery:
+            logger.warning('mensagem sem payload válido: %s', msg)
+            continue
+
+        delivery_id = delivery.get('id')
+        tentativas = int(msg.get('tentativas') or 1)
+        logger.info('Recebida mensagem para entrega id=%s (tentativa %s)', delivery_id, tentativas)
+
+        if not drivers:
+            # falta de entregador não é falha da mensagem: adia, mas nunca manda para a DLQ
+            logger.warning('Nenhum entregador cadastrado. Adiando a entrega %s', delivery_id)
+            metricas.REENFILEIRADAS.inc(motivo='sem_entregadores')
+            adiar.append((receipt, _atraso_backoff(tentativas)))
+            continue
+
+        driver = estrategia.escolher(drivers, delivery_id)
+        if not driver:
+            logger.info('nenhum entregador com capacidade livre para a entrega %s', delivery_id)
+            metricas.REENFILEIRADAS.inc(motivo='sem_capacidade')
+            adiar.append((receipt, _atraso_backoff(tentativas)))
+            continue
+
+        assigned = None
+        try:
+            assigned = atribuir_entrega(delivery_id, driver.get('id'))
+            if not assigned:
+                # entrega inexistente: reenfileirar só geraria um loop; descartar a mensagem
+                logger.error('entrega %s não encontrada; descartando mensagem', delivery_id)
+            else:
+                logger.info('Entrega %s atribuída ao entregador %s (%s)', delivery_id, driver.get('id'), driver.get('name'))
+                metricas.registrar_atribuicao('worker', msg.get('enfileirado_em'))
+                atribuidas += 1
+        except EntregaJaAtribuida:
+            # mensagem duplicada ou corrida com /driver/<id>/next: só fazer ack
+            logger.info('Entrega %s já atribuída; descartando duplicata', delivery_id)
+        except Exception as e:
+            logger.exception('erro ao atribuir entrega %s (tentativa %s): %s', delivery_id, tentativas, e)
+            estrategia.cancelar(delivery_id, driver)
+            if tentativas >= MAX_ATTEMPTS:
+                dlq.append((msg, {'motivo': 'erro', 'erro': str(e)}))
+            else:
+                metricas.REENFILEIRADAS.inc(motivo='erro')
+                adiar.append((receipt, _atraso_backoff(tentativas)))
+            continue
+        if not assigned:
+            estrategia.cancelar(delivery_id, driver)
+        if receipt:
+            ack.append(receipt)
+
+    if dlq:
+        try:
+            res = q.move_to_dlq(dlq)
+        except Exception as e:
+            logger.error('falha ao mover mensagens para a DLQ: %s', e)
+            res = {'Successful': [], 'Failed': [{'ReceiptHandle': m.get('ReceiptHandle'), 'erro': str(e)} for m, _ in dlq]}
+        if res.get('Successful'):
+            metricas.MENSAGENS_DLQ.inc(len(res['Successful']), motivo='erro')
+        for falha in res.get('Failed', []):
+            # sem DLQ a mensagem continua na fila, no maior intervalo de backoff
+            logger.error('falha ao mover mensagem %s para a DLQ: %s', falha.get('ReceiptHandle'), falha.get('erro'))
+            adiar.append((falha.get('ReceiptHandle'), RETRY_MAX_SECONDS))
+
+    adiar = [(r, segundos) for r, segundos in adiar if r]
+    if adiar:
+        try:
+            res = q.change_visibility(adiar)
+            for falha in res.get('Failed', []):
+                logger.warning('falha ao adiar mensagem %s: %s', falha.get('ReceiptHandle'), falha.get('erro'))
+        except Exception as e:
+            # a mensagem volta quando o lease expirar
+            logger.warning('falha ao adiar mensagens do lote: %s', e)
+
+    if ack:
+        try:
+            res = q.delete_messages(ack)
+            for falha in res.get('Failed', []):
+                logger.warning('falha ao deletar mensagem %s: %s', falha.get('ReceiptHandle'), falha.get('erro'))
+        except Exception as e:
+            logger.warning('falha ao deletar mensagens do lote: %s', e)
+
+    if not drivers and parar is not None:
+        parar.wait(POLL_INTERVAL)
+    return atribuidas
+
+
+def _criar_app():
+    """App Flask usado apenas para fornecer app context ao storage SQLAlchemy."""
+    # o relay do outbox roda na API (ou em processo próprio), não no worker
+    os.environ.setdefault('OUTBOX_RELAY', 'off')
+    from app import create_app
+    return create_app()
+
+
+class PoolWorkers:
+    """N threads consumidoras compartilhando um único cliente de fila.
+
+    Antes de cada receive a thread reserva vagas no conjunto de mensagens em
+    voo, limitado a `max_em_voo`. Ao receber SIGTERM/SIGINT as threads param de
+    buscar mensagens novas, terminam os lotes em andamento (ack dos leases) e
+    saem.
+    """
+
+    def __init__(self, q, state, concurrency, batch_size=BATCH_SIZE, max_em_voo=None, app=None, parar=None):
+        self.q = q
+        self.state = state
+        self.concurrency = max(1, int(concurrency))
+        self.batch_size = max(1, int(batch_size))
+        self.max_em_voo = max_em_voo or self.concurrency * self.batch_size
+        self.app = app
+        self.em_voo = set()
+        self.atribuidas = 0
+        self.parar = parar or threading.Event()
+        self._cond = threading.Condition()
+        self._reservadas = 0
+        self._threads = []
+
+    def _reservar(self):
+        with self._cond:
+            while not self.parar.is_set():
+                livres = self.max_em_voo - self._reservadas
+                if livres > 0:
+                    n = min(self.batch_size, livres)
+                    self._reservadas += n
+                    return n
+                self._cond.wait(POLL_INTERVAL)
+        return 0
+
+    def _liberar(self, n):
+        with self._cond:
+            self._reservadas -= n
+            self._cond.notify_all()
+
+    def _consumir(self):
+        with (self.app.app_context() if self.app else nullcontext()):
+            while not self.parar.is_set():
+                n = self._reservar()
+                if not n:
+                    break
+                try:
                     try:
-                        q.send_message(delivery_id)
+                        msgs = self.q.receive_messages(n, hidratar='nunca')
                     except Exception as e:
-                        logger.error('falha ao reenfileirar: %s', e)
-                    # Mesmo se reenfileirar, deletar a mensagem atual (ack) para evitar loop
-                    try:
-                        if receipt:
-                            q.delete_message(receipt)
-                    except Exception:
-                        logger.warning('falha ao deletar mensagem original')
-                else:
-                    logger.info('Entrega %s atribuída ao entregador %s (%s)', delivery_id, driver.get('id'), driver.get('name'))
-                    # ack/delete da mensagem processada
+                        logger.error('erro ao receber mensagem da fila: %s', e)
+                        self.parar.wait(POLL_INTERVAL)
+                        continue
+                    if not msgs:
+                        self.parar.wait(POLL_INTERVAL)
+                        continue
+                    receipts = [m.get('ReceiptHandle') for m in msgs]
+                    with self._cond:
+                        self.em_voo.update(receipts)
                     try:
-                        if receipt:
-                            q.delete_message(receipt)
-                    except Exception:
-                        logger.warning('falha ao deletar mensagem após atribuição')
-            except Exception as e:
-                logger.exception('erro ao atribuir entrega: %s', e)
-                try:
-                    q.send_message(delivery_id)
-                except Exception:
-                    logger.error('falha ao reenfileirar depois de erro')
-                # após reenfileirar, tentar deletar a mensagem original para não duplicar
+                        feitas = processar_lote(self.q, msgs, self.state, parar=self.parar)
+                    finally:
+                        with self._cond:
+                            self.em_voo.difference_update(receipts)
+                        # o app context dura o loop todo: sessão nova a cada lote
+                        storage.encerrar_sessao()
+                    with self._cond:
+                        self.atribuidas += feitas
+                finally:
+                    self._liberar(n)
+
+    def iniciar(self):
+        for i in range(self.concurrency):
+            t = threading.Thread(target=self._consumir, name='consumidor-%d' % i, daemon=True)
+            t.start()
+            self._threads.append(t)
+
+    def encerrar(self, timeout=None):
+        self.parar.set()
+        with self._cond:
+            self._cond.notify_all()
+        for t in self._threads:
+            t.join(timeout)
+
+    def vivo(self):
+        return any(t.is_alive() for t in self._threads)
+
+
+def _parar_com_sinais(parar, em_voo):
+    """SIGTERM/SIGINT acionam `parar`: o lote em andamento termina antes de sair (só na thread principal)."""
+    def _sinal(signum, frame):
+        logger.info('Sinal %s recebido; finalizando %s mensagens em voo', signum, em_voo())
+        parar.set()
+
+    if threading.current_thread() is threading.main_thread():
+        signal.signal(signal.SIGTERM, _sinal)
+        signal.signal(signal.SIGINT, _sinal)
+
+
+def executar_pool(concurrency, app=None, parar=None):
+    """Roda o pool até SIGTERM/SIGINT ou até `parar` (threading.Event) ser acionado."""
+    logger.info('Worker iniciado com %s threads. Poll interval=%ss, lote=%s', concurrency, POLL_INTERVAL, BATCH_SIZE)
+    state = criar_estrategia()
+    pool = PoolWorkers(get_queue(), state, concurrency, app=app or _criar_app(), parar=parar)
+
+    _parar_com_sinais(pool.parar, lambda: len(pool.em_voo))
+
+    inicio = time.monotonic()
+    ultimo, ultimo_total = inicio, 0
+    pool.iniciar()
+    while not pool.parar.wait(REPORT_INTERVAL):
+        agora = time.monotonic()
+        total = pool.atribuidas
+        taxa = (total - ultimo_total) / (agora - ultimo)
+        metricas.ATRIBUICOES_POR_SEGUNDO.set(taxa)
+        logger.info('Throughput: %.1f atribuições/s (total=%s, em voo=%s)', taxa, total, len(pool.em_voo))
+        ultimo, ultimo_total = agora, total
+    pool.encerrar()
+    state.fechar()
+    duracao = time.monotonic() - inicio
+    logger.info('Worker encerrado: %s atribuições em %.1fs (%.1f/s)', pool.atribuidas, duracao, pool.atribuidas / max(duracao, 1e-9))
+    return pool.atribuidas
+
+
+def executar(concurrency=CONCURRENCY, parar=None):
+    """Loop do worker até SIGTERM/SIGINT ou até `parar` (threading.Event), ex.: quando embutido num benchmark.
+
+    O lote em andamento termina (ack/adiamento) antes de sair.
+    """
+    if metricas.WORKER_METRICS_PORT:
+        metricas.servir(metricas.WORKER_METRICS_PORT, metricas.WORKER_METRICS_HOST)
+    if int(concurrency) > 1:
+        return executar_pool(concurrency, parar=parar)
+    parar = parar or threading.Event()
+    logger.info('Worker iniciado. Poll interval=%ss, lote=%s', POLL_INTERVAL, BATCH_SIZE)
+    q = get_queue()
+    state = criar_estrategia()
+    ultimo, ultimo_total, total = time.monotonic(), 0, 0
+    em_voo = []
+    _parar_com_sinais(parar, lambda: len(em_voo))
+
+    try:
+        with _criar_app().app_context():
+            while not parar.is_set():
                 try:
-                    if receipt:
-                        q.delete_message(receipt)
-                except Exception:
-                    logger.warning('falha ao deletar mensagem original depois de erro')
+                    msgs = q.receive_messages(BATCH_SIZE, hidratar='nunca')
+                except Exception as e:
+                    logger.error('erro ao receber mensagem da fila: %s', e)
+                    parar.wait(POLL_INTERVAL)
+                    continue
 
-            # pequeno delay antes de continuar
-            time.sleep(0.1)
+                if not msgs:
+                    # só a fila vazia espera; depois de um lote volta direto ao receive
+                    parar.wait(POLL_INTERVAL)
+                    continue
 
-    except KeyboardInterrupt:
-        logger.info('Worker interrompido pelo usuário')
+                em_voo[:] = msgs
+                try:
+                    total += processar_lote(q, msgs, state, parar=parar)
+                finally:
+                    em_voo.clear()
+                    storage.encerrar_sessao()
+                agora = time.monotonic()
+                if agora - ultimo >= REPORT_INTERVAL:
+                    metricas.ATRIBUICOES_POR_SEGUNDO.set((total - ultimo_total) / (agora - ultimo))
+                    ultimo, ultimo_total = agora, total
+    finally:
+        state.fechar()
+    return total
 
 
 if __name__ == '__main__':
-    executar()
+    parser = argparse.ArgumentParser(description='Worker que consome a fila e atribui entregas')
+    parser.add_argument('--concurrency', type=int, default=CONCURRENCY, help='número de threads consumidoras (padrão: WORKER_CONCURRENCY ou 1)')
+    args = parser.parse_args()
+    executar(args.concurrency)